@@ -0,0 +1,222 @@
+"""
+Control de admisión para los endpoints que generan con el LLM.
+
+Cada endpoint tiene un tope de generaciones simultáneas y una cola de espera
+acotada, y cada cliente (API key o IP) una cuota de token bucket. Cuando no
+hay lugar se responde enseguida: 429 si el cliente agotó su cuota, 503 si el
+endpoint está saturado, ambos con ``Retry-After``. Con
+``PEDAGOGY_RADAR_ADMISSION_MODE=fallback`` el endpoint saturado responde al
+instante con su contenido por defecto en vez de encolar.
+
+Los topes se ajustan por endpoint con
+``PEDAGOGY_RADAR_ADMISSION_<ENDPOINT>_CONCURRENCY`` y ``..._QUEUE`` (p. ej.
+``PEDAGOGY_RADAR_ADMISSION_SUGGEST_RUBRIC_CONCURRENCY=2``); 0 desactiva el tope.
+"""
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+import metrics
+from metrics import ADMISSION_REJECTIONS, ADMISSION_WAIT_SECONDS
+
+ADMISSION_CONCURRENCY = int(os.getenv("PEDAGOGY_RADAR_ADMISSION_CONCURRENCY", "4"))
+ADMISSION_QUEUE = int(os.getenv("PEDAGOGY_RADAR_ADMISSION_QUEUE", "16"))
+ADMISSION_WAIT_S = float(os.getenv("PEDAGOGY_RADAR_ADMISSION_WAIT_S", "15"))
+# queue: espera en la cola; reject: 503 sin esperar; fallback: contenido por defecto sin esperar
+ADMISSION_MODE = os.getenv("PEDAGOGY_RADAR_ADMISSION_MODE", "queue")
+ADMISSION_MODES = ("queue", "reject", "fallback")
+# Peticiones por segundo por cliente (0 = sin cuota) y ráfaga máxima
+QUOTA_RATE = float(os.getenv("PEDAGOGY_RADAR_QUOTA_RATE", "0"))
+QUOTA_BURST = float(os.getenv("PEDAGOGY_RADAR_QUOTA_BURST", "10"))
+QUOTA_MAX_CLIENTS = int(os.getenv("PEDAGOGY_RADAR_QUOTA_MAX_CLIENTS", "10000"))
+API_KEY_HEADER = os.getenv("PEDAGOGY_RADAR_API_KEY_HEADER", "X-API-Key")
+
+
+class Rejected(Exception):
+    def __init__(self, status, reason, retry_after):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Gate:
+    """
+    Tope de concurrencia con cola FIFO acotada para un endpoint.
+
+    Vive en el event loop del servidor, así que no necesita locks: al
+    liberarse un lugar se le pasa directamente al primero de la cola. El
+    tiempo de servicio (media móvil) sirve para estimar el ``Retry-After``.
+    """
+
+    def __init__(self, name, limit=ADMISSION_CONCURRENCY, queue=ADMISSION_QUEUE, wait_s=ADMISSION_WAIT_S):
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.wait_s = wait_s
+        self.in_flight = 0
+        self.service_s = None
+        self._waiters = deque()
+
+    @property
+    def waiting(self):
+        return len(self._waiters)
+
+    def retry_after(self):
+        seconds = (self.service_s or 1.0) * (self.waiting + 1) / max(self.limit, 1)
+        return max(1, math.ceil(seconds))
+
+    async def acquire(self, mode=ADMISSION_MODE):
+        if not self.limit or (self.in_flight < self.limit and not self._waiters):
+            self.in_flight += 1
+            return
+        if mode != "queue":
+            raise Rejected(503, "shed" if mode == "fallback" else "saturated", self.retry_after())
+        if self.waiting >= self.queue:
+            raise Rejected(503, "queue_full", self.retry_after())
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(waiter, self.wait_s)
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # Ya se le había pasado el lugar: se pasa al siguiente
+                self.release()
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                raise Rejected(503, "timeout", self.retry_after())
+            raise
+        finally:
+            ADMISSION_WAIT_SECONDS.labels(endpoint=self.name).observe(time.perf_counter() - started)
+
+    def release(self, service_s=None):
+        if service_s is not None:
+            self.service_s = service_s if self.service_s is None else 0.8 * self.service_s + 0.2 * service_s
+        if not self.limit:
+            self.in_flight -= 1
+            return
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def stats(self):
+        return {"limit": self.limit, "queue": self.queue, "in_flight": self.in_flight, "waiting": self.waiting, "service_s": self.service_s}
+
+
+class Quotas:
+    """Token bucket por cliente; se recuerdan a lo sumo ``max_clients`` (LRU)."""
+
+    def __init__(self, rate=QUOTA_RATE, burst=QUOTA_BURST, max_clients=QUOTA_MAX_CLIENTS):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, client):
+        """0 si el cliente tiene cuota (y la consume), o los segundos hasta que vuelva a tener."""
+        if not self.rate:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            wait = 0 if tokens >= 1 else (1 - tokens) / self.rate
+            self._buckets[client] = (tokens - 1 if not wait else tokens, now)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+def _gate_setting(name, setting, default):
+    return int(os.getenv(f"PEDAGOGY_RADAR_ADMISSION_{name.upper().replace('-', '_')}_{setting}", str(default)))
+
+def endpoint_name(path):
+    """``/suggest-activity/stream`` -> ``suggest-activity-stream`` (igual que en las métricas)."""
+    return path.strip("/").replace("/", "-")
+
+_gates = {}
+
+def get_gate(name):
+    if name not in _gates:
+        _gates[name] = Gate(
+            name, _gate_setting(name, "CONCURRENCY", ADMISSION_CONCURRENCY), _gate_setting(name, "QUEUE", ADMISSION_QUEUE),
+        )
+    return _gates[name]
+
+quotas = Quotas()
+
+def stats():
+    return {name: gate.stats() for name, gate in sorted(_gates.items())}
+
+metrics.gauge(
+    "pedagogy_admission_in_flight", "Generaciones en curso por endpoint.", ("endpoint",),
+    lambda: {(name,): gate.in_flight for name, gate in _gates.items()},
+)
+metrics.gauge(
+    "pedagogy_admission_queue_depth", "Peticiones esperando en la cola de admisión por endpoint.", ("endpoint",),
+    lambda: {(name,): gate.waiting for name, gate in _gates.items()},
+)
+
+
+def client_id(scope):
+    """API key del header ``API_KEY_HEADER`` o, si no hay, la IP del cliente."""
+    header = API_KEY_HEADER.lower().encode("latin-1")
+    for key, value in scope.get("headers", ()):
+        if key == header and value:
+            return "key:" + value.decode("latin-1")
+    client = scope.get("client")
+    return "ip:" + (client[0] if client else "unknown")
+
+
+class AdmissionMiddleware:
+    """
+    Middleware ASGI que admite (o rechaza) las peticiones a ``paths``.
+
+    El lugar se libera cuando termina de enviarse la respuesta, así que las
+    respuestas en streaming lo ocupan mientras dura la generación.
+    ``fallback(name)`` devuelve la respuesta por defecto del endpoint (o
+    None) para el modo ``fallback``.
+    """
+
+    def __init__(self, app, paths=(), fallback=None, mode=ADMISSION_MODE):
+        if mode not in ADMISSION_MODES:
+            raise ValueError(f"Modo de admisión desconocido: {mode} (usa {', '.join(ADMISSION_MODES)})")
+        self.app = app
+        self.paths = frozenset(paths)
+        self.fallback = fallback
+        self.mode = mode
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            return await self.app(scope, receive, send)
+        from fastapi.responses import JSONResponse
+
+        name = endpoint_name(scope["path"])
+        gate = get_gate(name)
+        try:
+            wait = quotas.take(client_id(scope))
+            if wait:
+                raise Rejected(429, "quota", max(1, math.ceil(wait)))
+            await gate.acquire(self.mode)
+        except Rejected as e:
+            ADMISSION_REJECTIONS.labels(endpoint=name, reason=e.reason).inc()
+            response = self.fallback(name) if e.reason == "shed" and self.fallback else None
+            if response is None:
+                detail = "Cuota agotada para este cliente." if e.status == 429 else "El servicio está saturado, reintenta más tarde."
+                response = JSONResponse({"detail": detail}, status_code=e.status, headers={"Retry-After": str(e.retry_after)})
+            return await response(scope, receive, send)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            gate.release(time.perf_counter() - started)
@@ -0,0 +1,223 @@
+"""
+Alineación de objetivos con evidencias de evaluación, sin modelo generativo.
+
+Cada evidencia del catálogo se representa con su nombre y el texto de las
+estrategias que la usan (descripción, niveles de Bloom, métricas), así un
+objetivo que pide "Analizar" se acerca a las evidencias de las estrategias
+de nivel Analyze. Los vectores del catálogo (TF-IDF, o embeddings con
+``PEDAGOGY_RADAR_EMBEDDING_MODEL``) se calculan una vez por versión del
+catálogo; por petición solo se vectorizan los objetivos, actividades y
+evidencias propias, y la matriz objetivo × evidencia sale de un único
+producto de matrices aunque lleguen muchos cursos juntos.
+"""
+import math
+import os
+import threading
+from collections import Counter
+from functools import lru_cache
+
+import numpy as np
+
+import metrics
+from bloom import BLOOM_LEVELS, BLOOM_VERB_LEVELS, BLOOM_VERBS
+from core import get_catalog
+from recommend import _embedder, strategy_text, tokenize
+
+ALIGNMENT_METHOD = os.getenv("PEDAGOGY_RADAR_ALIGNMENT_METHOD", "tfidf")
+METHODS = ("tfidf", "embeddings")
+# Similitud mínima para considerar que una evidencia cubre un objetivo
+ALIGNMENT_MIN_SCORE = float(os.getenv("PEDAGOGY_RADAR_ALIGNMENT_MIN_SCORE", "0.05"))
+# Peso del contexto de las actividades del curso en el vector de cada objetivo
+ACTIVITY_WEIGHT = 0.5
+# El nombre de la evidencia se repite para que pese frente al texto de las estrategias
+LABEL_WEIGHT = 3
+
+_VERB_STEMS = {tokenize(verb)[0]: verb for verb in BLOOM_VERBS}
+# Niveles que los verbos sugeridos permiten cubrir, en el orden de la taxonomía
+VERB_LEVELS = tuple(level for level in BLOOM_LEVELS if level in BLOOM_VERB_LEVELS.values())
+
+
+@lru_cache(maxsize=8192)
+def _terms(text):
+    # Los cursos de un batch suelen repetir actividades y evidencias: cada texto se tokeniza una vez
+    return tuple(Counter(tokenize(text)).items())
+
+def evidence_label(evidence):
+    return str(evidence).replace("_", " ")
+
+def bloom_verbs(text):
+    """Verbos de ``BLOOM_VERBS`` presentes en ``text`` (con stemming, sin tildes)."""
+    found = []
+    for term, _ in _terms(text):
+        verb = _VERB_STEMS.get(term)
+        if verb and verb not in found:
+            found.append(verb)
+    return found
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class EvidenceIndex:
+    """Matriz de evidencias del catálogo (una fila normalizada por evidencia)."""
+
+    def __init__(self, snapshot, method=ALIGNMENT_METHOD):
+        if method not in METHODS:
+            raise ValueError(f"Método desconocido: {method} (usa {', '.join(METHODS)})")
+        self.version = snapshot.version
+        self.method = method
+        documents = {}
+        for strategy in snapshot.strategies:
+            text = strategy_text(strategy)
+            for evidence in strategy.evidence:
+                documents.setdefault(str(evidence), []).append(text)
+        self.evidences = sorted(documents)
+        texts = [
+            "\n".join([evidence_label(evidence)] * LABEL_WEIGHT + documents[evidence])
+            for evidence in self.evidences
+        ]
+        if method == "tfidf":
+            counts = [Counter(tokenize(text)) for text in texts]
+            df = Counter(term for c in counts for term in c)
+            self.vocabulary = {term: i for i, term in enumerate(sorted(df))}
+            total = len(counts)
+            self.idf = np.array(
+                [math.log((1 + total) / (1 + df[term])) + 1 for term in sorted(df)], dtype=np.float32,
+            )
+            self.dim = len(self.vocabulary)
+        else:
+            self.dim = _embedder().get_sentence_embedding_dimension()
+        self.matrix = self.vectorize(texts)
+
+    def vectorize(self, texts):
+        """Filas normalizadas para ``texts`` en el espacio del índice."""
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        if self.method == "embeddings":
+            return np.asarray(_embedder().encode(list(texts), normalize_embeddings=True), dtype=np.float32)
+        rows, cols, values = [], [], []
+        for row, text in enumerate(texts):
+            for term, tf in _terms(text):
+                col = self.vocabulary.get(term)
+                if col is not None:
+                    rows.append(row)
+                    cols.append(col)
+                    values.append(1 + math.log(tf))
+        matrix = np.zeros((len(texts), len(self.vocabulary)), dtype=np.float32)
+        matrix[rows, cols] = values
+        return _normalize(matrix * self.idf)
+
+    def align(self, courses, top_k=3):
+        """
+        Evidencias sugeridas y reporte de cobertura para cada curso.
+
+        ``courses`` es una lista de dicts con ``objectives``, ``activities``
+        y ``evidences`` (las que el curso ya usa).
+        """
+        def flatten(field):
+            texts = [text for course in courses for text in course[field]]
+            owner = np.repeat(np.arange(len(courses)), [len(course[field]) for course in courses])
+            return self.vectorize(texts), owner, np.cumsum([0] + [len(course[field]) for course in courses])
+
+        queries, objective_owner, objective_bounds = flatten("objectives")
+        activities, activity_owner, _ = flatten("activities")
+        current, _, current_bounds = flatten("evidences")
+        # Cada objetivo se lee en el contexto de las actividades de su curso
+        context = np.zeros((len(courses), self.dim), dtype=np.float32)
+        np.add.at(context, activity_owner, activities)
+        queries = _normalize(queries + ACTIVITY_WEIGHT * _normalize(context)[objective_owner])
+        with metrics.stage("alignment_matrix"):
+            scores = queries @ self.matrix.T
+            ranked = np.argsort(-scores, axis=1, kind="stable")[:, :top_k]
+            # float64 antes de redondear: en float32 round(4) deja colas como 0.35019999742507935
+            top_scores = np.take_along_axis(scores, ranked, axis=1).astype(np.float64).round(4).tolist()
+        ranked = ranked.tolist()
+        results = []
+        for c, course in enumerate(courses):
+            rows = slice(objective_bounds[c], objective_bounds[c + 1])
+            own = current[current_bounds[c]:current_bounds[c + 1]]
+            current_scores = (queries[rows] @ own.T).astype(np.float64).round(4).tolist()
+            results.append(self._course(course, ranked[rows], top_scores[rows], current_scores, top_k))
+        return results
+
+    def _course(self, course, ranked, scores, current_scores, top_k):
+        alignment = []
+        without_verb = []
+        without_evidence = []
+        levels = {level: [] for level in VERB_LEVELS}
+        suggested = Counter()
+        for i, objective in enumerate(course["objectives"]):
+            evidences = [
+                {"evidence": self.evidences[j], "score": score, "source": "catalog"}
+                for j, score in zip(ranked[i], scores[i])
+                if score >= ALIGNMENT_MIN_SCORE
+            ]
+            evidences.extend(
+                {"evidence": evidence, "score": score, "source": "request"}
+                for evidence, score in zip(course["evidences"], current_scores[i])
+                if score >= ALIGNMENT_MIN_SCORE
+            )
+            evidences.sort(key=lambda e: -e["score"])
+            for evidence in evidences:
+                if evidence["source"] == "catalog":
+                    suggested[evidence["evidence"]] += evidence["score"]
+            verbs = bloom_verbs(objective)
+            for verb in verbs:
+                levels[BLOOM_VERB_LEVELS[verb]].append(i)
+            if not verbs:
+                without_verb.append(objective)
+            if not any(e["source"] == "request" for e in evidences):
+                without_evidence.append(objective)
+            alignment.append({"objective": objective, "bloom_verbs": verbs, "evidences": evidences})
+        coverage = {
+            "bloom_levels": {level: objectives for level, objectives in levels.items() if objectives},
+            "missing_levels": [level for level, objectives in levels.items() if not objectives],
+            "objectives_without_verb": without_verb,
+            "objectives_without_evidence": without_evidence,
+        }
+        suggested_evidences = [evidence for evidence, _ in suggested.most_common(max(top_k, len(course["objectives"])))]
+        return {
+            "suggested_evidences": suggested_evidences,
+            "reasoning": _reasoning(alignment, coverage),
+            "alignment": alignment,
+            "coverage": coverage,
+        }
+
+
+def _reasoning(alignment, coverage):
+    lines = []
+    for entry in alignment:
+        if entry["evidences"]:
+            best = entry["evidences"][0]
+            lines.append(f"El objetivo '{entry['objective']}' se alinea mejor con {evidence_label(best['evidence'])} ({best['score']:.2f}).")
+        else:
+            lines.append(f"El objetivo '{entry['objective']}' no se parece a ninguna evidencia conocida.")
+    if coverage["objectives_without_evidence"]:
+        lines.append(f"Sin evidencia actual que los cubra: {len(coverage['objectives_without_evidence'])} objetivo(s).")
+    if coverage["objectives_without_verb"]:
+        lines.append(f"Sin verbo observable de Bloom: {len(coverage['objectives_without_verb'])} objetivo(s).")
+    if coverage["missing_levels"]:
+        lines.append(f"Niveles de Bloom sin objetivos: {', '.join(coverage['missing_levels'])}.")
+    return " ".join(lines)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_evidence_index():
+    """Índice de evidencias del catálogo actual; se reconstruye si cambió la versión."""
+    global _index
+    snapshot = get_catalog().snapshot()
+    index = _index
+    if index is None or index.version != snapshot.version:
+        with _index_lock:
+            index = _index
+            if index is None or index.version != snapshot.version:
+                with metrics.stage("alignment_index"):
+                    index = _index = EvidenceIndex(snapshot)
+    return index
+
+def align_evidences(courses, top_k=3):
+    return get_evidence_index().align(courses, top_k)
@@ -1,10 +1,30 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from core import load_strategies, render_strategy
+import asyncio
+import json
+import os
+import threading
+import time
+from fastapi import Body, FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from typing import Optional
+from pydantic import BaseModel, Field, ValidationError
+from admission import AdmissionMiddleware, stats as admission_stats
+from core import expand_manifest, get_catalog, preload_templates, render_batch, render_cached, render_key
 from fastapi.middleware.cors import CORSMiddleware
+from jobs import JOBS_POLL_S, get_job_queue
+from llm_parsers import useful_activity, useful_objectives
+from metrics import HARDCODED_DEFAULTS, HTTP_REQUEST_SECONDS, SUGGEST_SECTIONS, render_prometheus
+from recommend import MAX_TOP_K, RECOMMEND_METHOD, get_index, recommend_strategies
 
 app = FastAPI(title="Pedagogy Radar API")
 
+# Endpoints que generan con el LLM: pasan por el control de admisión
+LLM_ENDPOINTS = (
+    "/suggest-objectives", "/suggest-activity", "/suggest-activity/stream", "/suggest-rubric",
+    "/suggest-rubric/stream", "/suggest-prework-resources", "/suggest",
+)
+# Se agrega antes que CORS para que los 429/503 también lleven sus headers
+app.add_middleware(AdmissionMiddleware, paths=LLM_ENDPOINTS, fallback=lambda name: _shed_response(name))
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -13,22 +33,66 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    started = time.perf_counter()
+    response = await call_next(request)
+    # Se usa la plantilla de la ruta (no la URL) para no disparar la cardinalidad
+    route = request.scope.get("route")
+    endpoint = route.path if route is not None else "unmatched"
+    HTTP_REQUEST_SECONDS.labels(
+        method=request.method, endpoint=endpoint, status=response.status_code
+    ).observe(time.perf_counter() - started)
+    return response
+
+@app.on_event("startup")
+def warm_up():
+    # Catálogo y plantillas listos antes de la primera petición
+    get_catalog().snapshot()
+    preload_templates()
+    # El índice de recomendación recorre todo el catálogo: se arma en segundo plano
+    threading.Thread(target=get_index, name="recommend-index", daemon=True).start()
+    threading.Thread(target=_build_evidence_index, name="evidence-index", daemon=True).start()
+    if os.getenv("LLM_PRELOAD") == "1":
+        from llm_utils import warm_up as warm_up_llm
+        warm_up_llm()
+
+def _build_evidence_index():
+    try:
+        from alignment import get_evidence_index
+        get_evidence_index()
+    except Exception as e:
+        print(f"[INFO] No se pudo precalcular el índice de evidencias: {e}")
+
+@app.on_event("shutdown")
+async def close_llm_clients():
+    from llm_utils import aclose_backends
+    await aclose_backends()
+
 class LearningObjective(BaseModel):
     text: str
     taxonomy: str
 
-class ScaffoldRequest(BaseModel):
+class ActivityBrief(BaseModel):
     carrera: str = ""
     semestre: str = ""
     materia: str = ""
     tema: str = ""
-    strategy_id: str
     activity_title: str
     activity_description: str
     learning_objectives: list[LearningObjective]
     prework_instructions: str = ""
     in_class_activity: str = ""
 
+class ScaffoldRequest(ActivityBrief):
+    strategy_id: str
+
+class ScaffoldBatchRequest(BaseModel):
+    # Lista explícita de peticiones y/o una actividad × varias estrategias
+    requests: list[ScaffoldRequest] = []
+    activity: Optional[ActivityBrief] = None
+    strategy_ids: list[str] = []
+
 class SuggestRubricRequest(BaseModel):
     activity_title: str
     activity_description: str
@@ -40,14 +104,50 @@ class SuggestRubricResponse(BaseModel):
 class ScaffoldResponse(BaseModel):
     markdown: str
 
-class EvidenceAlignmentRequest(BaseModel):
+class RecommendRequest(BaseModel):
+    activity_title: str = ""
+    activity_description: str = ""
+    tema: str = ""
+    materia: str = ""
+    top_k: int = Field(5, ge=1, le=MAX_TOP_K)
+    method: Optional[str] = None  # bm25 | tfidf | embeddings
+
+class EvidenceAlignmentCourse(BaseModel):
     objectives: list[str]
-    activities: list[str]
-    evidences: list[str]
+    activities: list[str] = []
+    evidences: list[str] = []
+
+class EvidenceAlignmentRequest(EvidenceAlignmentCourse):
+    top_k: int = Field(3, ge=1, le=MAX_TOP_K)
+
+class EvidenceAlignmentBatchRequest(BaseModel):
+    courses: list[EvidenceAlignmentCourse]
+    top_k: int = Field(3, ge=1, le=MAX_TOP_K)
+
+class AlignedEvidence(BaseModel):
+    evidence: str
+    score: float
+    source: str  # "catalog" o "request"
+
+class ObjectiveAlignment(BaseModel):
+    objective: str
+    bloom_verbs: list[str]
+    evidences: list[AlignedEvidence]
+
+class CoverageReport(BaseModel):
+    bloom_levels: dict[str, list[int]]  # nivel -> índices de los objetivos que lo cubren
+    missing_levels: list[str]
+    objectives_without_verb: list[str]
+    objectives_without_evidence: list[str]
 
 class EvidenceAlignmentResponse(BaseModel):
     suggested_evidences: list[str]
     reasoning: str
+    alignment: list[ObjectiveAlignment] = []
+    coverage: Optional[CoverageReport] = None
+
+class EvidenceAlignmentBatchResponse(BaseModel):
+    results: list[EvidenceAlignmentResponse]
 
 class PreworkResource(BaseModel):
     title: str
@@ -58,182 +158,403 @@ class PreworkResource(BaseModel):
 class PreworkResourceResponse(BaseModel):
     resources: list[PreworkResource]
 
+class SuggestResponse(BaseModel):
+    objectives: list[str]
+    activity: str
+    resources: list[PreworkResource]
+    rubric: str
+
+# -------- CONTENIDO POR DEFECTO (cuando el LLM no responde) --------
+
+FALLBACK_OBJECTIVES = [
+    "Analizar conceptos clave del tema.",
+    "Aplicar conocimientos en un caso práctico.",
+    "Evaluar el impacto de la solución propuesta.",
+    "Reflexionar sobre el proceso de aprendizaje."
+]
+
+FALLBACK_ACTIVITY = (
+    "Desarrollar una propuesta creativa aplicada al tema.\n"
+    "Resolver ejercicios prácticos relacionados en grupo.\n"
+    "Exponer resultados y reflexionar en clase."
+)
+
+FALLBACK_RUBRIC = (
+    "Nivel 1 (Aprueba): Cumple parcialmente los objetivos. Identifica conceptos básicos, pero con poca profundidad.\n"
+    "Nivel 2 (Destacado): Cumple todos los objetivos, analiza casos y aplica criterios de forma adecuada.\n"
+    "Nivel 3 (Excelente): Supera los objetivos, propone ideas innovadoras y justifica sus decisiones con evidencia."
+)
+
+FALLBACK_EVIDENCE_ALIGNMENT = {
+    "suggested_evidences": [
+        "Informe de caso",
+        "Debate grupal",
+        "Presentación grupal"
+    ],
+    "reasoning": (
+        "El objetivo 'Analizar...' requiere análisis escrito (informe). "
+        "La presentación valida la argumentación y el debate fomenta pensamiento crítico."
+    )
+}
+
+FALLBACK_RESOURCES = [
+    {
+        "title": "Content Marketing Strategies for SMEs: A Practical Guide",
+        "url": "https://www.semanticscholar.org/paper/XXXXX",
+        "type": "paper",
+        "summary": "Paper con análisis de casos reales de marketing digital en pequeñas empresas."
+    },
+    {
+        "title": "How Small Businesses Win with Content (YouTube)",
+        "url": "https://www.youtube.com/watch?v=ZZZZZ",
+        "type": "video",
+        "summary": "Conferencia breve sobre tácticas efectivas para pymes en redes sociales."
+    },
+    {
+        "title": "MOOC: Digital Marketing for Entrepreneurs (edX)",
+        "url": "https://www.edx.org/course/digital-marketing-for-entrepreneurs",
+        "type": "mooc",
+        "summary": "Curso online gratis que cubre fundamentos de contenido digital."
+    }
+]
+
+def _shed_response(name):
+    """Contenido por defecto de ``name`` para servirlo sin generar cuando el endpoint está saturado."""
+    content = {
+        "suggest-objectives": {"objectives": list(FALLBACK_OBJECTIVES)},
+        "suggest-activity": {"activity": FALLBACK_ACTIVITY},
+        "suggest-activity-stream": {"activity": FALLBACK_ACTIVITY},
+        "suggest-rubric": {"rubric": FALLBACK_RUBRIC},
+        "suggest-rubric-stream": {"rubric": FALLBACK_RUBRIC},
+        "suggest-prework-resources": {"resources": FALLBACK_RESOURCES},
+        "suggest": {
+            "objectives": list(FALLBACK_OBJECTIVES), "activity": FALLBACK_ACTIVITY,
+            "resources": FALLBACK_RESOURCES, "rubric": FALLBACK_RUBRIC,
+        },
+    }.get(name)
+    if content is None:
+        return None
+    HARDCODED_DEFAULTS.labels(endpoint=name).inc()
+    headers = {"X-Pedagogy-Fallback": "shed"}
+    if name.endswith("-stream"):
+        return StreamingResponse(iter([_sse("done", content)]), media_type="text/event-stream", headers=headers)
+    return JSONResponse(content, headers=headers)
+
 # -------- ENDPOINTS --------
 
+@app.get("/catalog")
+def catalog_info(response: Response):
+    catalog = get_catalog()
+    response.headers["ETag"] = catalog.etag
+    return {"version": catalog.version, "strategies": len(catalog.strategies)}
+
+def _facet_filters(request: Request):
+    # ?bloom=Create&abet=SO5&nsm_type=quantitative; repetir la faceta o separar con comas es un OR
+    filters = {}
+    for facet, value in request.query_params.multi_items():
+        filters.setdefault(facet, []).extend(v for v in value.split(",") if v)
+    return filters
+
+@app.get("/strategies")
+def list_strategies(request: Request, response: Response):
+    snapshot = get_catalog().snapshot()
+    try:
+        strategies = snapshot.facets.query(_facet_filters(request))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    response.headers["X-Catalog-Version"] = snapshot.version
+    return {
+        "catalog_version": snapshot.version,
+        "count": len(strategies),
+        "strategies": [{"id": s.id, "display_name": s.display_name} for s in strategies],
+    }
+
+@app.get("/strategies/facets")
+def strategy_facets(response: Response):
+    snapshot = get_catalog().snapshot()
+    response.headers["X-Catalog-Version"] = snapshot.version
+    return {"catalog_version": snapshot.version, "facets": snapshot.facets.counts()}
+
+def _etag_matches(if_none_match, etag):
+    # If-None-Match admite una lista de ETags (o "*") y se compara en forma débil
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
 @app.post("/scaffold", response_model=ScaffoldResponse)
-def scaffold_activity(req: ScaffoldRequest):
-    strategies = load_strategies()
-    strategy = next((s for s in strategies if s.id == req.strategy_id), None)
+def scaffold_activity(req: ScaffoldRequest, request: Request, response: Response):
+    snapshot = get_catalog().snapshot()
+    strategy = snapshot.get(req.strategy_id)
+    response.headers["X-Catalog-Version"] = snapshot.version
     if not strategy:
         raise HTTPException(status_code=404, detail="Estrategia no encontrada.")
 
-    context = req.dict()
-    context.update({
-        "expected_evidence": strategy.evidence,
-        "implementation_notes": strategy.implementation_notes,
-        "references": strategy.references,
-    })
-    markdown = render_strategy(strategy, context)
-    return {"markdown": markdown}
+    # El render es determinista: la clave sirve de ETag fuerte y de clave de la caché
+    brief = req.dict()
+    key = render_key(snapshot.version, strategy, brief)
+    etag = f'"{key}"'
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag, "X-Catalog-Version": snapshot.version})
+    response.headers["ETag"] = etag
+    return {"markdown": render_cached(strategy, brief, key)}
+
+def _batch_requests(req: ScaffoldBatchRequest):
+    entries = [r.dict() for r in req.requests]
+    if req.activity is not None:
+        entries.append({**req.activity.dict(), "strategy_ids": req.strategy_ids})
+    return expand_manifest(entries)
+
+@app.post("/recommend-strategies")
+def recommend(req: RecommendRequest):
+    if not (req.activity_title or req.activity_description or req.tema):
+        raise HTTPException(status_code=422, detail="Describe la actividad (título, descripción o tema).")
+    try:
+        strategies = recommend_strategies(
+            req.activity_title, req.activity_description, req.tema, req.materia, req.top_k, req.method,
+        )
+    except (ValueError, RuntimeError, ImportError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"catalog_version": get_catalog().version, "method": req.method or RECOMMEND_METHOD, "strategies": strategies}
+
+@app.post("/scaffold/batch")
+def scaffold_batch(req: ScaffoldBatchRequest, workers: Optional[int] = Query(None, ge=1, le=os.cpu_count())):
+    # NDJSON: una línea por documento, en el mismo orden de la petición
+    results = render_batch(_batch_requests(req), workers)
+    lines = (json.dumps(result, ensure_ascii=False) + "\n" for result in results)
+    return StreamingResponse(lines, media_type="application/x-ndjson")
+
+def scaffold_batch_results(req: ScaffoldBatchRequest):
+    return {"results": list(render_batch(_batch_requests(req)))}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+@app.get("/llm/stats")
+def llm_stats():
+    from llm_cache import response_cache
+    from llm_utils import all_backends
+    stats = {backend.name: backend.stats() for backend in all_backends()}
+    stats["cache"] = response_cache.stats()
+    stats["admission"] = admission_stats()
+    return stats
 
 @app.post("/suggest-objectives")
-def suggest_objectives(req: ScaffoldRequest):
+async def suggest_objectives(req: ScaffoldRequest, no_cache: bool = False):
     try:
-        from llm_utils import infer_objectives
-        objs = infer_objectives(req, n=4)
-        if not objs or (
-            len(objs) == 1 and ("Redacta" in objs[0] or "objetivo" in objs[0].lower()) or len(objs[0]) < 25
-        ):
+        from llm_utils import ainfer_objectives
+        objs = await ainfer_objectives(req, n=4, use_cache=not no_cache)
+        if not useful_objectives(objs):
             raise Exception("La API LLM no devolvió objetivos útiles.")
     except Exception as e:
         print("FALLBACK:", e)
-        objs = [
-            "Analizar conceptos clave del tema.",
-            "Aplicar conocimientos en un caso práctico.",
-            "Evaluar el impacto de la solución propuesta.",
-            "Reflexionar sobre el proceso de aprendizaje."
-        ]
+        HARDCODED_DEFAULTS.labels(endpoint="suggest-objectives").inc()
+        objs = list(FALLBACK_OBJECTIVES)
     return {"objectives": objs}
 
 @app.post("/suggest-activity")
-def suggest_activity(req: ScaffoldRequest):
+async def suggest_activity(req: ScaffoldRequest, no_cache: bool = False):
     try:
-        from llm_utils import infer_activity
-        activity = infer_activity(req)
-        if not activity or "Redacta" in activity or len(activity) < 25:
+        from llm_utils import ainfer_activity
+        activity = await ainfer_activity(req, use_cache=not no_cache)
+        if not useful_activity(activity):
             raise Exception("La IA no devolvió una actividad útil.")
     except Exception as e:
         print("FALLBACK actividad:", e)
-        activity = (
-            "Desarrollar una propuesta creativa aplicada al tema.\n"
-            "Resolver ejercicios prácticos relacionados en grupo.\n"
-            "Exponer resultados y reflexionar en clase."
-        )
+        HARDCODED_DEFAULTS.labels(endpoint="suggest-activity").inc()
+        activity = FALLBACK_ACTIVITY
     return {"activity": activity}
 
-@app.post("/suggest-rubric", response_model=SuggestRubricResponse)
-def suggest_rubric(req: SuggestRubricRequest):
-    # Puedes también recibir ScaffoldRequest completo si quieres más contexto
-    prompt = (
-        f"Genera una rúbrica de evaluación de 3 niveles para una actividad universitaria titulada '{req.activity_title}' "
-        f"con esta descripción: '{req.activity_description}'. "
-        f"Los objetivos de aprendizaje son: {', '.join(req.objectives)}.\n\n"
-        "Sigue este formato:\n"
-        "Nivel 1 (Aprueba): ...\n"
-        "Nivel 2 (Destacado): ...\n"
-        "Nivel 3 (Excelente): ...\n\n"
-        "Sé claro, conciso y específico para cada nivel."
-    )
-    # El resto igual que antes...
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def _sse_stream(chunks, finish, parser=None):
+    """
+    Reenvía cada fragmento como evento ``token`` y cierra con ``done``.
+
+    Con ``parser`` (un ``llm_parsers.StreamParser``) emite además un evento
+    ``item`` por cada ítem reconocido, sin esperar a que termine la generación.
+    """
+    text = ""
     try:
-        from transformers import pipeline
-        pipe = pipeline("text-generation", model="google/flan-t5-small", trust_remote_code=True)
-        outputs = pipe(prompt, max_new_tokens=180)
-        raw = outputs[0]["generated_text"]
-        if "Nivel 1" in raw:
-            return {"rubric": raw}
+        async for chunk in chunks:
+            text += chunk
+            yield _sse("token", {"text": chunk})
+            for item in parser.feed(chunk) if parser else ():
+                yield _sse("item", {"item": item})
     except Exception as e:
-        print(f"[INFO] No se pudo usar modelo local para rúbrica: {e}")
+        print(f"[INFO] Streaming interrumpido: {e}")
+    for item in parser.close() if parser else ():
+        yield _sse("item", {"item": item})
+    yield _sse("done", finish(text))
+
+@app.post("/suggest-activity/stream")
+async def suggest_activity_stream(req: ScaffoldRequest):
+    from llm_parsers import OBJECTIVES
+    from llm_utils import extract_activity, stream_activity
+
+    def finish(text):
+        activity = extract_activity(text)
+        if not useful_activity(activity):
+            HARDCODED_DEFAULTS.labels(endpoint="suggest-activity-stream").inc()
+            activity = FALLBACK_ACTIVITY
+        return {"activity": activity}
+
+    chunks = stream_activity(req)
+    return StreamingResponse(_sse_stream(chunks, finish, OBJECTIVES.stream(limit=1)), media_type="text/event-stream")
+
+@app.post("/suggest-rubric", response_model=SuggestRubricResponse)
+async def suggest_rubric(req: SuggestRubricRequest, no_cache: bool = False):
+    # Puedes también recibir ScaffoldRequest completo si quieres más contexto
     try:
-        import os
-        HF_API_TOKEN = os.getenv("HF_API_TOKEN")
-        if HF_API_TOKEN:
-            import requests
-            api_url = "https://api-inference.huggingface.co/models/mistralai/Mixtral-8x7B-Instruct-v0.1"
-            headers = {"Authorization": f"Bearer {HF_API_TOKEN}"}
-            payload = {"inputs": prompt, "parameters": {"max_new_tokens": 180}}
-            response = requests.post(api_url, headers=headers, json=payload, timeout=30)
-            response.raise_for_status()
-            output = response.json()
-            raw = output[0]["generated_text"] if isinstance(output, list) and "generated_text" in output[0] else output[0]
-            if "Nivel 1" in raw:
-                return {"rubric": raw}
+        from llm_utils import asuggest_rubric
+        rubric = await asuggest_rubric(req.activity_title, req.activity_description, req.objectives, use_cache=not no_cache)
+        if rubric:
+            return {"rubric": rubric}
     except Exception as e:
-        print(f"[INFO] No se pudo usar HuggingFace API para rúbrica: {e}")
+        print(f"[INFO] No se pudo generar rúbrica con LLM: {e}")
+    HARDCODED_DEFAULTS.labels(endpoint="suggest-rubric").inc()
+    return {"rubric": FALLBACK_RUBRIC}
+
+@app.post("/suggest-rubric/stream")
+async def suggest_rubric_stream(req: SuggestRubricRequest):
+    from llm_utils import extract_rubric, stream_rubric
+
+    def finish(text):
+        rubric = extract_rubric(text)
+        if not rubric:
+            HARDCODED_DEFAULTS.labels(endpoint="suggest-rubric-stream").inc()
+            rubric = FALLBACK_RUBRIC
+        return {"rubric": rubric}
+
+    chunks = stream_rubric(req.activity_title, req.activity_description, req.objectives)
+    return StreamingResponse(_sse_stream(chunks, finish), media_type="text/event-stream")
+
+def _align(courses, top_k, endpoint):
+    # Motor local (TF-IDF o embeddings sobre las evidencias del catálogo): no llama al LLM
     try:
-        import os
-        OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-        if OPENAI_API_KEY:
-            import openai
-            openai.api_key = OPENAI_API_KEY
-            messages = [
-                {"role": "system", "content": "Eres un experto en pedagogía universitaria."},
-                {"role": "user", "content": prompt}
-            ]
-            chat_resp = openai.ChatCompletion.create(
-                model="gpt-3.5-turbo",
-                messages=messages,
-                max_tokens=350,
-                n=1,
-                stop=None,
-                temperature=0.3,
-            )
-            raw = chat_resp.choices[0].message.content
-            if "Nivel 1" in raw:
-                return {"rubric": raw}
+        from alignment import align_evidences
+        return align_evidences([course.dict() for course in courses], top_k)
     except Exception as e:
-        print(f"[INFO] No se pudo usar OpenAI API para rúbrica: {e}")
-    return {
-        "rubric": (
-            "Nivel 1 (Aprueba): Cumple parcialmente los objetivos. Identifica conceptos básicos, pero con poca profundidad.\n"
-            "Nivel 2 (Destacado): Cumple todos los objetivos, analiza casos y aplica criterios de forma adecuada.\n"
-            "Nivel 3 (Excelente): Supera los objetivos, propone ideas innovadoras y justifica sus decisiones con evidencia."
-        )
-    }
+        print(f"[INFO] No se pudo calcular la alineación de evidencias: {e}")
+        HARDCODED_DEFAULTS.labels(endpoint=endpoint).inc()
+        return [dict(FALLBACK_EVIDENCE_ALIGNMENT) for _ in courses]
 
 @app.post("/suggest-evidence-alignment", response_model=EvidenceAlignmentResponse)
 def suggest_evidence_alignment(req: EvidenceAlignmentRequest):
-    prompt = (
-        f"Objetivos: {', '.join(req.objectives)}\n"
-        f"Actividades: {', '.join(req.activities)}\n"
-        f"Evidencias actuales: {', '.join(req.evidences)}\n"
-        "Sugiere una lista alineada de evidencias de evaluación para cada objetivo, "
-        "explica brevemente el porqué y si falta alguna evidencia importante."
-    )
-    # Aquí llamas a tu modelo local / HF / OpenAI, etc.
-    # ... lógica igual que antes ...
-    return {
-        "suggested_evidences": [
-            "Informe de caso",
-            "Debate grupal",
-            "Presentación grupal"
-        ],
-        "reasoning": (
-            "El objetivo 'Analizar...' requiere análisis escrito (informe). "
-            "La presentación valida la argumentación y el debate fomenta pensamiento crítico."
-        )
-    }
+    return _align([req], req.top_k, "suggest-evidence-alignment")[0]
+
+@app.post("/suggest-evidence-alignment/batch", response_model=EvidenceAlignmentBatchResponse)
+def suggest_evidence_alignment_batch(req: EvidenceAlignmentBatchRequest):
+    """Alineación de muchos cursos en una sola pasada (una sola matriz objetivo × evidencia)."""
+    return {"results": _align(req.courses, req.top_k, "suggest-evidence-alignment-batch")}
 
 @app.post("/suggest-prework-resources", response_model=PreworkResourceResponse)
-def suggest_prework_resources(req: ScaffoldRequest):
+async def suggest_prework_resources(req: ScaffoldRequest, no_cache: bool = False):
     # (Recomendado: en producción, primero intenta buscar recursos reales)
     try:
-        from llm_utils import suggest_prework_resources
-        resources = suggest_prework_resources(req, n=3)
+        from llm_utils import asuggest_prework_resources
+        resources = await asuggest_prework_resources(req, n=3, use_cache=not no_cache)
         if not resources or len(resources) < 1:
             raise Exception("LLM no devolvió recursos útiles.")
     except Exception as e:
         print(f"[INFO] No se pudo sugerir recursos con LLM: {e}")
-        resources = [
-            {
-                "title": "Content Marketing Strategies for SMEs: A Practical Guide",
-                "url": "https://www.semanticscholar.org/paper/XXXXX",
-                "type": "paper",
-                "summary": "Paper con análisis de casos reales de marketing digital en pequeñas empresas."
-            },
-            {
-                "title": "How Small Businesses Win with Content (YouTube)",
-                "url": "https://www.youtube.com/watch?v=ZZZZZ",
-                "type": "video",
-                "summary": "Conferencia breve sobre tácticas efectivas para pymes en redes sociales."
-            },
-            {
-                "title": "MOOC: Digital Marketing for Entrepreneurs (edX)",
-                "url": "https://www.edx.org/course/digital-marketing-for-entrepreneurs",
-                "type": "mooc",
-                "summary": "Curso online gratis que cubre fundamentos de contenido digital."
-            }
-        ]
+        HARDCODED_DEFAULTS.labels(endpoint="suggest-prework-resources").inc()
+        resources = FALLBACK_RESOURCES
     # Mapea dicts a modelos BaseModel (si fuera necesario)
     resources = [PreworkResource(**r) if not isinstance(r, PreworkResource) else r for r in resources]
-    return {"resources": resources}
\ No newline at end of file
+    return {"resources": resources}
+
+@app.post("/suggest", response_model=SuggestResponse)
+async def suggest(req: ScaffoldRequest, no_cache: bool = False):
+    """
+    Objetivos, actividad, recursos y rúbrica con una sola generación. Las
+    secciones que falten o no sirvan se piden a su endpoint (con su propio
+    fallback); la rúbrica, una vez que los objetivos son definitivos.
+    """
+    try:
+        from llm_utils import asuggest_all
+        combined = await asuggest_all(req, use_cache=not no_cache)
+    except Exception as e:
+        print(f"[INFO] No se pudo generar la sugerencia combinada: {e}")
+        combined = {}
+
+    async def section(name, value, useful, endpoint):
+        if useful(value):
+            SUGGEST_SECTIONS.labels(section=name, source="combined").inc()
+            return value
+        SUGGEST_SECTIONS.labels(section=name, source="endpoint").inc()
+        return (await endpoint(req, no_cache))[name]
+
+    objectives, activity, resources = await asyncio.gather(
+        section("objectives", combined.get("objectives"), useful_objectives, suggest_objectives),
+        section("activity", combined.get("activity"), useful_activity, suggest_activity),
+        section("resources", combined.get("resources"), bool, suggest_prework_resources),
+    )
+
+    async def rubric_endpoint(req, no_cache):
+        rubric_req = SuggestRubricRequest(
+            activity_title=req.activity_title, activity_description=req.activity_description, objectives=objectives,
+        )
+        return await suggest_rubric(rubric_req, no_cache)
+
+    rubric = await section("rubric", combined.get("rubric"), bool, rubric_endpoint)
+    return {"objectives": objectives, "activity": activity, "resources": resources, "rubric": rubric}
+
+# -------- TRABAJOS EN SEGUNDO PLANO --------
+
+# Tipo de trabajo -> (modelo de la petición, handler); los workers de jobs.py usan el mismo mapa
+JOB_KINDS = {
+    "suggest-objectives": (ScaffoldRequest, suggest_objectives),
+    "suggest-activity": (ScaffoldRequest, suggest_activity),
+    "suggest-rubric": (SuggestRubricRequest, suggest_rubric),
+    "suggest": (ScaffoldRequest, suggest),
+    "scaffold-batch": (ScaffoldBatchRequest, scaffold_batch_results),
+}
+
+@app.post("/jobs/{kind}", status_code=202)
+def submit_job(kind: str, payload: dict = Body(...)):
+    if kind not in JOB_KINDS:
+        raise HTTPException(status_code=404, detail="Tipo de trabajo desconocido.")
+    model, _ = JOB_KINDS[kind]
+    try:
+        req = model(**payload)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False))
+    job_id = get_job_queue().submit(kind, req.dict())
+    return {"id": job_id, "kind": kind, "status": "queued"}
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = get_job_queue().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado.")
+    return job
+
+async def _job_events(job_id):
+    """Emite ``status`` en cada cambio de estado y cierra con ``done`` o ``error``."""
+    queue = get_job_queue()
+    status = None
+    while True:
+        job = await asyncio.to_thread(queue.get, job_id)
+        if job is None:
+            # Se borró mientras se seguía (p. ej. expiró su TTL): se cierra el stream
+            yield _sse("error", {"detail": "Trabajo no encontrado."})
+            return
+        if job["status"] != status:
+            status = job["status"]
+            yield _sse("status", {"id": job_id, "status": status})
+        if status == "done":
+            yield _sse("done", job["result"])
+            return
+        if status == "error":
+            yield _sse("error", {"detail": job["error"]})
+            return
+        await asyncio.sleep(JOBS_POLL_S)
+
+@app.get("/jobs/{job_id}/events")
+def job_events(job_id: str):
+    if get_job_queue().get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado.")
+    return StreamingResponse(_job_events(job_id), media_type="text/event-stream")
@@ -0,0 +1,471 @@
+#!/usr/bin/env python3
+"""
+Benchmarks reproducibles de los caminos críticos de pedagogy-radar.
+
+Mide ops/s, latencia p50/p99 y memoria pico de: carga del catálogo,
+render de cada plantilla, extractores de salida LLM sobre textos sintéticos
+grandes y cada endpoint de la API a través de un cliente ASGI en proceso,
+con un backend LLM stub determinista (no se llama a ningún modelo real).
+La suite ``local`` sí genera con cada runtime local disponible (fp32, int8,
+ONNX, GGUF) y reporta su memoria residente en vez de la de tracemalloc.
+La suite ``startup`` lanza la CLI en procesos nuevos y falla si un comando
+importa módulos pesados que no necesita o supera el presupuesto de imports.
+
+    python bench.py                      # ejecuta todo
+    python bench.py --only render        # filtra por nombre
+    python bench.py --save baseline.json
+    python bench.py --compare baseline.json
+"""
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Optional
+
+import typer
+from rich.console import Console
+from rich.table import Table
+
+import alignment
+import core
+import llm_parsers
+import llm_utils
+import recommend
+from llm_cache import response_cache
+
+console = Console()
+app = typer.Typer()
+
+BRIEF = {
+    "carrera": "Ingeniería en Sistemas",
+    "semestre": "4",
+    "materia": "Algoritmos",
+    "tema": "Grafos",
+    "strategy_id": "flipped",
+    "activity_title": "Estrategia de Algoritmos de Búsqueda",
+    "activity_description": "Implementar y comparar algoritmos de búsqueda en grafos.",
+    "learning_objectives": [{"text": "Analizar BFS y DFS", "taxonomy": "bloom"}],
+    "prework_instructions": "Leer el capítulo 3.",
+    "in_class_activity": "Resolver ejercicios en grupo.",
+}
+
+
+class StubBackend(llm_utils.LLMBackend):
+    """Backend determinista: responde según el tipo de prompt, sin modelo."""
+    name = "stub"
+
+    def __init__(self, delay=0.0):
+        super().__init__("stub", max_concurrency=64)
+        self.delay = delay
+
+    def _reply(self, prompt):
+        if "### Objetivos" in prompt:
+            # Sugerencia combinada: las cuatro respuestas bajo sus encabezados
+            parts = [prompt.split("### Objetivos")[0] + p for p in ("objetivos", "actividad", "recursos", "rúbrica")]
+            return "\n\n".join(
+                f"### {title}\n{self._reply(part)}" for title, part in zip(("Objetivos", "Actividad", "Recursos", "Rúbrica"), parts)
+            )
+        if "rúbrica" in prompt:
+            return "Nivel 1 (Aprueba): cumple.\nNivel 2 (Destacado): analiza.\nNivel 3 (Excelente): innova."
+        if "recursos" in prompt:
+            return "\n".join(
+                f"- Recurso {i} [video] (https://example.org/{i}): resumen del recurso {i}" for i in range(3)
+            )
+        return "\n".join(f"{i}. Analizar el caso práctico número {i} con criterios de eficiencia" for i in range(1, 5))
+
+    def _generate(self, prompt, max_new_tokens, chat_max_tokens, system):
+        if self.delay:
+            time.sleep(self.delay)
+        return self._reply(prompt)
+
+    async def agenerate(self, prompt, max_new_tokens=256, chat_max_tokens=500, system=llm_utils.DEFAULT_SYSTEM_PROMPT):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        return self._reply(prompt)
+
+    async def astream(self, prompt, max_new_tokens=256, chat_max_tokens=500, system=llm_utils.DEFAULT_SYSTEM_PROMPT):
+        for line in (await self.agenerate(prompt)).splitlines(keepends=True):
+            yield line
+
+
+def synthetic_objectives(lines=2000):
+    out = []
+    for i in range(lines):
+        if i % 3 == 0:
+            out.append(f"{i}. Analizar el impacto del componente {i} en el sistema")
+        elif i % 3 == 1:
+            out.append(f"- Evaluar alternativas de diseño para el módulo {i}")
+        else:
+            out.append(f"Texto libre de relleno generado por el modelo en la línea {i}")
+    return "\n".join(out)
+
+def synthetic_resources(lines=2000):
+    out = []
+    for i in range(lines):
+        if i % 2 == 0:
+            out.append(f"- Recurso {i} [paper] (https://example.org/paper/{i}): resumen breve del recurso {i}")
+        else:
+            out.append(f"Comentario intermedio del modelo sobre el recurso {i - 1}")
+    return "\n".join(out)
+
+
+def stream_parse(line_format, text, chunk_size=16):
+    # Simula tokens llegando de a poco desde el backend
+    parser = line_format.stream()
+    for start in range(0, len(text), chunk_size):
+        parser.feed(text[start:start + chunk_size])
+    parser.close()
+    return parser.items
+
+
+def summarize(name, samples, peak_bytes, errors=0, wall=None):
+    samples = sorted(samples)
+    total = wall if wall is not None else sum(samples)
+    return {
+        "name": name,
+        "iterations": len(samples),
+        "ops_per_s": len(samples) / total if total else 0.0,
+        "p50_ms": 1000 * statistics.median(samples),
+        "p99_ms": 1000 * samples[min(len(samples) - 1, int(len(samples) * 0.99))],
+        "peak_kb": peak_bytes / 1024,
+        "errors": errors,
+    }
+
+def peak_memory(fn):
+    # tracemalloc distorsiona los tiempos: la memoria se mide en una pasada aparte
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+def measure(name, fn, iterations=200, warmup=5):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return summarize(name, samples, peak_memory(fn))
+
+
+def bench_catalog(iterations):
+    raw = core.DEFAULT_CATALOG_PATH.read_bytes()
+    yield measure("catalog.parse_yaml", lambda: core._parse_catalog(raw, "bench"), iterations)
+    yield measure("catalog.load_strategies", core.load_strategies, iterations * 10)
+    yield measure("catalog.get", lambda: core.get_catalog().get("flipped"), iterations * 10)
+    with tempfile.TemporaryDirectory() as tmp:
+        binary = core.build_snapshot(out=Path(tmp) / "strategies.snapshot")["path"]
+        yield measure("catalog.open_snapshot", lambda: core.BinarySnapshot(binary).get("flipped"), iterations)
+    snapshot = core.get_catalog().snapshot()
+    yield measure("catalog.facet_index_build", lambda: core.FacetIndex(snapshot.strategies), iterations)
+    filters = {"bloom": ["Create"], "abet": ["SO5"], "nsm_type": ["quantitative"]}
+    yield measure("catalog.facet_query", lambda: snapshot.facets.query(filters), iterations * 10)
+    yield measure("catalog.recommend_index_build", lambda: recommend.StrategyIndex(snapshot), iterations)
+    index = recommend.get_index()
+    query = recommend.brief_text(BRIEF["activity_title"], BRIEF["activity_description"], BRIEF["tema"])
+    yield measure("catalog.recommend_bm25", lambda: index.search(query, method="bm25"), iterations * 10)
+    yield measure("catalog.recommend_tfidf", lambda: index.search(query, method="tfidf"), iterations * 10)
+    yield measure("catalog.evidence_index_build", lambda: alignment.EvidenceIndex(snapshot, "tfidf"), iterations)
+    evidence_index = alignment.get_evidence_index()
+    courses = [
+        {
+            "objectives": [f"Analizar el caso {i} de la empresa", "Evaluar el impacto de la solución", "Diseñar un prototipo funcional"],
+            "activities": ["Debate grupal sobre el caso", f"Proyecto en equipo {i}"],
+            "evidences": ["Informe final", "Presentación grupal"],
+        }
+        for i in range(100)
+    ]
+    yield measure("catalog.align_evidences_100_courses", lambda: evidence_index.align(courses), iterations)
+
+def synthetic_catalog(size=10_000):
+    # Estrategias del catálogo incluido, replicadas con ids y textos distintos
+    import copy
+    import yaml
+    base = yaml.safe_load(core.DEFAULT_CATALOG_PATH.read_bytes())["strategies"]
+    entries = []
+    for i in range(size):
+        # Copia profunda: sin anclas YAML, cada estrategia trae sus propias listas como en un catálogo real
+        entry = copy.deepcopy(base[i % len(base)])
+        entry["id"] = f"{entry['id']}_{i}"
+        entry["description"] = f"{entry.get('description', '')} Variante institucional {i}."
+        entries.append(entry)
+    dumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+    return yaml.dump({"strategies": entries}, Dumper=dumper, allow_unicode=True).encode("utf-8")
+
+def bench_scale(iterations, size=10_000):
+    """Carga de un catálogo de 10k estrategias con los campos pesados en memoria y en disco."""
+    import itertools
+
+    raw = synthetic_catalog(size)
+    cache_dir = core.CATALOG_CACHE_DIR
+    with tempfile.TemporaryDirectory() as tmp:
+        core.CATALOG_CACHE_DIR = Path(tmp)
+        try:
+            for mode, lazy in (("eager", False), ("lazy", True)):
+                samples = []
+                for _ in range(2):
+                    started = time.perf_counter()
+                    core._parse_catalog(raw, f"bench-{mode}", lazy)
+                    samples.append(time.perf_counter() - started)
+                # Una sola pasada con tracemalloc: pico durante el parseo y memoria que queda retenida
+                tracemalloc.start()
+                snapshot = core._parse_catalog(raw, f"bench-{mode}", lazy)
+                retained, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                console.print(f"scale.{mode}: {retained / size:.0f} bytes retenidos por estrategia")
+                yield summarize(f"scale.parse_{size // 1000}k_{mode}", samples, peak)
+            ids = itertools.cycle([s.id for s in snapshot.strategies])
+            yield measure("scale.get_lazy_notes", lambda: snapshot.by_id[next(ids)].implementation_notes, iterations * 10)
+            yaml_path = Path(tmp) / "strategies.yaml"
+            yaml_path.write_bytes(raw)
+            binary = core.build_snapshot(yaml_path)["path"]
+            yield measure(f"scale.open_snapshot_{size // 1000}k", lambda: core.BinarySnapshot(binary).get(snapshot.strategies[size // 2].id), iterations)
+        finally:
+            core.CATALOG_CACHE_DIR = cache_dir
+
+def bench_render(iterations):
+    env = core.get_template_env()
+    available = set(env.list_templates(extensions=["jinja"]))
+    for strategy in core.get_catalog().strategies:
+        if strategy.template not in available:
+            continue
+        context = core.build_context(strategy, {**BRIEF, "strategy_id": strategy.id})
+        yield measure(f"render.{strategy.id}", lambda: core.render_strategy(strategy, context), iterations)
+    # Preview repetido de /scaffold: clave de contenido + acierto en la caché de renders
+    strategy = core.get_catalog().get("flipped")
+    request = {**BRIEF, "strategy_id": strategy.id}
+    version = core.get_catalog().version
+    yield measure(
+        "render.cached_hit",
+        lambda: core.render_cached(strategy, request, core.render_key(version, strategy, request)), iterations,
+    )
+
+def bench_extract(iterations):
+    objectives = synthetic_objectives()
+    resources = synthetic_resources()
+    yield measure("extract.objectives_2k_lines", lambda: llm_utils._extract_objectives(objectives), iterations)
+    yield measure("extract.resources_2k_lines", lambda: llm_utils.extract_resources(resources), iterations)
+    yield measure("extract.objectives_first_item", lambda: llm_utils.extract_activity(objectives), iterations)
+    yield measure("extract.objectives_stream_2k_lines", lambda: stream_parse(llm_parsers.OBJECTIVES, objectives), iterations)
+    structured = json.dumps({"items": llm_parsers.parse_resources(resources)}, ensure_ascii=False)
+    yield measure("extract.resources_json_1k_items", lambda: llm_utils.extract_resources(structured), iterations)
+
+
+ENDPOINTS = [
+    ("POST", "/scaffold", BRIEF),
+    ("POST", "/recommend-strategies", BRIEF),
+    ("POST", "/scaffold/batch", {"activity": BRIEF, "strategy_ids": ["flipped", "pbl", "scrum", "capstone"]}),
+    ("POST", "/suggest-objectives?no_cache=true", BRIEF),
+    ("POST", "/suggest-activity?no_cache=true", BRIEF),
+    ("POST", "/suggest-activity/stream", BRIEF),
+    ("POST", "/suggest-rubric?no_cache=true", {"activity_title": "a", "activity_description": "b", "objectives": ["x"]}),
+    ("POST", "/suggest-rubric/stream", {"activity_title": "a", "activity_description": "b", "objectives": ["x"]}),
+    ("POST", "/suggest-prework-resources?no_cache=true", BRIEF),
+    ("POST", "/suggest?no_cache=true", BRIEF),
+    ("POST", "/suggest-evidence-alignment", {"objectives": ["Analizar"], "activities": ["Debate"], "evidences": ["Informe"]}),
+    ("POST", "/suggest-evidence-alignment/batch", {"courses": [{"objectives": ["Analizar casos", "Diseñar un prototipo"], "activities": ["Debate"], "evidences": ["Informe"]}] * 50}),
+    ("GET", "/catalog", None),
+    ("GET", "/strategies?bloom=Create&abet=SO5&nsm_type=quantitative", None),
+]
+
+async def _bench_endpoint(client, method, path, body, requests, concurrency):
+    samples = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.request(method, path, json=body)
+            samples.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+
+    await one()  # warmup
+    tracemalloc.start()
+    await asyncio.gather(*(one() for _ in range(concurrency)))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    samples.clear()
+    errors = 0
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    wall = time.perf_counter() - started
+    return samples, peak, errors, wall
+
+def bench_endpoints(iterations, concurrency=16, backend=None):
+    import httpx
+    import api
+
+    backends = list(llm_utils.BACKENDS)
+    llm_utils.BACKENDS[:] = [backend or StubBackend()]
+    response_cache.clear()
+
+    async def run():
+        transport = httpx.ASGITransport(app=api.app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            results = []
+            for method, path, body in ENDPOINTS:
+                samples, peak, errors, wall = await _bench_endpoint(client, method, path, body, iterations, concurrency)
+                results.append(summarize(f"api.{method} {path.split('?')[0]}", samples, peak, errors, wall))
+            return results
+
+    try:
+        yield from asyncio.run(run())
+    finally:
+        llm_utils.BACKENDS[:] = backends
+
+
+def _bench_local_runtime(runtime, iterations):
+    # Proceso aparte: la memoria del modelo de un runtime no contamina la del siguiente
+    from model_export import rss_mb, sample_prompts
+
+    backend = llm_utils.local_backend(runtime)
+    if not backend.available():
+        return None, f"modelo no disponible ({backend.model or 'sin configurar'})"
+    before = rss_mb()
+    try:
+        backend.load()
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+    prompt = sample_prompts()[0]
+    result = measure(f"local.{runtime}", lambda: backend.generate(prompt, 32), iterations, warmup=1)
+    result["peak_kb"] = 1024 * (rss_mb() - before)
+    return result, None
+
+def bench_local(iterations):
+    """Latencia y memoria (RSS) de cada runtime local disponible, 32 tokens por generación."""
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(1, maxtasksperchild=1) as pool:
+        for runtime in llm_utils.LOCAL_RUNTIMES:
+            result, skipped = pool.apply(_bench_local_runtime, (runtime, max(3, iterations // 20)))
+            if skipped:
+                console.print(f"[yellow]local.{runtime} omitido:[/yellow] {skipped}")
+                continue
+            yield result
+
+
+# Arranque de la CLI: módulos que cada comando no debe importar y presupuesto de importación
+STARTUP_BUDGET_MS = float(os.getenv("PEDAGOGY_RADAR_STARTUP_BUDGET_MS", "400"))
+HEAVY_MODULES = ("llm_utils", "httpx", "openai", "transformers", "torch", "optimum", "llama_cpp", "fastapi")
+STARTUP_CASES = [
+    ("help", ["--help"], HEAVY_MODULES + ("core", "yaml", "jinja2")),
+    ("strategies", ["strategies", "--bloom", "Create"], HEAVY_MODULES + ("jinja2",)),
+    ("demo", ["demo"], HEAVY_MODULES),
+]
+
+def import_profile(args):
+    """Módulos importados por ``cli.py args`` (``-X importtime``) y el tiempo total de importación en ms."""
+    env = {**os.environ, "PEDAGOGY_RADAR_DAEMON": "0"}
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", str(core.BASE_DIR / "cli.py"), *args],
+        capture_output=True, text=True, env=env,
+    )
+    modules, total_us = set(), 0
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        modules.add(name.strip())
+        # Solo los imports de primer nivel: los anidados ya están en su acumulado
+        if len(name) - len(name.lstrip()) == 1:
+            total_us += int(cumulative)
+    return modules, total_us / 1000
+
+def bench_startup(iterations):
+    """Arranque en frío de la CLI (proceso nuevo) con verificación de imports y presupuesto."""
+    for name, args, forbidden in STARTUP_CASES:
+        samples = []
+        for _ in range(max(3, iterations // 40)):
+            started = time.perf_counter()
+            subprocess.run([sys.executable, str(core.BASE_DIR / "cli.py"), *args], capture_output=True, env={**os.environ, "PEDAGOGY_RADAR_DAEMON": "0"})
+            samples.append(time.perf_counter() - started)
+        modules, import_ms = import_profile(args)
+        violations = [f"importa {module}" for module in forbidden if module in modules]
+        if import_ms > STARTUP_BUDGET_MS:
+            violations.append(f"{import_ms:.0f} ms de imports (presupuesto {STARTUP_BUDGET_MS:.0f} ms)")
+        console.print(f"startup.{name}: {import_ms:.0f} ms de imports, {len(modules)} módulos")
+        result = summarize(f"startup.{name}", samples, 0, errors=len(violations))
+        result["violations"] = violations
+        yield result
+
+
+SUITES = {
+    "catalog": bench_catalog,
+    "render": bench_render,
+    "extract": bench_extract,
+    "api": bench_endpoints,
+    "local": bench_local,
+    "scale": bench_scale,
+    "startup": bench_startup,
+}
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    return {"python": platform.python_version(), "machine": platform.machine(), "commit": commit}
+
+def print_results(results, baseline=None, threshold=0.1):
+    table = Table(title="pedagogy-radar benchmarks")
+    for column in ("benchmark", "ops/s", "p50 ms", "p99 ms", "peak KB", "errores"):
+        table.add_column(column, justify="left" if column == "benchmark" else "right")
+    if baseline is not None:
+        table.add_column("Δ ops/s", justify="right")
+    previous = {r["name"]: r for r in (baseline or {}).get("results", [])}
+    regressions = []
+    for r in results:
+        row = [r["name"], f"{r['ops_per_s']:.1f}", f"{r['p50_ms']:.3f}", f"{r['p99_ms']:.3f}", f"{r['peak_kb']:.1f}", str(r["errors"])]
+        if baseline is not None:
+            before = previous.get(r["name"])
+            if before and before["ops_per_s"]:
+                delta = r["ops_per_s"] / before["ops_per_s"] - 1
+                color = "red" if delta < -threshold else "green" if delta > threshold else "white"
+                row.append(f"[{color}]{delta:+.1%}[/{color}]")
+                if delta < -threshold:
+                    regressions.append(r["name"])
+            else:
+                row.append("nuevo")
+        table.add_row(*row)
+    console.print(table)
+    return regressions
+
+
+@app.command()
+def run(
+    only: str = typer.Option("", help="Ejecuta solo benchmarks cuyo nombre contenga este texto"),
+    iterations: int = typer.Option(200, help="Iteraciones por benchmark"),
+    save: Optional[Path] = typer.Option(None, help="Guarda los resultados como baseline JSON"),
+    compare: Optional[Path] = typer.Option(None, help="Compara contra un baseline JSON"),
+    threshold: float = typer.Option(0.1, help="Caída de ops/s considerada regresión (0.1 = 10%)"),
+):
+    """Ejecuta la suite de benchmarks."""
+    suites = [name for name in SUITES if only in name] or list(SUITES)
+    results = [r for name in suites for r in SUITES[name](iterations) if only in r["name"]]
+    baseline = json.loads(compare.read_text(encoding="utf-8")) if compare else None
+    regressions = print_results(results, baseline, threshold)
+    violations = [f"{r['name']}: {v}" for r in results for v in r.get("violations", [])]
+    for violation in violations:
+        console.print(f"[red]Presupuesto de arranque excedido[/red] {violation}")
+    if save:
+        save.write_text(json.dumps({"environment": environment(), "results": results}, indent=2), encoding="utf-8")
+        console.print(f"[green]Baseline guardado en[/green] {save}")
+    if regressions:
+        console.print(f"[red]Regresiones (> {threshold:.0%}):[/red] {', '.join(regressions)}")
+    if regressions or violations:
+        raise typer.Exit(1)
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,21 @@
+"""
+Verbos de Bloom que la CLI sugiere para redactar objetivos y el nivel de la
+taxonomía (en inglés, como en el catálogo) que cada uno evidencia. Se usa en
+la validación de la CLI y en el reporte de cobertura de la alineación de
+evidencias; no importa nada para no pesar en el arranque de la CLI.
+"""
+BLOOM_VERBS = [
+    "Analizar", "Evaluar", "Diseñar", "Comparar", "Reflexionar", "Aplicar", "Identificar", "Crear", "Sintetizar"
+]
+BLOOM_LEVELS = ("Remember", "Understand", "Apply", "Analyze", "Evaluate", "Create")
+BLOOM_VERB_LEVELS = {
+    "Analizar": "Analyze",
+    "Evaluar": "Evaluate",
+    "Diseñar": "Create",
+    "Comparar": "Analyze",
+    "Reflexionar": "Evaluate",
+    "Aplicar": "Apply",
+    "Identificar": "Remember",
+    "Crear": "Create",
+    "Sintetizar": "Create",
+}
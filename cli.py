@@ -1,16 +1,16 @@
 #!/usr/bin/env python3
+# Solo typer, rich.console y los verbos de Bloom al importar: cada comando importa lo que necesita
+# (catálogo, plantillas, LLM), así `--help` y los comandos simples arrancan rápido.
+from pathlib import Path
+from typing import Optional
+
 import typer
 from rich.console import Console
-from rich.markdown import Markdown
-from core import load_strategies, render_strategy
-import random
-from llm_utils import infer_objectives
+
+from bloom import BLOOM_VERBS
 
 console = Console()
 
-BLOOM_VERBS = [
-    "Analizar", "Evaluar", "Diseñar", "Comparar", "Reflexionar", "Aplicar", "Identificar", "Crear", "Sintetizar"
-]
 
 def print_bloom_tip():
     console.print("\n[bold cyan]💡 Tip:[/bold cyan] Un buen objetivo de aprendizaje comienza con un verbo observable de la taxonomía de Bloom.")
@@ -29,11 +29,43 @@ def validate_objectives(objectives):
         validated.append(obj)
     return validated
 
+def print_markdown(text):
+    from rich.markdown import Markdown
+    console.print(Markdown(text))
+
+def llm():
+    """
+    Funciones de generación: las del daemon si está corriendo (modelo ya
+    cargado), si no las de ``llm_utils`` en este mismo proceso.
+    """
+    from daemon import RemoteLLM, connect
+    client = connect()
+    if client is not None:
+        return RemoteLLM(client)
+    import llm_utils
+    return llm_utils
+
+def stream_to_console(chunks, title):
+    """Muestra en vivo el texto que va generando el LLM y lo devuelve completo."""
+    from rich.live import Live
+    from rich.markdown import Markdown
+    from rich.panel import Panel
+    if hasattr(chunks, "__anext__"):
+        from llm_utils import iter_sync
+        chunks = iter_sync(chunks)
+    text = ""
+    with Live(Panel(Markdown(""), title=title), console=console, refresh_per_second=12) as live:
+        for chunk in chunks:
+            text += chunk
+            live.update(Panel(Markdown(text), title=title))
+    return text
+
 app = typer.Typer()
 
 @app.command()
 def demo():
     """Ejecuta un ejemplo de actividad pre-cargada sin interacción."""
+    from core import build_context, get_catalog, render_strategy
     activity_title = "Estrategia de Algoritmos de Búsqueda"
     activity_description = "Los estudiantes deberán implementar y comparar algoritmos de búsqueda en grafos, analizando su eficiencia en distintos escenarios."
     objectives = [
@@ -46,33 +78,31 @@ def demo():
     prework_instructions = "Revisar el capítulo sobre algoritmos de búsqueda antes de la clase."
     in_class_activity = "Resolver un set de ejercicios prácticos y discutir los resultados en grupo."
 
-    strategies = load_strategies()
-    strategy = next((s for s in strategies if s.id == strategy_id), None)
+    strategy = get_catalog().get(strategy_id)
 
-    context = {
+    context = build_context(strategy, {
         "activity_title": activity_title,
         "activity_description": activity_description,
         "learning_objectives": objectives,
         "prework_instructions": prework_instructions,
         "in_class_activity": in_class_activity,
-        "expected_evidence": strategy.evidence,
-        "implementation_notes": strategy.implementation_notes,
-        "references": strategy.references,
-    }
+    })
 
     output = render_strategy(strategy, context)
     console.print("\n[bold green]--- Demo: Markdown generado ---[/bold green]\n")
-    console.print(Markdown(output))
+    print_markdown(output)
 
 @app.command()
 def scaffold(
     strategy_id: str = typer.Option(..., help="ID de la estrategia (ej. 'flipped')"),
+    suggest_all: bool = typer.Option(False, "--suggest-all", help="Sugiere objetivos, actividad, prework y rúbrica en una sola llamada al LLM"),
 ):
     """
     Genera un Markdown adaptado a la estrategia seleccionada, con validaciones y ayuda.
     """
-    strategies = load_strategies()
-    strategy = next((s for s in strategies if s.id == strategy_id), None)
+    import random
+    from core import build_context, get_catalog, render_strategy
+    strategy = get_catalog().get(strategy_id)
     if not strategy:
         console.print(f"[red]Estrategia '{strategy_id}' no encontrada.[/red]")
         raise typer.Exit(1)
@@ -99,9 +129,23 @@ def scaffold(
             console.print("[bold cyan]Ejemplo:[/bold cyan] 'Desarrollar estrategias de marketing digital para pequeñas empresas'")
             activity_description = typer.prompt("Descripción de la actividad (puedes copiar el ejemplo)", default="")
 
+    brief = {"activity_title": activity_title, "activity_description": activity_description, "strategy_id": strategy_id}
+    suggestion = {}
+    if suggest_all:
+        with console.status("Generando objetivos, actividad, prework y rúbrica..."):
+            suggestion = llm().suggest_all(brief)
+        if not suggestion:
+            console.print("⚠️ No se pudo generar la sugerencia combinada; puedes pedir cada sección por separado.")
+
     print_bloom_tip()
 
     learning_objectives = ""
+    if suggestion.get("objectives"):
+        typer.echo("\nObjetivos sugeridos por IA:")
+        for i, obj in enumerate(suggestion["objectives"], 1):
+            typer.echo(f"{i}. {obj}")
+        if typer.confirm("¿Usar estos objetivos?", default=True):
+            learning_objectives = ";".join(suggestion["objectives"])
     attempts = 0
     while not learning_objectives.strip():
         if attempts > 0:
@@ -116,7 +160,13 @@ def scaffold(
         if not learning_objectives.strip():
             typer.echo("\n🔮 ¿Quieres que te sugiera 3-4 objetivos basados en tu actividad usando IA? [y/N]")
             if typer.confirm("¿Usar IA para generar objetivos?", default=True):
-                objectives = infer_objectives(activity_title, activity_description, n=4)
+                objectives = llm().infer_objectives(
+                    {"activity_title": activity_title, "activity_description": activity_description}, n=4
+                )
+                if not objectives:
+                    # Sin salida utilizable del modelo: se vuelve a pedir los objetivos a mano
+                    console.print("⚠️ El modelo no devolvió objetivos útiles. Escríbelos a mano.")
+                    continue
                 # Fallback si respuesta es igual al prompt
                 if (
                     len(objectives) == 1 and
@@ -165,23 +215,269 @@ def scaffold(
             "Reflexionar sobre el proceso de aprendizaje."
         ]
 
-    prework_instructions = typer.prompt("Instrucciones de prework (solo para flipped, si aplica)", default="")
-    in_class_activity = typer.prompt("Descripción de la actividad en clase (si aplica)", default="")
+    prework_default = "; ".join(f"{r['title']} ({r['url']})" for r in suggestion.get("resources", []))
+    prework_instructions = typer.prompt("Instrucciones de prework (solo para flipped, si aplica)", default=prework_default)
+    in_class_activity = typer.prompt("Descripción de la actividad en clase (si aplica)", default=suggestion.get("activity", ""))
+    if not in_class_activity.strip() and typer.confirm("¿Generar la actividad en clase con IA?", default=False):
+        generator = llm()
+        text = stream_to_console(generator.stream_activity(brief), "Actividad sugerida")
+        in_class_activity = generator.extract_activity(text)
+
+    rubric = suggestion.get("rubric", "")
+    if rubric:
+        console.print(f"\n[bold]Rúbrica sugerida:[/bold]\n{rubric}")
+        if not typer.confirm("¿Usar esta rúbrica?", default=True):
+            rubric = ""
+    if not rubric and typer.confirm("¿Generar una rúbrica con IA?", default=False):
+        generator = llm()
+        text = stream_to_console(generator.stream_rubric(activity_title, activity_description, objectives_list), "Rúbrica sugerida")
+        rubric = generator.extract_rubric(text)
 
-    context = {
+    context = build_context(strategy, {
         "activity_title": activity_title,
         "activity_description": activity_description,
         "learning_objectives": objectives_list,
         "prework_instructions": prework_instructions,
         "in_class_activity": in_class_activity,
-        "expected_evidence": strategy.evidence,
-        "implementation_notes": strategy.implementation_notes,
-        "references": strategy.references,
-    }
+        "rubric": rubric,
+    })
 
     output = render_strategy(strategy, context)
     console.print("\n[bold green]--- Generado Markdown ---[/bold green]\n")
-    console.print(Markdown(output))
+    print_markdown(output)
+
+def _batch_filename(result):
+    import re
+    import unicodedata
+    title = unicodedata.normalize("NFKD", result["activity_title"]).encode("ascii", "ignore").decode()
+    slug = re.sub(r"[^a-z0-9]+", "-", title.lower()).strip("-") or "actividad"
+    return f"{result['index']:04d}-{slug[:60]}-{result['strategy_id']}.md"
+
+@app.command()
+def batch(
+    manifest: Path = typer.Argument(..., help="Manifiesto JSONL, JSON o YAML con peticiones de scaffold"),
+    strategies: str = typer.Option("", help="IDs separados por coma para entradas sin strategy_id"),
+    out: Optional[Path] = typer.Option(None, help="Directorio o archivo .zip de salida (por defecto NDJSON a stdout)"),
+    workers: Optional[int] = typer.Option(None, help="Workers para renderizar en paralelo"),
+):
+    """Renderiza un curso completo (muchas actividades × estrategias) en una sola pasada."""
+    import json
+    import zipfile
+    from core import expand_manifest, load_manifest, render_batch
+    strategy_ids = [s.strip() for s in strategies.split(",") if s.strip()]
+    requests = expand_manifest(load_manifest(manifest), strategy_ids)
+    results = render_batch(requests, workers)
+
+    if out is None:
+        for result in results:
+            typer.echo(json.dumps(result, ensure_ascii=False))
+        return
+
+    errors = 0
+    written = 0
+    archive = zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) if out.suffix == ".zip" else None
+    if archive is None:
+        out.mkdir(parents=True, exist_ok=True)
+    try:
+        for result in results:
+            if "error" in result:
+                errors += 1
+                console.print(f"[red]#{result['index']} ({result['strategy_id']}):[/red] {result['error']}")
+                continue
+            name = _batch_filename(result)
+            if archive is not None:
+                archive.writestr(name, result["markdown"])
+            else:
+                (out / name).write_text(result["markdown"], encoding="utf-8")
+            written += 1
+    finally:
+        if archive is not None:
+            archive.close()
+    console.print(f"[green]{written} documentos generados en[/green] {out}" + (f" [red]({errors} con error)[/red]" if errors else ""))
+
+@app.command()
+def recommend(
+    title: str = typer.Option("", "--title", help="Título de la actividad"),
+    description: str = typer.Option("", "--description", help="Descripción de la actividad"),
+    tema: str = typer.Option("", help="Tema de la clase"),
+    top_k: int = typer.Option(5, help="Cantidad de estrategias a sugerir"),
+    method: Optional[str] = typer.Option(None, help="bm25, tfidf o embeddings"),
+):
+    """Sugiere las estrategias más adecuadas para una actividad (sin llamar al LLM)."""
+    from rich.table import Table
+    from daemon import connect
+    if not (title or description or tema):
+        title = typer.prompt("Título de la actividad")
+        description = typer.prompt("Descripción breve", default="")
+    client = connect()
+    if client is not None:
+        # El daemon ya tiene el índice armado
+        results = client.call("recommend_strategies", title, description, tema, top_k=top_k, method=method)
+    else:
+        from recommend import recommend_strategies
+        results = recommend_strategies(title, description, tema, top_k=top_k, method=method)
+    if not results:
+        console.print("[yellow]Ninguna estrategia coincide con la descripción.[/yellow]")
+        raise typer.Exit(1)
+    table = Table(title="Estrategias recomendadas")
+    for column in ("#", "id", "estrategia", "puntaje", "términos"):
+        table.add_column(column)
+    for i, r in enumerate(results, 1):
+        table.add_row(str(i), r["strategy_id"], r["display_name"], f"{r['score']:.3f}", ", ".join(r["matched_terms"][:6]))
+    console.print(table)
+
+@app.command()
+def strategies(
+    bloom: Optional[list[str]] = typer.Option(None, help="Nivel de Bloom (repetible)"),
+    abet: Optional[list[str]] = typer.Option(None, help="Student outcome ABET (repetible)"),
+    nsm_type: Optional[list[str]] = typer.Option(None, help="Tipo de métrica NSM: quantitative o qualitative"),
+    facet: Optional[list[str]] = typer.Option(None, help="Otra faceta como faceta=valor (p. ej. tpack=TPK)"),
+):
+    """Filtra el catálogo por taxonomías y métricas NSM (AND entre facetas, OR dentro de una)."""
+    from rich.table import Table
+    from core import get_catalog
+    filters = {"bloom": bloom, "abet": abet, "nsm_type": nsm_type}
+    for item in facet or []:
+        name, _, value = item.partition("=")
+        filters.setdefault(name, []).append(value)
+    try:
+        results = get_catalog().query(**{name: values for name, values in filters.items() if values})
+    except ValueError as e:
+        console.print(f"[red]{e}[/red]")
+        raise typer.Exit(2)
+    if not results:
+        console.print("[yellow]Ninguna estrategia cumple los filtros.[/yellow]")
+        raise typer.Exit(1)
+    table = Table(title=f"{len(results)} estrategias")
+    for column in ("id", "estrategia", "bloom", "abet"):
+        table.add_column(column)
+    for s in results:
+        levels = {taxonomy: ", ".join(map(str, values or [])) for entry in s.taxonomies for taxonomy, values in entry.items()}
+        table.add_row(s.id, s.display_name, levels.get("bloom", ""), levels.get("abet", ""))
+    console.print(table)
+
+@app.command()
+def worker(
+    processes: Optional[int] = typer.Option(None, help="Procesos worker (por defecto, uno por núcleo)"),
+):
+    """Procesa la cola de trabajos de la API (POST /jobs/...) con modelos ya cargados."""
+    from jobs import JOBS_DB, run_workers
+    console.print(f"[bold]Cola de trabajos:[/bold] {JOBS_DB}")
+    run_workers(processes)
+
+@app.command("export-model")
+def export_model(
+    model: str = typer.Option(None, help="Modelo de transformers a exportar (por defecto LLM_LOCAL_MODEL)"),
+    out: Optional[Path] = typer.Option(None, help="Directorio de salida (por defecto LLM_ONNX_MODEL)"),
+    quantize: bool = typer.Option(False, help="Agrega versiones cuantizadas int8 de cada archivo ONNX"),
+    verify: bool = typer.Option(True, help="Compara el modelo exportado contra el pipeline fp32"),
+):
+    """Exporta el modelo local a ONNX para LLM_LOCAL_RUNTIME=onnx."""
+    import llm_utils
+    from model_export import export_onnx
+    model = model or llm_utils.LOCAL_MODEL
+    out = out or Path(llm_utils.ONNX_MODEL)
+    files = export_onnx(model, out, quantize=quantize)
+    console.print(f"[green]Modelo exportado en[/green] {out}: {', '.join(files)}")
+    if verify:
+        verify_model("onnx", str(out), reference=model)
+
+@app.command("verify-model")
+def verify_model(
+    runtime: str = typer.Argument(..., help="int8, onnx o gguf"),
+    path: Optional[str] = typer.Option(None, help="Modelo del runtime (por defecto el configurado)"),
+    reference: Optional[str] = typer.Option(None, help="Modelo fp32 de referencia (por defecto LLM_LOCAL_MODEL)"),
+    max_new_tokens: int = typer.Option(64, help="Tokens por prompt de muestra"),
+):
+    """Compara salidas, latencia y memoria de un runtime local contra el pipeline fp32."""
+    import llm_utils
+    from rich.table import Table
+    from model_export import verify
+    report = verify(runtime, path, max_new_tokens, reference or llm_utils.LOCAL_MODEL)
+    table = Table(title=f"{runtime} vs transformers fp32")
+    for column in ("prompt", "idéntica", "solapamiento", f"{runtime} ms", "fp32 ms"):
+        table.add_column(column)
+    candidate, baseline = report["candidate"], report["reference"]
+    for i, comparison in enumerate(report["comparisons"]):
+        table.add_row(
+            str(i + 1), "sí" if comparison["identical"] else "no", f"{comparison['overlap']:.0%}",
+            f"{candidate['latency_ms'][i]:.0f}", f"{baseline['latency_ms'][i]:.0f}",
+        )
+    console.print(table)
+    console.print(
+        f"Carga: {candidate['load_s']:.1f}s vs {baseline['load_s']:.1f}s · "
+        f"Memoria: {candidate['rss_growth_mb']:.0f} MB vs {baseline['rss_growth_mb']:.0f} MB"
+    )
+
+@app.command("compile-templates")
+def compile_templates_cmd():
+    """Precompila las plantillas Jinja a bytecode para acelerar el arranque."""
+    from core import TEMPLATE_BYTECODE_DIR, compile_templates
+    names = compile_templates()
+    console.print(f"[green]{len(names)} plantillas compiladas en[/green] {TEMPLATE_BYTECODE_DIR}")
+
+catalog_app = typer.Typer(help="Herramientas del catálogo de estrategias.")
+app.add_typer(catalog_app, name="catalog")
+
+@catalog_app.command("build")
+def catalog_build(
+    yaml_path: Optional[Path] = typer.Option(None, "--yaml", help="Catálogo YAML a compilar (por defecto strategies.yaml)"),
+    out: Optional[Path] = typer.Option(None, help="Archivo de salida (por defecto, junto al YAML con extensión .snapshot)"),
+):
+    """Valida el catálogo y escribe su snapshot binario para arrancar sin parsear el YAML."""
+    import time
+    from core import DEFAULT_CATALOG_PATH, build_snapshot
+    started = time.perf_counter()
+    try:
+        info = build_snapshot(yaml_path or DEFAULT_CATALOG_PATH, out)
+    except (ValueError, KeyError, TypeError) as e:
+        console.print(f"[red]Catálogo inválido:[/red] {e}")
+        raise typer.Exit(1)
+    elapsed = time.perf_counter() - started
+    size_kb = info["path"].stat().st_size / 1024
+    console.print(
+        f"[green]{info['strategies']} estrategias[/green] (versión {info['version']}) → {info['path']} "
+        f"({size_kb:.1f} KB, {elapsed:.2f} s)"
+    )
+    if info["missing_templates"]:
+        console.print(f"[yellow]Plantillas que no existen:[/yellow] {', '.join(info['missing_templates'])}")
+
+daemon_app = typer.Typer(help="Proceso local con el catálogo y el modelo ya cargados.")
+app.add_typer(daemon_app, name="daemon")
+
+@daemon_app.command("start")
+def daemon_start(
+    model: bool = typer.Option(True, help="Carga el modelo local al arrancar"),
+):
+    """Arranca el daemon en primer plano; los demás comandos lo usan mientras esté corriendo."""
+    from daemon import DAEMON_SOCKET, serve
+    console.print(f"[bold]Daemon:[/bold] {DAEMON_SOCKET}")
+    try:
+        serve(preload_model=model)
+    except RuntimeError as e:
+        console.print(f"[yellow]{e}[/yellow]")
+        raise typer.Exit(1)
+
+@daemon_app.command("status")
+def daemon_status():
+    """Muestra si el daemon está corriendo."""
+    from daemon import DAEMON_SOCKET, DaemonClient
+    status = DaemonClient(DAEMON_SOCKET).ping()
+    if status is None:
+        console.print("[yellow]El daemon no está corriendo.[/yellow]")
+        raise typer.Exit(1)
+    console.print(f"[green]Daemon activo[/green] (pid {status['pid']}, {status['uptime_s']:.0f} s) en {DAEMON_SOCKET}")
+
+@daemon_app.command("stop")
+def daemon_stop():
+    """Detiene el daemon."""
+    from daemon import connect
+    client = connect()
+    if client is None:
+        console.print("[yellow]El daemon no está corriendo.[/yellow]")
+        raise typer.Exit(1)
+    client.shutdown()
+    console.print("[green]Daemon detenido.[/green]")
 
 if __name__ == "__main__":
     app()
\ No newline at end of file
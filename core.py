@@ -1,27 +1,747 @@
-import yaml
+import atexit
+import hashlib
+import json
+import mmap
+import os
+import sys
+import threading
+from array import array
+from collections.abc import Sequence
+from functools import lru_cache
 from pathlib import Path
-from jinja2 import Environment, FileSystemLoader
+
+import metrics
+
+BASE_DIR = Path(__file__).parent
+DEFAULT_CATALOG_PATH = BASE_DIR / "strategies.yaml"
+TEMPLATES_DIR = BASE_DIR / "strategies"
+CACHE_DIR = Path(os.getenv("PEDAGOGY_RADAR_CACHE_DIR", BASE_DIR / ".cache"))
+TEMPLATE_BYTECODE_DIR = CACHE_DIR / "templates"
+TEMPLATE_CACHE_SIZE = int(os.getenv("PEDAGOGY_RADAR_TEMPLATE_CACHE_SIZE", "64"))
+# A partir de este tamaño los batches se renderizan en procesos separados
+BATCH_PROCESS_THRESHOLD = int(os.getenv("PEDAGOGY_RADAR_BATCH_PROCESS_THRESHOLD", "64"))
+RENDER_CACHE_SIZE = int(os.getenv("PEDAGOGY_RADAR_RENDER_CACHE_SIZE", "512"))
+RENDER_CACHE_TTL = float(os.getenv("PEDAGOGY_RADAR_RENDER_CACHE_TTL", "604800"))
+# Archivo SQLite para que los scaffolds renderizados sobrevivan reinicios (vacío = solo memoria)
+RENDER_CACHE_PATH = os.getenv("PEDAGOGY_RADAR_RENDER_CACHE_PATH", "")
+CATALOG_CACHE_DIR = CACHE_DIR / "catalog"
+# Catálogos con al menos esta cantidad de estrategias dejan los textos largos en disco
+LAZY_FIELDS_THRESHOLD = int(os.getenv("PEDAGOGY_RADAR_LAZY_FIELDS_THRESHOLD", "256"))
+LAZY_FIELDS_CACHE_SIZE = int(os.getenv("PEDAGOGY_RADAR_LAZY_FIELDS_CACHE_SIZE", "256"))
+SNAPSHOT_FORMAT = 1
+HEAVY_FIELDS = ("description", "implementation_notes", "references")
+
+
+def load_yaml(raw):
+    # yaml se importa al usarlo: con el snapshot binario la CLI arranca sin él.
+    # libyaml (si está disponible) parsea los catálogos grandes varias veces más rápido.
+    import yaml
+    return yaml.load(raw, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
+
+
+def write_records(path, records):
+    """
+    Escribe ``records`` (bytes) en ``path``: cantidad, tabla de offsets y datos.
+
+    Se escribe a un temporal y se reemplaza de forma atómica, así otro
+    proceso nunca lee un archivo a medias.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    offsets = array("Q", [len(records), 0])
+    for record in records:
+        offsets.append(offsets[-1] + len(record))
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(offsets.tobytes())
+        for record in records:
+            f.write(record)
+    os.replace(tmp, path)
+
+
+class RecordFile:
+    """Registros de un archivo de ``write_records``, leídos con mmap sin cargarlo entero."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        count = array("Q", self._map[:8])[0] if len(self._map) >= 8 else -1
+        if count < 0 or len(self._map) < 8 * (count + 2):
+            raise ValueError(f"Archivo de registros truncado: {self.path}")
+        self._offsets = memoryview(self._map)[8:8 * (count + 2)].cast("Q")
+        self._data = 8 * (count + 2)
+        if self._data + self._offsets[-1] != len(self._map):
+            raise ValueError(f"Archivo de registros inconsistente: {self.path}")
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        return self._map[self._data + self._offsets[index]:self._data + self._offsets[index + 1]]
+
+
+def _invalid(strategy_id, field, expected):
+    return ValueError(f"Estrategia {strategy_id}: '{field}' debe ser {expected}.")
+
+def _text_field(data, field, default=""):
+    value = data.get(field)
+    if value is None:
+        return default
+    if not isinstance(value, (str, int, float)):
+        raise _invalid(data.get("id"), field, "un texto")
+    return str(value)
+
+def _list_field(data, field):
+    value = data.get(field)
+    if value is None:
+        return []
+    if not isinstance(value, list):
+        raise _invalid(data.get("id"), field, "una lista")
+    return value
+
+def _label(value):
+    return sys.intern(str(value))
+
+def heavy_fields(data):
+    """``(description, implementation_notes, references)`` validados de una entrada del YAML."""
+    references = tuple(str(r) for r in _list_field(data, "references"))
+    return _text_field(data, "description"), _text_field(data, "implementation_notes"), references
+
+
+def _heavy_record(fields):
+    return json.dumps(fields, ensure_ascii=False).encode("utf-8")
+
+
+class FieldStore:
+    """
+    Campos pesados guardados en disco (JSON por estrategia), con caché LRU.
+
+    ``base`` es el primer registro de los campos dentro de ``records``.
+    """
+
+    def __init__(self, records, base=0):
+        self.records = records
+        self.base = base
+        self.fields = lru_cache(maxsize=LAZY_FIELDS_CACHE_SIZE)(self._load)
+
+    def _load(self, row):
+        description, notes, references = json.loads(self.records[self.base + row])
+        return description, notes, tuple(references)
+
+    @classmethod
+    def build(cls, path, entries):
+        # El nombre lleva la versión del YAML: si ya existe (otro proceso), se reutiliza
+        path = Path(path)
+        if path.exists():
+            store = cls(RecordFile(path))
+            if len(store.records) == len(entries):
+                return store
+        write_records(path, [_heavy_record(heavy_fields(e)) for e in entries])
+        return cls(RecordFile(path))
+
 
 class Strategy:
-    def __init__(self, data):
-        self.id = data["id"]
-        self.display_name = data.get("display_name", self.id)
-        self.description = data.get("description", "")
-        self.taxonomies = data.get("taxonomies", [])
-        self.nsm_metrics = data.get("nsm_metrics", [])
-        self.evidence = data.get("evidence", [])
-        self.implementation_notes = data.get("implementation_notes", "")
-        self.references = data.get("references", [])
-        self.template = data.get("template", "")
-
-def load_strategies(yaml_path="strategies.yaml"):
-    with open(yaml_path, "r", encoding="utf-8") as f:
-        doc = yaml.safe_load(f)
-    strategies = [Strategy(s) for s in doc["strategies"]]
-    return strategies
+    """
+    Estrategia del catálogo, inmutable y con ``__slots__``.
+
+    Los campos se validan al construirla y las etiquetas (taxonomías, ids y
+    tipos de métricas, evidencias) se internan, así miles de estrategias
+    comparten las mismas cadenas. ``description``, ``implementation_notes``
+    y ``references`` quedan en memoria o, con ``store``, se leen del
+    ``FieldStore`` recién cuando se usan.
+    """
+
+    __slots__ = ("id", "display_name", "taxonomies", "nsm_metrics", "evidence", "template", "_heavy", "_store")
+
+    def __init__(self, data, store=None, row=None):
+        if not isinstance(data, dict) or not isinstance(data.get("id"), str) or not data["id"]:
+            raise ValueError(f"Estrategia sin 'id' válido: {str(data)[:80]}")
+        strategy_id = data["id"]
+        taxonomies = []
+        for entry in _list_field(data, "taxonomies"):
+            if not isinstance(entry, dict):
+                raise _invalid(strategy_id, "taxonomies", "una lista de {taxonomía: [niveles]}")
+            for taxonomy, levels in entry.items():
+                if levels is not None and not isinstance(levels, list):
+                    raise _invalid(strategy_id, f"taxonomies.{taxonomy}", "una lista")
+                taxonomies.append({_label(taxonomy): tuple(_label(level) for level in levels or ())})
+        nsm_metrics = []
+        for metric in _list_field(data, "nsm_metrics"):
+            if not isinstance(metric, dict):
+                raise _invalid(strategy_id, "nsm_metrics", "una lista de {id, display_name, type}")
+            nsm_metrics.append({
+                _label(key): _label(value) if key in ("id", "type") else value for key, value in metric.items()
+            })
+        init = object.__setattr__
+        init(self, "id", sys.intern(strategy_id))
+        init(self, "display_name", _text_field(data, "display_name", strategy_id))
+        init(self, "taxonomies", tuple(taxonomies))
+        init(self, "nsm_metrics", tuple(nsm_metrics))
+        init(self, "evidence", tuple(_label(e) for e in _list_field(data, "evidence")))
+        init(self, "template", _text_field(data, "template"))
+        init(self, "_store", store)
+        init(self, "_heavy", row if store is not None else heavy_fields(data))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"Strategy es inmutable: no se puede asignar '{name}'.")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"Strategy es inmutable: no se puede borrar '{name}'.")
+
+    def __reduce__(self):
+        return Strategy, (self.to_dict(),)
+
+    def __repr__(self):
+        return f"Strategy({self.id!r})"
+
+    def _fields(self):
+        return self._heavy if self._store is None else self._store.fields(self._heavy)
+
+    @property
+    def description(self):
+        return self._fields()[0]
+
+    @property
+    def implementation_notes(self):
+        return self._fields()[1]
+
+    @property
+    def references(self):
+        return self._fields()[2]
+
+    def light_dict(self):
+        """Campos livianos (todo salvo ``HEAVY_FIELDS``), con listas en vez de tuplas."""
+        return {
+            "id": self.id,
+            "display_name": self.display_name,
+            "taxonomies": [{k: list(v) for k, v in entry.items()} for entry in self.taxonomies],
+            "nsm_metrics": [dict(metric) for metric in self.nsm_metrics],
+            "evidence": list(self.evidence),
+            "template": self.template,
+        }
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "display_name": self.display_name,
+            "description": self.description,
+            "taxonomies": [{k: list(v) for k, v in entry.items()} for entry in self.taxonomies],
+            "nsm_metrics": [dict(metric) for metric in self.nsm_metrics],
+            "evidence": list(self.evidence),
+            "implementation_notes": self.implementation_notes,
+            "references": list(self.references),
+            "template": self.template,
+        }
+
+
+def strategy_facets(strategy):
+    """Pares ``(faceta, valor)`` de una estrategia: cada taxonomía, tipo e id de métrica NSM y evidencias."""
+    for entry in strategy.taxonomies:
+        for taxonomy, levels in entry.items():
+            for level in levels or []:
+                yield taxonomy, str(level)
+    for metric in strategy.nsm_metrics:
+        if metric.get("type"):
+            yield "nsm_type", metric["type"]
+        if metric.get("id"):
+            yield "nsm_metric", metric["id"]
+    for evidence in strategy.evidence:
+        yield "evidence", str(evidence)
+
+
+class FacetIndex:
+    """
+    Bitsets precalculados por faceta: el bit ``i`` de ``bits[faceta][valor]``
+    indica que la estrategia ``i`` del snapshot tiene ese valor.
+
+    Una consulta es un AND entre facetas y un OR entre los valores de una
+    misma faceta, así que se resuelve con unas pocas operaciones sobre
+    enteros en vez de recorrer las estrategias. Los valores no distinguen
+    mayúsculas.
+    """
+
+    def __init__(self, strategies):
+        self.strategies = strategies
+        self.all = (1 << len(strategies)) - 1
+        self.bits = {}
+        self.labels = {}
+        for i, strategy in enumerate(strategies):
+            bit = 1 << i
+            for facet, value in strategy_facets(strategy):
+                key = value.casefold()
+                column = self.bits.setdefault(facet, {})
+                column[key] = column.get(key, 0) | bit
+                self.labels.setdefault(facet, {}).setdefault(key, value)
+
+    def mask(self, filters):
+        """Bitset de las estrategias que cumplen ``filters`` (``{faceta: [valores]}``)."""
+        mask = self.all
+        for facet, values in filters.items():
+            if not values:
+                continue
+            column = self.bits.get(facet)
+            if column is None:
+                raise ValueError(f"Faceta desconocida: {facet} (usa {', '.join(sorted(self.bits))})")
+            matches = 0
+            for value in values:
+                matches |= column.get(str(value).casefold(), 0)
+            mask &= matches
+            if not mask:
+                break
+        return mask
+
+    def query(self, filters):
+        mask = self.mask(filters)
+        found = []
+        while mask:
+            low = mask & -mask
+            found.append(self.strategies[low.bit_length() - 1])
+            mask ^= low
+        return found
+
+    def to_dict(self):
+        # Bitsets en hexadecimal: no hay límite de dígitos al convertirlos de vuelta a int
+        return {facet: [[self.labels[facet][key], format(bits, "x")] for key, bits in column.items()] for facet, column in self.bits.items()}
+
+    @classmethod
+    def from_dict(cls, strategies, data):
+        """Reconstruye el índice guardado por ``to_dict`` sin recorrer las estrategias."""
+        index = cls.__new__(cls)
+        index.strategies = strategies
+        index.all = (1 << len(strategies)) - 1
+        index.bits = {facet: {label.casefold(): int(bits, 16) for label, bits in values} for facet, values in data.items()}
+        index.labels = {facet: {label.casefold(): label for label, _ in values} for facet, values in data.items()}
+        return index
+
+    def counts(self):
+        """``{faceta: {valor: cantidad de estrategias}}`` para armar filtros."""
+        return {
+            facet: {self.labels[facet][key]: bin(bits).count("1") for key, bits in column.items()}
+            for facet, column in self.bits.items()
+        }
+
+
+class CatalogSnapshot:
+    """Vista inmutable del catálogo en una versión concreta del YAML."""
+
+    def __init__(self, strategies, version):
+        self.strategies = tuple(strategies)
+        self.version = version
+        self.by_id = {s.id: s for s in self.strategies}
+        self.facets = FacetIndex(self.strategies)
+
+    def get(self, strategy_id):
+        return self.by_id.get(strategy_id)
+
+
+class _LazyStrategies(Sequence):
+    # Decodifica cada estrategia del snapshot binario la primera vez que se pide
+    def __init__(self, records, base, count, store):
+        self._records = records
+        self._base = base
+        self._store = store
+        self._items = [None] * count
+
+    def __len__(self):
+        return len(self._items)
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self[i] for i in range(*row.indices(len(self._items)))]
+        strategy = self._items[row]
+        if strategy is None:
+            if row < 0:
+                row += len(self._items)
+            data = json.loads(self._records[self._base + row])
+            strategy = self._items[row] = Strategy(data, self._store, row)
+        return strategy
+
+
+class BinarySnapshot:
+    """
+    Snapshot leído de un archivo de ``build_snapshot`` con mmap.
+
+    Al abrirlo solo se leen el encabezado, los ids y los bitsets de facetas
+    ya calculados: el arranque no depende del tamaño del catálogo y cada
+    estrategia se decodifica recién cuando se usa.
+    """
+
+    def __init__(self, path):
+        records = RecordFile(path)
+        header = json.loads(records[0])
+        if header.get("format") != SNAPSHOT_FORMAT:
+            raise ValueError(f"Formato de snapshot no soportado: {header.get('format')}")
+        count = header["count"]
+        self.path = Path(path)
+        self.version = header["version"]
+        self._rows = {strategy_id: row for row, strategy_id in enumerate(json.loads(records[1]))}
+        store = FieldStore(records, base=3 + count)
+        self.strategies = _LazyStrategies(records, 3, count, store)
+        self.facets = FacetIndex.from_dict(self.strategies, json.loads(records[2]))
+
+    def get(self, strategy_id):
+        row = self._rows.get(strategy_id)
+        return self.strategies[row] if row is not None else None
+
+
+def snapshot_path(yaml_path):
+    """Ruta del snapshot binario de un catálogo: junto al YAML, con extensión ``.snapshot``."""
+    return Path(yaml_path).with_suffix(".snapshot")
+
+def catalog_version(raw):
+    return hashlib.sha256(raw).hexdigest()[:16]
+
+def build_snapshot(yaml_path=DEFAULT_CATALOG_PATH, out=None):
+    """
+    Valida el YAML y escribe su snapshot binario (por defecto en ``snapshot_path``).
+
+    Registros: encabezado, ids, bitsets de facetas, campos livianos de cada
+    estrategia y luego sus campos pesados. Devuelve un dict con la ruta, la
+    versión, la cantidad de estrategias y las plantillas que faltan.
+    """
+    yaml_path = Path(yaml_path)
+    raw = yaml_path.read_bytes()
+    version = catalog_version(raw)
+    strategies = [Strategy(entry) for entry in load_yaml(raw)["strategies"]]
+    seen = set()
+    for strategy in strategies:
+        if strategy.id in seen:
+            raise ValueError(f"Estrategia duplicada: {strategy.id}")
+        seen.add(strategy.id)
+    header = {"format": SNAPSHOT_FORMAT, "version": version, "count": len(strategies), "source": yaml_path.name}
+    records = [
+        json.dumps(header).encode("utf-8"),
+        json.dumps([s.id for s in strategies]).encode("utf-8"),
+        json.dumps(FacetIndex(strategies).to_dict(), ensure_ascii=False).encode("utf-8"),
+    ]
+    records.extend(json.dumps(s.light_dict(), ensure_ascii=False).encode("utf-8") for s in strategies)
+    records.extend(_heavy_record(s._fields()) for s in strategies)
+    out = Path(out) if out else snapshot_path(yaml_path)
+    write_records(out, records)
+    missing = sorted({s.template for s in strategies if s.template and not (TEMPLATES_DIR / s.template).exists()})
+    return {"path": out, "version": version, "strategies": len(strategies), "missing_templates": missing}
+
+
+def _parse_catalog(raw, version, lazy=None):
+    entries = load_yaml(raw)["strategies"]
+    if lazy is None:
+        lazy = len(entries) >= LAZY_FIELDS_THRESHOLD
+    store = None
+    if lazy:
+        try:
+            store = FieldStore.build(CATALOG_CACHE_DIR / f"{version}.fields", entries)
+        except OSError as e:
+            print(f"[INFO] No se pudo escribir el índice de campos en disco, quedan en memoria: {e}")
+    return CatalogSnapshot([Strategy(s, store, row) for row, s in enumerate(entries)], version)
+
+
+class StrategyCatalog:
+    """
+    Registro compartido del catálogo de estrategias.
+
+    Si hay un snapshot binario (``cli.py catalog build``) más nuevo que el
+    YAML, se abre ese; si no, parsea el YAML. Vuelve a cargar solo si cambia
+    el mtime de alguno de los dos y, si el contenido es idéntico (misma
+    versión), conserva el snapshot actual. Las recargas reemplazan el
+    snapshot completo, así que los lectores nunca ven un catálogo a medio
+    construir.
+    """
+
+    def __init__(self, yaml_path=DEFAULT_CATALOG_PATH):
+        self.path = Path(yaml_path)
+        self.snapshot_path = snapshot_path(self.path)
+        self._lock = threading.Lock()
+        # ((mtime_ns, tamaño, mtime_ns del snapshot), snapshot): se reemplaza como una sola referencia
+        self._state = None
+
+    def _stat_key(self):
+        stat = os.stat(self.path)
+        try:
+            binary_mtime = os.stat(self.snapshot_path).st_mtime_ns
+        except FileNotFoundError:
+            binary_mtime = None
+        return stat.st_mtime_ns, stat.st_size, binary_mtime
+
+    def _load_binary(self, stat_key):
+        yaml_mtime, _, binary_mtime = stat_key
+        if binary_mtime is None or binary_mtime < yaml_mtime:
+            return None
+        try:
+            return BinarySnapshot(self.snapshot_path)
+        except (OSError, ValueError, KeyError, IndexError) as e:
+            print(f"[INFO] Snapshot binario inválido ({self.snapshot_path}), se usa el YAML: {e}")
+            return None
+
+    def snapshot(self):
+        stat_key = self._stat_key()
+        state = self._state
+        if state is not None and state[0] == stat_key:
+            return state[1]
+        with self._lock:
+            state = self._state
+            if state is not None and state[0] == stat_key:
+                return state[1]
+            with metrics.stage("catalog_load"):
+                snapshot = self._load_binary(stat_key)
+                if snapshot is None:
+                    raw = self.path.read_bytes()
+                    version = catalog_version(raw)
+                    if state is not None and state[1].version == version:
+                        snapshot = state[1]
+                    else:
+                        snapshot = _parse_catalog(raw, version)
+                elif state is not None and state[1].version == snapshot.version:
+                    snapshot = state[1]
+            self._state = (stat_key, snapshot)
+            return snapshot
+
+    @property
+    def version(self):
+        return self.snapshot().version
+
+    @property
+    def etag(self):
+        return f'"{self.version}"'
+
+    @property
+    def strategies(self):
+        return self.snapshot().strategies
+
+    def get(self, strategy_id):
+        return self.snapshot().get(strategy_id)
+
+    def by_taxonomy(self, taxonomy, level):
+        facets = self.snapshot().facets
+        return facets.query({taxonomy: [level]}) if taxonomy in facets.bits else []
+
+    def by_nsm_metric(self, metric_id):
+        facets = self.snapshot().facets
+        return facets.query({"nsm_metric": [metric_id]}) if "nsm_metric" in facets.bits else []
+
+    def query(self, **filters):
+        """Estrategias que cumplen todas las facetas, p. ej. ``query(bloom=["Create"], abet=["SO5"])``."""
+        return self.snapshot().facets.query(filters)
+
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+def get_catalog(yaml_path=None):
+    """Devuelve el catálogo compartido del proceso para ``yaml_path``."""
+    path = Path(yaml_path) if yaml_path else DEFAULT_CATALOG_PATH
+    key = str(path.resolve())
+    catalog = _catalogs.get(key)
+    if catalog is None:
+        with _catalogs_lock:
+            catalog = _catalogs.setdefault(key, StrategyCatalog(path))
+    return catalog
+
+def load_strategies(yaml_path=DEFAULT_CATALOG_PATH):
+    return list(get_catalog(yaml_path).strategies)
+
+_template_env = None
+_template_env_lock = threading.Lock()
+
+def get_template_env():
+    """
+    Entorno Jinja compartido por todo el proceso.
+
+    Mantiene hasta TEMPLATE_CACHE_SIZE plantillas compiladas en memoria y las
+    recompila si el archivo cambia (auto_reload). Si existe el directorio de
+    bytecode generado por ``compile_templates`` se usa como caché en disco,
+    así un worker nuevo no vuelve a compilar las plantillas.
+    """
+    global _template_env
+    if _template_env is None:
+        with _template_env_lock:
+            if _template_env is None:
+                from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+                bytecode_cache = None
+                if TEMPLATE_BYTECODE_DIR.is_dir():
+                    bytecode_cache = FileSystemBytecodeCache(str(TEMPLATE_BYTECODE_DIR))
+                _template_env = Environment(
+                    loader=FileSystemLoader(str(TEMPLATES_DIR)),
+                    cache_size=TEMPLATE_CACHE_SIZE,
+                    auto_reload=True,
+                    bytecode_cache=bytecode_cache,
+                )
+    return _template_env
+
+def preload_templates():
+    """Carga todas las plantillas en la caché en memoria del entorno compartido."""
+    env = get_template_env()
+    names = env.list_templates(extensions=["jinja"])
+    for name in names:
+        env.get_template(name)
+    return names
+
+def compile_templates():
+    """Precompila todas las plantillas a bytecode en TEMPLATE_BYTECODE_DIR."""
+    global _template_env
+    TEMPLATE_BYTECODE_DIR.mkdir(parents=True, exist_ok=True)
+    with _template_env_lock:
+        _template_env = None
+    return preload_templates()
 
 def render_strategy(strategy, context):
-    templates_dir = Path(__file__).parent / "strategies"
-    env = Environment(loader=FileSystemLoader(str(templates_dir)))
-    template = env.get_template(strategy.template)
-    return template.render(**context)
\ No newline at end of file
+    with metrics.stage("template_render"):
+        template = get_template_env().get_template(strategy.template)
+        return template.render(**context)
+
+
+_template_digests = {}
+
+def template_digest(name):
+    """Digest del código de la plantilla ``name``; se recalcula solo si cambia el archivo."""
+    path = TEMPLATES_DIR / name
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    stat_key = (stat.st_mtime_ns, stat.st_size)
+    cached = _template_digests.get(name)
+    if cached is None or cached[0] != stat_key:
+        cached = _template_digests[name] = (stat_key, hashlib.blake2b(path.read_bytes(), digest_size=16).hexdigest())
+    return cached[1]
+
+def render_key(version, strategy, request):
+    """
+    Clave de contenido de un scaffold: versión del catálogo, plantilla y
+    petición. Cambia sola cuando cambia el YAML o el archivo de la plantilla.
+    """
+    payload = json.dumps(
+        [version, strategy.id, strategy.template, template_digest(strategy.template), request],
+        sort_keys=True, ensure_ascii=False, default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+_render_cache = None
+_render_cache_lock = threading.Lock()
+
+def get_render_cache():
+    global _render_cache
+    if _render_cache is None:
+        with _render_cache_lock:
+            if _render_cache is None:
+                from llm_cache import ResponseCache
+                _render_cache = ResponseCache(
+                    RENDER_CACHE_SIZE, RENDER_CACHE_TTL, RENDER_CACHE_PATH, lookups=metrics.RENDER_CACHE_LOOKUPS,
+                )
+    return _render_cache
+
+def render_cached(strategy, request, key):
+    """``render_strategy`` memoizado bajo ``key`` (ver ``render_key``)."""
+    cache = get_render_cache()
+    markdown = cache.get(key)
+    if markdown is None:
+        markdown = render_strategy(strategy, build_context(strategy, request))
+        cache.set(key, markdown)
+    return markdown
+
+
+def build_context(strategy, request):
+    """Contexto de plantilla para una petición de scaffold (dict)."""
+    context = dict(request)
+    context.setdefault("strategy_id", strategy.id)
+    context.update({
+        "expected_evidence": strategy.evidence,
+        "implementation_notes": strategy.implementation_notes,
+        "references": strategy.references,
+    })
+    return context
+
+def expand_manifest(entries, strategy_ids=None):
+    """
+    Normaliza un manifiesto de scaffolds.
+
+    Cada entrada es una petición con ``strategy_id``, o una actividad con
+    ``strategy_ids`` (o sin estrategia, usando ``strategy_ids`` global) que
+    se expande en una petición por estrategia.
+    """
+    requests = []
+    for entry in entries:
+        # Sin estrategia se conserva la entrada para que se reporte como error
+        ids = entry.get("strategy_ids") or ([entry["strategy_id"]] if entry.get("strategy_id") else strategy_ids or [None])
+        base = {k: v for k, v in entry.items() if k != "strategy_ids"}
+        for strategy_id in ids:
+            requests.append({**base, "strategy_id": strategy_id})
+    return requests
+
+def load_manifest(path):
+    """Lee un manifiesto JSONL, JSON o YAML (lista o ``{requests: [...]}``)."""
+    path = Path(path)
+    text = path.read_text(encoding="utf-8")
+    if path.suffix == ".jsonl":
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    doc = json.loads(text) if path.suffix == ".json" else load_yaml(text)
+    return doc.get("requests", []) if isinstance(doc, dict) else doc
+
+def _render_one(item):
+    index, request = item
+    result = {"index": index, "strategy_id": request.get("strategy_id"), "activity_title": request.get("activity_title", "")}
+    strategy = get_catalog().get(request.get("strategy_id"))
+    if strategy is None:
+        result["error"] = "Estrategia no encontrada."
+        return result
+    try:
+        result["markdown"] = render_strategy(strategy, build_context(strategy, request))
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    return result
+
+def render_batch(requests, workers=None):
+    """
+    Renderiza muchas peticiones sobre el catálogo y plantillas compartidos.
+
+    Devuelve un iterador (en orden) de dicts con ``markdown`` o ``error``.
+    Los manifiestos grandes se reparten en un pool de procesos, cada uno con
+    su propio catálogo y entorno Jinja ya cargados. Los pools se crean una vez
+    por proceso y se reutilizan entre llamadas; ``workers`` se acota a
+    ``1..os.cpu_count()``.
+    """
+    items = list(enumerate(requests))
+    cpus = os.cpu_count() or 1
+    workers = min(max(workers, 1), cpus) if workers else None
+    if workers == 1 or len(items) < 2:
+        return map(_render_one, items)
+    if len(items) >= BATCH_PROCESS_THRESHOLD:
+        workers = workers or cpus
+        kind = "process"
+        chunksize = max(1, len(items) // (4 * workers))
+    else:
+        kind = "thread"
+        chunksize = 1
+    executor = _batch_executor(kind, workers)
+    return _drain(kind, workers, executor.map(_render_one, items, chunksize=chunksize))
+
+_batch_executors = {}
+_batch_executors_lock = threading.Lock()
+
+def _batch_executor(kind, workers):
+    # A lo sumo un pool por (tipo, workers): workers está acotado, así que son pocos
+    key = (kind, workers)
+    executor = _batch_executors.get(key)
+    if executor is None:
+        with _batch_executors_lock:
+            executor = _batch_executors.get(key)
+            if executor is None:
+                from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+                pool = ProcessPoolExecutor if kind == "process" else ThreadPoolExecutor
+                executor = _batch_executors[key] = pool(max_workers=workers)
+    return executor
+
+@atexit.register
+def _shutdown_batch_executors():
+    for executor in list(_batch_executors.values()):
+        executor.shutdown(cancel_futures=True)
+
+def _drain(kind, workers, results):
+    from concurrent.futures import BrokenExecutor
+    try:
+        yield from results
+    except BrokenExecutor:
+        # Un worker murió: el próximo batch crea un pool nuevo
+        with _batch_executors_lock:
+            _batch_executors.pop((kind, workers), None)
+        raise
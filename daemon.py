@@ -0,0 +1,195 @@
+"""
+Daemon local para la CLI.
+
+``python cli.py daemon start`` deja un proceso con el catálogo, las
+plantillas y el modelo ya cargados escuchando en un socket Unix. Mientras
+esté corriendo, los comandos de la CLI le delegan la generación y la
+recomendación en vez de importar ``llm_utils`` y cargar el modelo en cada
+invocación. Este módulo solo usa la biblioteca estándar para que el
+cliente no agregue nada al arranque de la CLI.
+
+Protocolo: JSON por líneas, una petición por conexión
+(``{"op", "args", "kwargs"}``). La respuesta es ``{"result"}`` o
+``{"error"}``; las operaciones en streaming mandan una línea ``{"chunk"}``
+por fragmento y terminan con ``{"done": true}``.
+"""
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+from pathlib import Path
+
+from core import CACHE_DIR
+
+DAEMON_SOCKET = Path(os.getenv("PEDAGOGY_RADAR_DAEMON_SOCKET", CACHE_DIR / "daemon.sock"))
+# PEDAGOGY_RADAR_DAEMON=0 hace que la CLI ignore el daemon aunque esté corriendo
+DAEMON_ENABLED = os.getenv("PEDAGOGY_RADAR_DAEMON", "1") != "0"
+STREAM_OPS = ("stream_activity", "stream_rubric")
+
+
+def _load_ops(preload_model=True):
+    import llm_utils
+    from core import get_catalog, preload_templates
+    from recommend import get_index, recommend_strategies
+
+    get_catalog().snapshot()
+    preload_templates()
+    get_index()
+    if preload_model:
+        llm_utils.warm_up()
+
+    def stream(fn):
+        return lambda *args, **kwargs: llm_utils.iter_sync(fn(*args, **kwargs))
+
+    return {
+        "infer_objectives": llm_utils.infer_objectives,
+        "extract_activity": llm_utils.extract_activity,
+        "extract_rubric": llm_utils.extract_rubric,
+        "suggest_all": llm_utils.suggest_all,
+        "stream_activity": stream(llm_utils.stream_activity),
+        "stream_rubric": stream(llm_utils.stream_rubric),
+        "recommend_strategies": recommend_strategies,
+    }
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def _send(self, message):
+        self.wfile.write(json.dumps(message, ensure_ascii=False).encode("utf-8") + b"\n")
+        self.wfile.flush()
+
+    def handle(self):
+        server = self.server
+        try:
+            request = json.loads(self.rfile.readline())
+            op = request["op"]
+            if op == "ping":
+                return self._send({"result": {"pid": os.getpid(), "uptime_s": time.time() - server.started, "ops": sorted(server.ops)}})
+            if op == "shutdown":
+                self._send({"result": "ok"})
+                return threading.Thread(target=server.shutdown, daemon=True).start()
+            fn = server.ops[op]
+            args, kwargs = request.get("args", []), request.get("kwargs", {})
+            # Una generación a la vez: el modelo local ya usa todos los hilos configurados
+            with server.generation_lock:
+                if op in STREAM_OPS:
+                    for chunk in fn(*args, **kwargs):
+                        self._send({"chunk": chunk})
+                    return self._send({"done": True})
+                self._send({"result": fn(*args, **kwargs)})
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        except Exception as e:
+            print(f"[INFO] Falló la operación del daemon: {e}")
+            self._send({"error": f"{type(e).__name__}: {e}"})
+
+
+class _Server(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def serve(path=DAEMON_SOCKET, preload_model=True):
+    """Carga todo una vez y atiende a la CLI en ``path`` hasta ``shutdown`` o Ctrl+C."""
+    path = Path(path)
+    if path.exists():
+        if DaemonClient(path).ping() is not None:
+            raise RuntimeError(f"Ya hay un daemon escuchando en {path}.")
+        path.unlink()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    ops = _load_ops(preload_model)
+    # El socket nace ya con 0600: con el umask por defecto otro usuario podría conectarse antes del chmod
+    umask = os.umask(0o077)
+    try:
+        server = _Server(str(path), _Handler)
+    finally:
+        os.umask(umask)
+    os.chmod(path, 0o600)
+    server.ops = ops
+    server.started = time.time()
+    server.generation_lock = threading.Lock()
+    print(f"[INFO] Daemon listo en {path} (pid {os.getpid()}).")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        path.unlink(missing_ok=True)
+
+
+class DaemonClient:
+    """Cliente del daemon; cada llamada abre una conexión al socket."""
+
+    def __init__(self, path=DAEMON_SOCKET, timeout=None):
+        self.path = Path(path)
+        self.timeout = timeout
+
+    def _request(self, op, args=(), kwargs=None):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(str(self.path))
+            sock.sendall(json.dumps({"op": op, "args": list(args), "kwargs": kwargs or {}}, ensure_ascii=False).encode("utf-8") + b"\n")
+            with sock.makefile("rb") as replies:
+                for line in replies:
+                    message = json.loads(line)
+                    if "error" in message:
+                        raise RuntimeError(f"Daemon: {message['error']}")
+                    yield message
+        finally:
+            sock.close()
+
+    def call(self, op, *args, **kwargs):
+        for message in self._request(op, args, kwargs):
+            return message["result"]
+        raise RuntimeError("Daemon: respuesta vacía.")
+
+    def stream(self, op, *args, **kwargs):
+        for message in self._request(op, args, kwargs):
+            if message.get("done"):
+                return
+            yield message["chunk"]
+
+    def ping(self):
+        """Estado del daemon, o None si no responde."""
+        try:
+            return DaemonClient(self.path, timeout=2).call("ping")
+        except (OSError, ValueError, RuntimeError):
+            return None
+
+    def shutdown(self):
+        return self.call("shutdown")
+
+
+class RemoteLLM:
+    """Las funciones de ``llm_utils`` que usa la CLI, ejecutadas en el daemon."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def infer_objectives(self, brief, n=4):
+        return self.client.call("infer_objectives", brief, n=n)
+
+    def extract_activity(self, text):
+        return self.client.call("extract_activity", text)
+
+    def extract_rubric(self, text):
+        return self.client.call("extract_rubric", text)
+
+    def suggest_all(self, brief):
+        return self.client.call("suggest_all", brief)
+
+    def stream_activity(self, brief):
+        return self.client.stream("stream_activity", brief)
+
+    def stream_rubric(self, activity_title, activity_description, objectives):
+        return self.client.stream("stream_rubric", activity_title, activity_description, objectives)
+
+
+def connect(path=DAEMON_SOCKET):
+    """Cliente del daemon si hay uno escuchando en ``path`` (y no está desactivado), o None."""
+    if not DAEMON_ENABLED or not Path(path).exists():
+        return None
+    client = DaemonClient(path)
+    return client if client.ping() is not None else None
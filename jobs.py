@@ -0,0 +1,251 @@
+"""
+Cola de trabajos persistente para la generación de larga duración.
+
+La API encola el trabajo en un SQLite local y responde de inmediato con su
+id; un pool de procesos worker (``python cli.py worker``), cada uno con su
+modelo ya cargado, los va tomando en orden. Así la concurrencia de la API
+queda separada de la del modelo y los workers escalan con los núcleos.
+"""
+import asyncio
+import json
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import metrics
+from core import CACHE_DIR
+
+JOBS_DB = Path(os.getenv("PEDAGOGY_RADAR_JOBS_DB", CACHE_DIR / "jobs.sqlite3"))
+JOBS_POLL_S = float(os.getenv("PEDAGOGY_RADAR_JOBS_POLL_S", "0.25"))
+# Un trabajo "running" sin latido durante este tiempo se considera de un worker caído
+JOBS_LEASE_S = float(os.getenv("PEDAGOGY_RADAR_JOBS_LEASE_S", "600"))
+# Cada cuánto renueva el worker el lease del trabajo que está corriendo
+JOBS_HEARTBEAT_S = float(os.getenv("PEDAGOGY_RADAR_JOBS_HEARTBEAT_S", str(JOBS_LEASE_S / 3)))
+JOBS_MAX_ATTEMPTS = int(os.getenv("PEDAGOGY_RADAR_JOBS_MAX_ATTEMPTS", "3"))
+JOBS_TTL = float(os.getenv("PEDAGOGY_RADAR_JOBS_TTL", "86400"))
+# Fija cada worker a su propio bloque de núcleos (además de limitar sus hilos)
+WORKER_AFFINITY = os.getenv("PEDAGOGY_RADAR_WORKER_AFFINITY", "") == "1"
+
+JOB_STATUSES = ("queued", "running", "done", "error")
+
+
+class JobQueue:
+    """
+    Cola FIFO sobre SQLite (modo WAL), compartida entre procesos.
+
+    Cada proceso abre su propia conexión; ``claim`` toma el siguiente
+    trabajo dentro de una transacción ``BEGIN IMMEDIATE`` para que dos
+    workers nunca tomen el mismo. Mientras corre, el worker renueva el lease
+    con ``heartbeat``; solo se re-encolan los trabajos sin latido reciente.
+    """
+
+    def __init__(self, path=JOBS_DB):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._db = None
+        self._pid = None
+
+    def _conn(self):
+        if self._db is None or self._pid != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            db = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, kind TEXT, payload TEXT, status TEXT, result TEXT, error TEXT,"
+                "attempts INTEGER DEFAULT 0, worker TEXT, created REAL, started REAL, finished REAL, heartbeat REAL)"
+            )
+            try:
+                # Bases creadas antes de que existiera el latido
+                db.execute("ALTER TABLE jobs ADD COLUMN heartbeat REAL")
+            except sqlite3.OperationalError:
+                pass
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created)")
+            self._db, self._pid = db, os.getpid()
+        return self._db
+
+    def submit(self, kind, payload):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            db = self._conn()
+            db.execute(
+                "INSERT INTO jobs (id, kind, payload, status, created) VALUES (?, ?, ?, 'queued', ?)",
+                (job_id, kind, json.dumps(payload, ensure_ascii=False), now),
+            )
+            db.execute("DELETE FROM jobs WHERE finished < ?", (now - JOBS_TTL,))
+        return job_id
+
+    def claim(self, worker):
+        """Marca como ``running`` el trabajo más antiguo en cola y lo devuelve (o None)."""
+        now = time.time()
+        with self._lock:
+            db = self._conn()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                # Trabajos de workers caídos: vuelven a la cola hasta JOBS_MAX_ATTEMPTS
+                db.execute(
+                    "UPDATE jobs SET status = 'error', error = 'Se agotaron los reintentos.', finished = ? "
+                    "WHERE status = 'running' AND COALESCE(heartbeat, started) < ? AND attempts >= ?",
+                    (now, now - JOBS_LEASE_S, JOBS_MAX_ATTEMPTS),
+                )
+                db.execute(
+                    "UPDATE jobs SET status = 'queued', worker = NULL "
+                    "WHERE status = 'running' AND COALESCE(heartbeat, started) < ?",
+                    (now - JOBS_LEASE_S,),
+                )
+                row = db.execute(
+                    "SELECT id, kind, payload FROM jobs WHERE status = 'queued' ORDER BY created LIMIT 1"
+                ).fetchone()
+                if row:
+                    db.execute(
+                        "UPDATE jobs SET status = 'running', started = ?, heartbeat = ?, worker = ?, attempts = attempts + 1 "
+                        "WHERE id = ?",
+                        (now, now, worker, row[0]),
+                    )
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+        return (row[0], row[1], json.loads(row[2])) if row else None
+
+    def heartbeat(self, job_id, worker):
+        """Renueva el lease; False si el trabajo ya no es de ``worker`` (se re-encoló o terminó)."""
+        with self._lock:
+            cursor = self._conn().execute(
+                "UPDATE jobs SET heartbeat = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                (time.time(), job_id, worker),
+            )
+        return cursor.rowcount > 0
+
+    def complete(self, job_id, result, worker=None):
+        self._finish(job_id, "done", json.dumps(result, ensure_ascii=False), None, worker)
+
+    def fail(self, job_id, error, worker=None):
+        self._finish(job_id, "error", None, error, worker)
+
+    def _finish(self, job_id, status, result, error, worker=None):
+        # Con ``worker``, un worker que perdió el lease no pisa el resultado de quien lo retomó
+        owner = " AND worker = ? AND status = 'running'" if worker is not None else ""
+        with self._lock:
+            self._conn().execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished = ? WHERE id = ?" + owner,
+                (status, result, error, time.time(), job_id) + ((worker,) if worker is not None else ()),
+            )
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn().execute(
+                "SELECT id, kind, status, result, error, attempts, created, started, finished FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(("id", "kind", "status", "result", "error", "attempts", "created", "started", "finished"), row))
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        return job
+
+    def counts(self):
+        with self._lock:
+            rows = self._conn().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: dict(rows).get(status, 0) for status in JOB_STATUSES}
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+def get_job_queue():
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = JobQueue()
+    return _queue
+
+metrics.gauge(
+    "pedagogy_jobs", "Trabajos en la cola persistente por estado.", ("status",),
+    # No crea la base solo por exportar métricas si nunca se usó la cola
+    lambda: {(status,): count for status, count in get_job_queue().counts().items()} if JOBS_DB.exists() else {},
+)
+
+
+# -------- Workers --------
+
+async def _work(worker, queue, kinds):
+    from fastapi.encoders import jsonable_encoder
+
+    while True:
+        job = await asyncio.to_thread(queue.claim, worker)
+        if job is None:
+            await asyncio.sleep(JOBS_POLL_S)
+            continue
+        job_id, kind, payload = job
+        heartbeat = asyncio.create_task(_heartbeat(queue, job_id, worker))
+        try:
+            model, handler = kinds[kind]
+            request = model(**payload)
+            if asyncio.iscoroutinefunction(handler):
+                result = await handler(request)
+            else:
+                # Los handlers síncronos (p. ej. scaffold-batch) corren fuera del loop para no frenar el latido
+                result = await asyncio.to_thread(handler, request)
+            await asyncio.to_thread(queue.complete, job_id, jsonable_encoder(result), worker)
+        except Exception as e:
+            print(f"[INFO] Falló el trabajo {job_id} ({kind}): {e}")
+            await asyncio.to_thread(queue.fail, job_id, f"{type(e).__name__}: {e}", worker)
+        finally:
+            heartbeat.cancel()
+
+async def _heartbeat(queue, job_id, worker):
+    """Renueva el lease del trabajo cada ``JOBS_HEARTBEAT_S`` hasta que deja de ser de ``worker``."""
+    while True:
+        await asyncio.sleep(JOBS_HEARTBEAT_S)
+        try:
+            if not await asyncio.to_thread(queue.heartbeat, job_id, worker):
+                return
+        except sqlite3.Error as e:
+            print(f"[INFO] No se pudo renovar el lease de {job_id}: {e}")
+
+def _pin_cores(index, threads):
+    cores = sorted(os.sched_getaffinity(0))
+    block = [cores[(index * threads + i) % len(cores)] for i in range(threads)]
+    os.sched_setaffinity(0, block)
+
+def run_worker(index=0):
+    """Bucle de un worker: carga el modelo una vez y procesa trabajos en orden."""
+    threads = int(os.getenv("LLM_LOCAL_THREADS", "0"))
+    if WORKER_AFFINITY and threads and hasattr(os, "sched_setaffinity"):
+        _pin_cores(index, threads)
+    from api import JOB_KINDS
+    from llm_utils import warm_up
+
+    worker = f"{os.uname().nodename}:{os.getpid()}:{index}"
+    warm_up()
+    print(f"[INFO] Worker {worker} listo.")
+    try:
+        asyncio.run(_work(worker, get_job_queue(), JOB_KINDS))
+    except KeyboardInterrupt:
+        pass
+
+def run_workers(processes=None):
+    """Arranca ``processes`` workers (por defecto, uno por núcleo) y espera a que terminen."""
+    processes = processes or os.cpu_count() or 1
+    # Los núcleos se reparten entre los workers para que no compitan por ellos
+    os.environ.setdefault("LLM_LOCAL_THREADS", str(max(1, (os.cpu_count() or 1) // processes)))
+    if processes == 1:
+        return run_worker()
+    # spawn: cada worker importa y carga su propio modelo desde cero
+    context = multiprocessing.get_context("spawn")
+    pool = [context.Process(target=run_worker, args=(i,), name=f"pedagogy-worker-{i}") for i in range(processes)]
+    for process in pool:
+        process.start()
+    try:
+        for process in pool:
+            process.join()
+    except KeyboardInterrupt:
+        for process in pool:
+            process.terminate()
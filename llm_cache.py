@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "1024"))
+CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "86400"))
+# Ruta a un archivo SQLite para que la caché sobreviva reinicios (vacío = solo memoria)
+CACHE_PATH = os.getenv("LLM_CACHE_PATH", "")
+CACHE_ENABLED = os.getenv("LLM_CACHE_DISABLED", "") != "1"
+
+
+def cache_key(backend, model, params, prompt):
+    payload = json.dumps([backend, model, params, prompt], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Caché de resultados ya parseados de ``extract_fn``.
+
+    Primer nivel: LRU en memoria con TTL. Segundo nivel opcional: SQLite en
+    disco, que se consulta cuando la entrada no está en memoria y la vuelve
+    a promover al LRU. ``lookups`` es el contador de aciertos y fallos (la
+    caché de renders de ``core`` usa la misma clase con el suyo).
+    """
+
+    def __init__(self, max_size=CACHE_SIZE, ttl=CACHE_TTL, path=CACHE_PATH, lookups=metrics.LLM_CACHE_LOOKUPS):
+        self.max_size = max_size
+        self.lookups = lookups
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT, created REAL)"
+            )
+            self._db.commit()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        return self.get_first([key])
+
+    def get_first(self, keys):
+        """Devuelve el primer valor vigente entre ``keys`` (cuenta un solo acierto/fallo)."""
+        now = time.time()
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                value, created = entry
+                if now - created <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    self.lookups.labels(result="hit").inc()
+                    return value
+                del self._entries[key]
+            if self._db is not None:
+                for key in keys:
+                    row = self._db.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+                    if row and now - row[1] <= self.ttl:
+                        value = json.loads(row[0])
+                        self._store(key, value, row[1])
+                        self.disk_hits += 1
+                        self.lookups.labels(result="disk_hit").inc()
+                        return value
+            self.misses += 1
+            self.lookups.labels(result="miss").inc()
+            return None
+
+    def set(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._store(key, value, now)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, created) VALUES (?, ?, ?)",
+                    (key, json.dumps(value, ensure_ascii=False), now),
+                )
+                self._db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+                self._db.commit()
+
+    def _store(self, key, value, created):
+        self._entries[key] = (value, created)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "persistent": self._db is not None,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
+
+
+response_cache = ResponseCache()
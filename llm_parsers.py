@@ -0,0 +1,295 @@
+"""
+Parsers de la salida de los LLM.
+
+Los patrones se compilan una sola vez al importar y cada formato recorre la
+salida en una sola pasada. Hay tres formas de usarlos:
+
+- ``parse_objectives`` / ``parse_resources`` / ``parse_rubric`` sobre el
+  texto completo.
+- ``StreamParser``: se alimenta con fragmentos (tokens o líneas) y devuelve
+  cada ítem en cuanto su línea se completa, mientras la generación sigue.
+- Modo JSON (``LLM_JSON_MODE=1``): los prompts piden JSON y, si la salida lo
+  es, se lee con ``json.loads`` sin aplicar ninguna regex.
+"""
+import json
+import os
+import re
+from itertools import islice
+
+JSON_MODE = os.getenv("LLM_JSON_MODE", "") == "1"
+# Los backends que soportan salida estructurada la activan si el prompt lleva esta instrucción
+JSON_INSTRUCTION = "Responde solo con JSON válido, sin texto adicional, con esta forma: "
+JSON_SHAPES = {
+    "objectives": '{"items": ["...", "..."]}',
+    "resources": '{"items": [{"title": "...", "type": "paper|video|curso|mooc|podcast|libro", "url": "https://...", "summary": "..."}]}',
+    "rubric": '{"levels": [{"level": 1, "label": "Aprueba", "description": "..."}]}',
+    "suggest": (
+        '{"objectives": ["..."], "activity": "...", '
+        '"resources": [{"title": "...", "type": "paper|video|curso|mooc|podcast|libro", "url": "https://...", "summary": "..."}], '
+        '"rubric": {"levels": [{"level": 1, "label": "Aprueba", "description": "..."}]}}'
+    ),
+}
+# Encabezados de las secciones de la sugerencia combinada ("### Objetivos", "Rúbrica:", ...)
+SUGGEST_SECTIONS = {"objetivos": "objectives", "actividad": "activity", "recursos": "resources", "rubrica": "rubric"}
+RUBRIC_LABELS = {1: "Aprueba", 2: "Destacado", 3: "Excelente"}
+
+_SECTION = re.compile(
+    r"^[ \t]*(?:#{1,6}[ \t]*|\*\*)?(objetivos|actividad|recursos|r[uú]brica)\b[^\n]*$", re.IGNORECASE | re.MULTILINE,
+)
+_FENCE = re.compile(r"^```(?:json)?\s*(.*?)\s*```$", re.DOTALL | re.IGNORECASE)
+# "1. xxx", "- xxx" o "• xxx"
+_LIST_ITEM = re.compile(r"^[ \t]*(?:\d[^.\n]*\.|[-•])[ \t]*(\S[^\n]*)", re.MULTILINE)
+# "- Título [tipo] (url): descripción"
+_RESOURCE_ITEM = re.compile(
+    r"^-[ \t]*([^\n]+?)[ \t]*\[(paper|video|curso|mooc|podcast|libro)\][ \t]*"
+    r"\((https?://[^\s)]+)\)[ \t]*[:-][ \t]*(\S[^\n]*)",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+
+def json_hint(kind):
+    """Instrucción para añadir al prompt cuando se pide salida JSON."""
+    return f"\n{JSON_INSTRUCTION}{JSON_SHAPES[kind]}"
+
+def wants_json(prompt):
+    return JSON_INSTRUCTION in prompt
+
+def parse_json(text):
+    """Devuelve el JSON de ``text`` (admite bloque ```json) o None si no lo es."""
+    stripped = text.strip()
+    if stripped.startswith("```"):
+        match = _FENCE.match(stripped)
+        stripped = match.group(1) if match else stripped
+    if not stripped or stripped[0] not in "[{":
+        return None
+    try:
+        return json.loads(stripped)
+    except ValueError:
+        return None
+
+def _json_list(data, keys):
+    if isinstance(data, dict):
+        data = next((data[k] for k in keys if isinstance(data.get(k), list)), None)
+    return data if isinstance(data, list) else None
+
+
+def _objective_item(body):
+    return body.rstrip()
+
+def _loose_line(line):
+    return line.strip().strip("-• ")
+
+def _objectives_from_json(data):
+    items = _json_list(data, ("items", "objectives"))
+    if items is None:
+        return None
+    texts = (item if isinstance(item, str) else item.get("text", "") if isinstance(item, dict) else "" for item in items)
+    return [text.strip() for text in texts if text and text.strip()]
+
+def _resource_item(groups):
+    title, kind, url, summary = groups
+    return {"title": title, "type": kind.lower(), "url": url, "summary": summary.rstrip()}
+
+def _resources_from_json(data):
+    items = _json_list(data, ("items", "resources"))
+    if items is None:
+        return None
+    resources = []
+    for item in items:
+        if isinstance(item, dict) and item.get("title") and item.get("url"):
+            resources.append({
+                "title": str(item["title"]),
+                "type": str(item.get("type", "")).lower(),
+                "url": str(item["url"]),
+                "summary": str(item.get("summary") or item.get("description") or ""),
+            })
+    return resources
+
+
+class LineFormat:
+    """
+    Formato de salida orientado a líneas.
+
+    ``pattern`` reconoce los ítems (un grupo por campo) y ``item`` los
+    convierte; ``loose`` (opcional) arma el fallback a partir de las líneas
+    sueltas cuando no hay ningún ítem. ``from_json`` lee la salida
+    estructurada.
+    """
+
+    def __init__(self, pattern, item, from_json, loose=None):
+        self.pattern = pattern
+        self.item = item
+        self.from_json = from_json
+        self.loose = loose
+
+    def groups(self, match):
+        # findall devuelve el grupo solo si hay uno; finditer se normaliza igual
+        return match.group(1) if self.pattern.groups == 1 else match.groups()
+
+    def find(self, text, limit=None):
+        """Ítems reconocidos por la regex, en una sola pasada (sin JSON ni fallback)."""
+        if limit:
+            return [self.item(self.groups(m)) for m in islice(self.pattern.finditer(text), limit)]
+        return [self.item(groups) for groups in self.pattern.findall(text)]
+
+    def loose_lines(self, text):
+        if self.loose is None:
+            return []
+        return [line for line in map(self.loose, text.split("\n")) if line]
+
+    def parse(self, text, limit=None):
+        data = parse_json(text)
+        if data is not None:
+            items = self.from_json(data)
+            if items is not None:
+                return items[:limit] if limit else items
+        items = self.find(text, limit)
+        if items:
+            return items
+        # Sin ítems reconocibles: solo entonces se miran las líneas sueltas
+        loose = self.loose_lines(text)
+        return loose[:limit] if limit else loose
+
+    def stream(self, limit=None):
+        return StreamParser(self, limit)
+
+
+class StreamParser:
+    """
+    Parser incremental sobre un flujo de fragmentos.
+
+    ``feed(chunk)`` devuelve los ítems nuevos cuyas líneas ya se completaron;
+    ``close()`` procesa la última línea (y el fallback si no hubo ítems).
+    Una salida que empieza como JSON se acumula y se parsea al cerrar.
+    Con ``limit``, ``done`` indica que ya se tienen suficientes ítems.
+    """
+
+    def __init__(self, line_format, limit=None):
+        self.format = line_format
+        self.limit = limit
+        self.items = []
+        self._loose = []
+        self._buffer = ""
+        self._json = None
+
+    @property
+    def done(self):
+        return bool(self.limit) and len(self.items) >= self.limit
+
+    def feed(self, chunk):
+        if self._json is not None:
+            self._json += chunk
+            return []
+        self._buffer += chunk
+        if not self.items and not self._loose:
+            head = self._buffer.lstrip()
+            if head[:1] in ("{", "[", "`"):
+                self._json, self._buffer = self._buffer, ""
+                return []
+        if "\n" not in chunk:
+            return []
+        complete, self._buffer = self._buffer.rsplit("\n", 1)
+        return self._consume(complete)
+
+    def _consume(self, block):
+        # Cada bloque de líneas completas se recorre una sola vez con la regex compilada
+        if self.done:
+            return []
+        new = self.format.find(block, self.limit - len(self.items) if self.limit else None)
+        if new:
+            self.items.extend(new)
+        elif not self.items:
+            self._loose.extend(self.format.loose_lines(block))
+        return new
+
+    def close(self):
+        if self._json is not None:
+            self.items = self.format.parse(self._json, self.limit)
+            self._json = None
+            return list(self.items)
+        new = self._consume(self._buffer)
+        self._buffer = ""
+        if not self.items and self._loose:
+            self.items = self._loose[:self.limit] if self.limit else self._loose
+            return list(self.items)
+        return new
+
+
+OBJECTIVES = LineFormat(_LIST_ITEM, _objective_item, _objectives_from_json, loose=_loose_line)
+RESOURCES = LineFormat(_RESOURCE_ITEM, _resource_item, _resources_from_json)
+
+def parse_objectives(text, limit=None):
+    """Ítems de una lista numerada o con viñetas; si no hay, las líneas no vacías."""
+    return OBJECTIVES.parse(text, limit)
+
+def parse_resources(text, limit=None):
+    """Recursos ``{title, type, url, summary}``; lista vacía si no se reconoce ninguno."""
+    return RESOURCES.parse(text, limit)
+
+def _rubric_from_json(data, text=""):
+    if isinstance(data, dict):
+        if isinstance(data.get("rubric"), str):
+            return data["rubric"]
+        if isinstance(data.get("levels"), list):
+            lines = []
+            for position, level in enumerate(data["levels"], 1):
+                if not isinstance(level, dict):
+                    continue
+                number = level.get("level", position)
+                label = level.get("label") or RUBRIC_LABELS.get(number, "")
+                lines.append(f"Nivel {number} ({label}): {level.get('description', '')}".replace(" ()", ""))
+            return "\n".join(lines)
+    return text
+
+def parse_rubric(text):
+    """Texto de la rúbrica si tiene el formato por niveles, o ""."""
+    text = _rubric_from_json(parse_json(text), text)
+    return text if "Nivel 1" in text else ""
+
+def useful_objectives(objectives):
+    """False si la lista está vacía o el modelo repitió la instrucción en vez de responderla."""
+    return bool(objectives) and not (
+        len(objectives) == 1 and ("Redacta" in objectives[0] or "objetivo" in objectives[0].lower())
+        or len(objectives[0]) < 25
+    )
+
+def useful_activity(activity):
+    return bool(activity) and "Redacta" not in activity and len(activity) >= 25
+
+def _first_item(text):
+    items = parse_objectives(text, limit=1)
+    return items[0] if items else ""
+
+def split_sections(text):
+    """``{sección: texto}`` de una salida con encabezados de ``SUGGEST_SECTIONS``."""
+    sections = {}
+    matches = list(_SECTION.finditer(text))
+    for match, following in zip(matches, matches[1:] + [None]):
+        name = SUGGEST_SECTIONS[match.group(1).lower().replace("ú", "u")]
+        end = following.start() if following else len(text)
+        sections.setdefault(name, text[match.end():end].strip())
+    return sections
+
+def parse_suggestion(text, n_objectives=None, n_resources=None):
+    """
+    Secciones de la sugerencia combinada: ``objectives`` (lista), ``activity``
+    (texto), ``resources`` (lista de dicts) y ``rubric`` (texto). Cada sección
+    se lee con el mismo parser que su endpoint; las que faltan quedan vacías.
+    """
+    data = parse_json(text)
+    if isinstance(data, dict):
+        activity = data.get("activity")
+        rubric = _rubric_from_json(data.get("rubric"), data.get("rubric") if isinstance(data.get("rubric"), str) else "")
+        return {
+            "objectives": (_objectives_from_json(data.get("objectives")) or [])[:n_objectives],
+            "activity": activity.strip() if isinstance(activity, str) else "",
+            "resources": (_resources_from_json(data.get("resources")) or [])[:n_resources],
+            "rubric": rubric if "Nivel 1" in rubric else "",
+        }
+    sections = split_sections(text)
+    return {
+        "objectives": parse_objectives(sections.get("objectives", ""), n_objectives),
+        "activity": _first_item(sections.get("activity", "")),
+        "resources": parse_resources(sections.get("resources", ""), n_resources),
+        "rubric": parse_rubric(sections.get("rubric", "")),
+    }
@@ -1,67 +1,1000 @@
+import asyncio
+import json
 import os
-import re
+import queue
+import threading
+import time
+import weakref
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
 
+import httpx
 
-def query_llm(prompt, extract_fn, n=3):
-    # 1. Local
-    try:
+import metrics
+from core import CACHE_DIR
+from llm_cache import CACHE_ENABLED, cache_key, response_cache
+from llm_parsers import (
+    JSON_MODE, OBJECTIVES, RESOURCES, json_hint, parse_objectives, parse_resources, parse_rubric, parse_suggestion,
+    useful_activity, useful_objectives, wants_json,
+)
+
+
+LOCAL_MODEL = os.getenv("LLM_LOCAL_MODEL", "google/flan-t5-small")
+# transformers (fp32) | int8 (cuantización dinámica) | onnx (ONNX Runtime) | gguf (llama.cpp)
+LOCAL_RUNTIME = os.getenv("LLM_LOCAL_RUNTIME", "transformers")
+LOCAL_MODELS_DIR = Path(os.getenv("LLM_LOCAL_MODELS_DIR", CACHE_DIR / "models"))
+ONNX_MODEL = os.getenv("LLM_ONNX_MODEL", str(LOCAL_MODELS_DIR / (LOCAL_MODEL.replace("/", "--") + "-onnx")))
+GGUF_MODEL = os.getenv("LLM_GGUF_MODEL", "")
+# Hilos de inferencia por proceso (0 = lo que decida el runtime)
+LOCAL_THREADS = int(os.getenv("LLM_LOCAL_THREADS", "0"))
+HF_MODEL = os.getenv("LLM_HF_MODEL", "mistralai/Mixtral-8x7B-Instruct-v0.1")
+OPENAI_MODEL = os.getenv("LLM_OPENAI_MODEL", "gpt-3.5-turbo")
+DEFAULT_SYSTEM_PROMPT = "Eres un asistente pedagógico experto en educación superior."
+HTTP_TIMEOUT = float(os.getenv("LLM_HTTP_TIMEOUT", "30"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("LLM_HTTP_CONNECT_TIMEOUT", "5"))
+BATCH_WINDOW_MS = float(os.getenv("LLM_BATCH_WINDOW_MS", "20"))
+BATCH_MAX_SIZE = int(os.getenv("LLM_BATCH_MAX_SIZE", "8"))
+# sequential: local -> HF -> OpenAI de a uno | race: todos en paralelo |
+# hedge: lanza el siguiente si el actual supera su percentil de latencia
+DISPATCH_POLICY = os.getenv("LLM_DISPATCH", "sequential")
+HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+HEDGE_DEFAULT_MS = float(os.getenv("LLM_HEDGE_DEFAULT_MS", "2000"))
+BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "3"))
+BREAKER_RESET_S = float(os.getenv("LLM_BREAKER_RESET_S", "30"))
+# Cortar la generación en cuanto el extractor reconoce los n ítems pedidos
+EARLY_STOP = os.getenv("LLM_EARLY_STOP", "1") != "0"
+
+
+class CircuitBreaker:
+    """
+    Corta un backend tras ``failure_threshold`` errores consecutivos.
+
+    Mientras está abierto el backend se salta sin intentarlo; pasado
+    ``reset_timeout`` se deja pasar una petición de prueba (half-open) y el
+    circuito se cierra de nuevo si tiene éxito.
+    """
+
+    def __init__(self, failure_threshold=BREAKER_FAILURES, reset_timeout=BREAKER_RESET_S):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_cancelled(self):
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+
+class MicroBatcher:
+    """
+    Cola de micro-batching delante de un modelo local.
+
+    Un único hilo recoge los prompts que llegan dentro de ``window_ms`` (hasta
+    ``max_batch_size``), los genera en una sola llamada y devuelve cada
+    resultado a la petición que lo espera. Un prompt enviado con ``stop`` (ver
+    ``_stop_condition``) deja de generar dentro del batch en cuanto su parser
+    reconoce los ítems pedidos, sin detener al resto.
+    """
+
+    def __init__(self, generate_batch, window_ms=BATCH_WINDOW_MS, max_batch_size=BATCH_MAX_SIZE):
+        self._generate_batch = generate_batch
+        self.window = window_ms / 1000
+        self.max_batch_size = max_batch_size
+        self._queue = queue.Queue()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._requests = 0
+        self._batch_sizes = {}
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def submit(self, prompt, max_new_tokens, stop=None):
+        future = Future()
+        self._ensure_worker()
+        self._queue.put((prompt, max_new_tokens, stop, time.perf_counter(), future))
+        return future
+
+    def _ensure_worker(self):
+        if self._thread is None:
+            with self._thread_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="llm-microbatcher", daemon=True)
+                    self._thread.start()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            self._record(len(batch), [started - enqueued for _, _, _, enqueued, _ in batch])
+            # Solo se agrupan prompts con el mismo presupuesto de tokens
+            groups = {}
+            for item in batch:
+                groups.setdefault(item[1], []).append(item)
+            for max_new_tokens, items in groups.items():
+                # Descarta las peticiones canceladas (p. ej. perdedoras de una carrera)
+                items = [item for item in items if item[4].set_running_or_notify_cancel()]
+                if not items:
+                    continue
+                prompts = [prompt for prompt, _, _, _, _ in items]
+                stops = [stop for _, _, stop, _, _ in items]
+                try:
+                    if any(stops):
+                        outputs = self._generate_batch(prompts, max_new_tokens, stops)
+                    else:
+                        outputs = self._generate_batch(prompts, max_new_tokens)
+                    for (_, _, _, _, future), text in zip(items, outputs):
+                        future.set_result(text)
+                except Exception as e:
+                    for _, _, _, _, future in items:
+                        future.set_exception(e)
+
+    def _record(self, size, waits):
+        with self._stats_lock:
+            self._batches += 1
+            self._requests += size
+            self._batch_sizes[size] = self._batch_sizes.get(size, 0) + 1
+            self._wait_total += sum(waits)
+            self._wait_max = max(self._wait_max, *waits)
+        metrics.LLM_BATCH_SIZE.observe(size)
+        for wait in waits:
+            metrics.LLM_BATCH_QUEUE_WAIT_SECONDS.observe(wait)
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "window_ms": self.window * 1000,
+                "max_batch_size": self.max_batch_size,
+                "queue_depth": self._queue.qsize(),
+                "batches": self._batches,
+                "requests": self._requests,
+                "avg_batch_size": self._requests / self._batches if self._batches else 0.0,
+                "batch_size_histogram": dict(sorted(self._batch_sizes.items())),
+                "avg_queue_wait_ms": 1000 * self._wait_total / self._requests if self._requests else 0.0,
+                "max_queue_wait_ms": 1000 * self._wait_max,
+            }
+
+
+class LLMBackend:
+    """
+    Backend de generación compartido por todo el proceso.
+
+    Cada backend limita cuántas generaciones corren a la vez con un semáforo,
+    de modo que todos los endpoints comparten la misma capacidad.
+    """
+    name = ""
+
+    def __init__(self, model, max_concurrency=4):
+        self.model = model
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self.breaker = CircuitBreaker()
+        self._latencies = deque(maxlen=200)
+
+    def available(self):
+        return True
+
+    def record_latency(self, seconds):
+        self._latencies.append(seconds)
+
+    def latency_percentile(self, percentile):
+        if not self._latencies:
+            return None
+        ordered = sorted(self._latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * percentile / 100))
+        return ordered[index]
+
+    def hedge_delay(self):
+        latency = self.latency_percentile(HEDGE_PERCENTILE)
+        return latency if latency is not None else HEDGE_DEFAULT_MS / 1000
+
+    def generate(self, prompt, max_new_tokens=256, chat_max_tokens=500, system=DEFAULT_SYSTEM_PROMPT):
+        with self._slots:
+            return self._generate(prompt, max_new_tokens, chat_max_tokens, system)
+
+    async def agenerate(self, prompt, max_new_tokens=256, chat_max_tokens=500, system=DEFAULT_SYSTEM_PROMPT):
+        return await asyncio.to_thread(self.generate, prompt, max_new_tokens, chat_max_tokens, system)
+
+    async def astream(self, prompt, max_new_tokens=256, chat_max_tokens=500, system=DEFAULT_SYSTEM_PROMPT):
+        """Genera el texto en fragmentos; por defecto, un único fragmento final."""
+        yield await self.agenerate(prompt, max_new_tokens, chat_max_tokens, system)
+
+    def _generate(self, prompt, max_new_tokens, chat_max_tokens, system):
+        raise NotImplementedError
+
+    def stats(self):
+        p50 = self.latency_percentile(50)
+        p95 = self.latency_percentile(95)
+        return {
+            "circuit": self.breaker.state,
+            "latency_p50_ms": p50 * 1000 if p50 is not None else None,
+            "latency_p95_ms": p95 * 1000 if p95 is not None else None,
+        }
+
+
+SEQ2SEQ_TASK = "text2text-generation"
+
+def generation_task(model, **kwargs):
+    """Tarea de pipeline para ``model``: los encoder-decoder (p. ej. flan-t5) no son ``text-generation``."""
+    from transformers import AutoConfig
+    return SEQ2SEQ_TASK if AutoConfig.from_pretrained(model, **kwargs).is_encoder_decoder else "text-generation"
+
+
+class LocalBackend(LLMBackend):
+    """
+    Pipeline de transformers cargado una sola vez y mantenido en memoria.
+
+    Con ``max_batch_size`` > 1 las peticiones concurrentes pasan por un
+    MicroBatcher; su hilo es el único que llama al modelo.
+    """
+    name = "local"
+    runtime = "transformers"
+
+    def __init__(self, model, max_concurrency=1, window_ms=BATCH_WINDOW_MS, max_batch_size=BATCH_MAX_SIZE, threads=LOCAL_THREADS):
+        super().__init__(model, max_concurrency)
+        self.threads = threads
+        self._pipe = None
+        self._load_error = None
+        self._load_lock = threading.Lock()
+        self.batcher = MicroBatcher(self._generate_batch, window_ms, max_batch_size) if max_batch_size > 1 else None
+
+    def load(self):
+        if self._pipe is None:
+            with self._load_lock:
+                if self._load_error is not None:
+                    raise self._load_error
+                if self._pipe is None:
+                    try:
+                        with metrics.stage("model_load", backend=self.name):
+                            self._pipe = self._load_pipeline()
+                    except Exception as e:
+                        # No reintentar la carga (segundos de CPU) en cada petición
+                        self._load_error = e
+                        raise
+        return self._pipe
+
+    def _set_torch_threads(self):
+        if self.threads:
+            import torch
+            torch.set_num_threads(self.threads)
+
+    def _load_pipeline(self):
         from transformers import pipeline
-        MODEL_NAME = "google/flan-t5-small"
-        pipe = pipeline("text-generation", model=MODEL_NAME, trust_remote_code=True)
-        outputs = pipe(prompt, max_new_tokens=256)
-        raw = outputs[0]["generated_text"]
-        results = extract_fn(raw)
-        if results:
-            return results
-    except Exception as e:
-        print(f"[INFO] No se pudo usar modelo local: {e}")
+        self._set_torch_threads()
+        task = generation_task(self.model, trust_remote_code=True)
+        return self._prepare(pipeline(task, model=self.model, trust_remote_code=True))
 
-    # 2. HuggingFace Inference API
-    try:
-        HF_API_TOKEN = os.getenv("HF_API_TOKEN")
-        if HF_API_TOKEN:
-            import requests
-            api_url = "https://api-inference.huggingface.co/models/mistralai/Mixtral-8x7B-Instruct-v0.1"
-            headers = {"Authorization": f"Bearer {HF_API_TOKEN}"}
-            payload = {"inputs": prompt, "parameters": {"max_new_tokens": 256}}
-            response = requests.post(api_url, headers=headers, json=payload, timeout=30)
+    @staticmethod
+    def _prepare(pipe):
+        # Necesario para rellenar (padding) prompts de distinto largo en un batch
+        if pipe.tokenizer.pad_token is None:
+            pipe.tokenizer.pad_token = pipe.tokenizer.eos_token
+        pipe.tokenizer.padding_side = "left"
+        return pipe
+
+    def generate(self, prompt, max_new_tokens=256, chat_max_tokens=500, system=DEFAULT_SYSTEM_PROMPT):
+        if self.batcher is None:
+            return super().generate(prompt, max_new_tokens, chat_max_tokens, system)
+        self.load()
+        return self.batcher.submit(prompt, max_new_tokens).result()
+
+    async def agenerate(self, prompt, max_new_tokens=256, chat_max_tokens=500, system=DEFAULT_SYSTEM_PROMPT):
+        if self.batcher is None:
+            return await super().agenerate(prompt, max_new_tokens, chat_max_tokens, system)
+        if self._pipe is None:
+            await asyncio.to_thread(self.load)
+        return await asyncio.wrap_future(self.batcher.submit(prompt, max_new_tokens))
+
+    def generate_until(self, prompt, max_new_tokens, stop):
+        """Como ``generate`` por el batcher, cortando esta secuencia cuando ``stop()`` reconoce sus ítems."""
+        self.load()
+        return self.batcher.submit(prompt, max_new_tokens, stop).result()
+
+    async def agenerate_until(self, prompt, max_new_tokens, stop):
+        if self._pipe is None:
+            await asyncio.to_thread(self.load)
+        return await asyncio.wrap_future(self.batcher.submit(prompt, max_new_tokens, stop))
+
+    async def astream(self, prompt, max_new_tokens=256, chat_max_tokens=500, system=DEFAULT_SYSTEM_PROMPT):
+        # El streaming no pasa por el batcher: cada token se emite en cuanto se genera
+        from transformers import StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+        pipe = self._pipe or await asyncio.to_thread(self.load)
+        streamer = TextIteratorStreamer(pipe.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        stop = threading.Event()
+        errors = []
+
+        class StopWhenClosed(StoppingCriteria):
+            # Si el consumidor deja de leer (p. ej. parada temprana) el modelo deja de generar
+            def __call__(self, input_ids, scores, **kwargs):
+                return stop.is_set()
+
+        def run():
+            try:
+                with self._slots:
+                    pipe(
+                        prompt, max_new_tokens=max_new_tokens, streamer=streamer,
+                        stopping_criteria=StoppingCriteriaList([StopWhenClosed()]),
+                    )
+            except Exception as e:
+                errors.append(e)
+                streamer.end()
+
+        threading.Thread(target=run, name="llm-stream", daemon=True).start()
+        try:
+            while True:
+                chunk = await asyncio.to_thread(next, streamer, None)
+                if chunk is None:
+                    break
+                if chunk:
+                    yield chunk
+        finally:
+            stop.set()
+        if errors:
+            raise errors[0]
+
+    def _generate(self, prompt, max_new_tokens, chat_max_tokens, system):
+        return self._generate_batch([prompt], max_new_tokens)[0]
+
+    def _generate_batch(self, prompts, max_new_tokens, stops=None):
+        pipe = self.load()
+        parsers = [stop() if stop else None for stop in stops or ()]
+        kwargs = {}
+        if any(parser is not None for parser in parsers):
+            kwargs["stopping_criteria"] = _stop_sequences(pipe.tokenizer, parsers)
+        if getattr(pipe, "task", None) == "text-generation":
+            # Sin el prompt repetido: el extractor ve lo mismo que en streaming (skip_prompt)
+            kwargs["return_full_text"] = False
+        outputs = pipe(prompts, max_new_tokens=max_new_tokens, batch_size=len(prompts), **kwargs)
+        # text-generation devuelve una lista por prompt; text2text-generation, un dict
+        texts = [(out[0] if isinstance(out, list) else out)["generated_text"] for out in outputs]
+        for i, parser in enumerate(parsers):
+            if parser is not None and parser.done:
+                # Igual que en _generate_until: se descarta la línea que quedó a medias
+                metrics.LLM_EARLY_STOPS.labels(backend=self.name).inc()
+                texts[i] = texts[i][:texts[i].rfind("\n") + 1]
+        return texts
+
+    def stats(self):
+        stats = super().stats()
+        stats.update({"runtime": self.runtime, "model": self.model, "threads": self.threads or None, "loaded": self._pipe is not None})
+        if self.batcher:
+            stats["batching"] = self.batcher.stats()
+        return stats
+
+
+def _stop_sequences(tokenizer, parsers):
+    """
+    Criterio de parada por fila para un batch de ``generate``.
+
+    Cada fila con parser se da por terminada cuando este reconoce sus ítems;
+    las demás siguen generando y el batch termina cuando terminan todas.
+    """
+    import torch
+    from transformers import StoppingCriteria, StoppingCriteriaList
+
+    class StopSequences(StoppingCriteria):
+        def __init__(self):
+            self.start = None
+            self.seen = [""] * len(parsers)
+
+        def __call__(self, input_ids, scores, **kwargs):
+            if self.start is None:
+                # La primera llamada llega con un solo token generado
+                self.start = input_ids.shape[1] - 1
+            for i, parser in enumerate(parsers):
+                if parser is None or parser.done:
+                    continue
+                text = tokenizer.decode(input_ids[i, self.start:], skip_special_tokens=True)
+                parser.feed(text[len(self.seen[i]):])
+                self.seen[i] = text
+            return torch.tensor([parser is not None and parser.done for parser in parsers], device=input_ids.device)
+
+    return StoppingCriteriaList([StopSequences()])
+
+
+class Int8LocalBackend(LocalBackend):
+    """El mismo modelo de transformers con las capas lineales cuantizadas a int8 al cargar."""
+    name = "local-int8"
+    runtime = "int8"
+
+    def _load_pipeline(self):
+        import torch
+        from transformers import AutoModelForCausalLM, AutoModelForSeq2SeqLM, AutoTokenizer, pipeline
+        self._set_torch_threads()
+        task = generation_task(self.model, trust_remote_code=True)
+        model_class = AutoModelForSeq2SeqLM if task == SEQ2SEQ_TASK else AutoModelForCausalLM
+        model = model_class.from_pretrained(self.model, trust_remote_code=True)
+        model = torch.quantization.quantize_dynamic(model.eval(), {torch.nn.Linear}, dtype=torch.qint8)
+        tokenizer = AutoTokenizer.from_pretrained(self.model)
+        return self._prepare(pipeline(task, model=model, tokenizer=tokenizer))
+
+
+class ONNXLocalBackend(LocalBackend):
+    """
+    Modelo exportado con ``python cli.py export-model`` servido por ONNX Runtime.
+
+    Si el directorio tiene archivos ``*_quantized.onnx`` (export con
+    ``--quantize``) se usan esos.
+    """
+    name = "local-onnx"
+    runtime = "onnx"
+
+    def available(self):
+        return Path(self.model).is_dir()
+
+    def _load_pipeline(self):
+        import onnxruntime
+        from optimum.onnxruntime import ORTModelForCausalLM, ORTModelForSeq2SeqLM
+        from transformers import AutoTokenizer, pipeline
+
+        options = onnxruntime.SessionOptions()
+        if self.threads:
+            options.intra_op_num_threads = self.threads
+            options.inter_op_num_threads = 1
+        path = Path(self.model)
+        quantized = {f.name.replace("_quantized.onnx", ""): f.name for f in path.glob("*_quantized.onnx")}
+        task = generation_task(path)
+        if task == SEQ2SEQ_TASK:
+            files = {f"{part}_file_name": quantized[part] for part in ("encoder_model", "decoder_model", "decoder_with_past_model") if part in quantized}
+            model = ORTModelForSeq2SeqLM.from_pretrained(path, session_options=options, **files)
+        else:
+            files = {"file_name": quantized["model"]} if "model" in quantized else {}
+            model = ORTModelForCausalLM.from_pretrained(path, session_options=options, **files)
+        return self._prepare(pipeline(task, model=model, tokenizer=AutoTokenizer.from_pretrained(path)))
+
+
+class GGUFLocalBackend(LocalBackend):
+    """
+    Modelo GGUF (normalmente cuantizado a 4-8 bits) servido por llama.cpp.
+
+    llama.cpp no admite llamadas concurrentes sobre el mismo modelo: se
+    genera de a un prompt, sin micro-batching.
+    """
+    name = "local-gguf"
+    runtime = "gguf"
+
+    def __init__(self, model, max_concurrency=1, window_ms=BATCH_WINDOW_MS, max_batch_size=1, threads=LOCAL_THREADS):
+        super().__init__(model, 1, window_ms, 1, threads)
+
+    def available(self):
+        return bool(self.model) and Path(self.model).is_file()
+
+    def _load_pipeline(self):
+        from llama_cpp import Llama
+        return Llama(
+            model_path=self.model,
+            n_ctx=int(os.getenv("LLM_GGUF_CONTEXT", "2048")),
+            n_threads=self.threads or None,
+            verbose=False,
+        )
+
+    def _generate_batch(self, prompts, max_new_tokens, stops=None):
+        llm = self.load()
+        return [llm(prompt, max_tokens=max_new_tokens, temperature=0.0)["choices"][0]["text"] for prompt in prompts]
+
+    async def astream(self, prompt, max_new_tokens=256, chat_max_tokens=500, system=DEFAULT_SYSTEM_PROMPT):
+        llm = self._pipe or await asyncio.to_thread(self.load)
+        await asyncio.to_thread(self._slots.acquire)
+        chunks = llm(prompt, max_tokens=max_new_tokens, temperature=0.0, stream=True)
+        try:
+            while True:
+                event = await asyncio.to_thread(next, chunks, None)
+                if event is None:
+                    break
+                text = event["choices"][0]["text"]
+                if text:
+                    yield text
+        finally:
+            # Cerrar el generador de llama.cpp detiene la generación (parada temprana)
+            chunks.close()
+            self._slots.release()
+
+
+LOCAL_RUNTIMES = {
+    "transformers": (LocalBackend, LOCAL_MODEL),
+    "int8": (Int8LocalBackend, LOCAL_MODEL),
+    "onnx": (ONNXLocalBackend, ONNX_MODEL),
+    "gguf": (GGUFLocalBackend, GGUF_MODEL),
+}
+_local_backends = {}
+_local_backends_lock = threading.Lock()
+
+def local_backend(runtime=LOCAL_RUNTIME):
+    """Backend local compartido del proceso para ``runtime``."""
+    backend = _local_backends.get(runtime)
+    if backend is None:
+        if runtime not in LOCAL_RUNTIMES:
+            raise ValueError(f"Runtime local desconocido: {runtime}")
+        with _local_backends_lock:
+            backend = _local_backends.get(runtime)
+            if backend is None:
+                cls, model = LOCAL_RUNTIMES[runtime]
+                backend = _local_backends[runtime] = cls(model, int(os.getenv("LLM_LOCAL_CONCURRENCY", "1")))
+    return backend
+
+
+class HTTPBackend(LLMBackend):
+    """
+    Backend remoto con clientes httpx compartidos (keep-alive).
+
+    El límite de conexiones del pool es el límite de concurrencia del
+    backend. El cliente asíncrono se crea por event loop porque sus
+    conexiones quedan ligadas al loop en que se abrieron.
+    """
+
+    def __init__(self, model, max_concurrency=8):
+        super().__init__(model, max_concurrency)
+        self.max_connections = max_concurrency
+        self._client = None
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._clients_lock = threading.Lock()
+
+    def _client_options(self):
+        return {
+            "timeout": httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            "limits": httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections,
+            ),
+        }
+
+    def client(self):
+        if self._client is None:
+            with self._clients_lock:
+                if self._client is None:
+                    self._client = httpx.Client(**self._client_options())
+        return self._client
+
+    def async_client(self):
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = httpx.AsyncClient(**self._client_options())
+            self._async_clients[loop] = client
+        return client
+
+    async def aclose(self):
+        client = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+    def _generate(self, prompt, max_new_tokens, chat_max_tokens, system):
+        url, headers, payload = self._request(prompt, max_new_tokens, chat_max_tokens, system)
+        response = self.client().post(url, headers=headers, json=payload)
+        response.raise_for_status()
+        return self._parse(response.json())
+
+    async def agenerate(self, prompt, max_new_tokens=256, chat_max_tokens=500, system=DEFAULT_SYSTEM_PROMPT):
+        url, headers, payload = self._request(prompt, max_new_tokens, chat_max_tokens, system)
+        response = await self.async_client().post(url, headers=headers, json=payload)
+        response.raise_for_status()
+        return self._parse(response.json())
+
+    async def astream(self, prompt, max_new_tokens=256, chat_max_tokens=500, system=DEFAULT_SYSTEM_PROMPT):
+        url, headers, payload = self._request(prompt, max_new_tokens, chat_max_tokens, system)
+        payload["stream"] = True
+        async with self.async_client().stream("POST", url, headers=headers, json=payload) as response:
             response.raise_for_status()
-            output = response.json()
-            raw = output[0]["generated_text"] if isinstance(output, list) and "generated_text" in output[0] else output[0] if output else ""
-            results = extract_fn(raw)
-            if results:
-                return results
+            async for line in response.aiter_lines():
+                # Server-sent events: "data: {...}" por evento, "data: [DONE]" al final
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                chunk = self._parse_stream_event(json.loads(data))
+                if chunk:
+                    yield chunk
+
+    def _request(self, prompt, max_new_tokens, chat_max_tokens, system):
+        raise NotImplementedError
+
+    def _parse(self, output):
+        raise NotImplementedError
+
+    def _parse_stream_event(self, event):
+        raise NotImplementedError
+
+
+class HuggingFaceBackend(HTTPBackend):
+    name = "huggingface"
+
+    def available(self):
+        return bool(os.getenv("HF_API_TOKEN"))
+
+    def _request(self, prompt, max_new_tokens, chat_max_tokens, system):
+        api_url = f"https://api-inference.huggingface.co/models/{self.model}"
+        headers = {"Authorization": f"Bearer {os.getenv('HF_API_TOKEN')}"}
+        payload = {"inputs": prompt, "parameters": {"max_new_tokens": max_new_tokens}}
+        return api_url, headers, payload
+
+    def _parse(self, output):
+        return output[0]["generated_text"] if isinstance(output, list) and "generated_text" in output[0] else output[0] if output else ""
+
+    def _parse_stream_event(self, event):
+        token = event.get("token") or {}
+        return "" if token.get("special") else token.get("text", "")
+
+
+class OpenAIBackend(HTTPBackend):
+    name = "openai"
+
+    def available(self):
+        return bool(os.getenv("OPENAI_API_KEY"))
+
+    def _request(self, prompt, max_new_tokens, chat_max_tokens, system):
+        api_url = f"{os.getenv('OPENAI_BASE_URL', 'https://api.openai.com/v1')}/chat/completions"
+        headers = {"Authorization": f"Bearer {os.getenv('OPENAI_API_KEY')}"}
+        payload = {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": system},
+                {"role": "user", "content": prompt}
+            ],
+            "max_tokens": chat_max_tokens,
+            "n": 1,
+            "temperature": 0.3,
+        }
+        if wants_json(prompt):
+            payload["response_format"] = {"type": "json_object"}
+        return api_url, headers, payload
+
+    def _parse(self, output):
+        return output["choices"][0]["message"]["content"]
+
+    def _parse_stream_event(self, event):
+        choices = event.get("choices") or [{}]
+        return (choices[0].get("delta") or {}).get("content") or ""
+
+
+# Orden de fallback: local -> HuggingFace -> OpenAI
+BACKENDS = [
+    local_backend(LOCAL_RUNTIME),
+    HuggingFaceBackend(HF_MODEL, int(os.getenv("LLM_HF_CONCURRENCY", "8"))),
+    OpenAIBackend(OPENAI_MODEL, int(os.getenv("LLM_OPENAI_CONCURRENCY", "8"))),
+]
+
+_CIRCUIT_STATES = {"closed": 0, "half-open": 1, "open": 2}
+
+metrics.gauge(
+    "pedagogy_llm_circuit_state", "Estado del circuit breaker por backend (0 cerrado, 1 half-open, 2 abierto).",
+    ("backend",), lambda: {(b.name,): _CIRCUIT_STATES[b.breaker.state] for b in all_backends()},
+)
+metrics.gauge(
+    "pedagogy_llm_batch_queue_depth", "Prompts esperando en la cola de micro-batching.",
+    ("backend",), lambda: {(b.name,): b.batcher.stats()["queue_depth"] for b in all_backends() if getattr(b, "batcher", None)},
+)
+
+def get_backend(name):
+    return next((b for b in BACKENDS if b.name == name), None)
+
+def _backends_for(runtime):
+    """BACKENDS con el backend local cambiado por el del runtime pedido."""
+    if not runtime:
+        return BACKENDS
+    return [local_backend(runtime) if isinstance(b, LocalBackend) else b for b in BACKENDS]
+
+def all_backends():
+    """BACKENDS más los backends locales de otros runtimes ya creados."""
+    return BACKENDS + [b for b in list(_local_backends.values()) if b not in BACKENDS]
+
+def warm_up():
+    """Carga los modelos locales (todos los runtimes configurados) al arrancar."""
+    runtimes = {LOCAL_RUNTIME, *(params["runtime"] for params in ENDPOINT_PARAMS.values())}
+    for runtime in sorted(runtimes):
+        backend = local_backend(runtime)
+        if not backend.available():
+            continue
+        try:
+            backend.load()
+        except Exception as e:
+            print(f"[INFO] No se pudo precargar el modelo local ({runtime}): {e}")
+
+async def aclose_backends():
+    for backend in BACKENDS:
+        if isinstance(backend, HTTPBackend):
+            await backend.aclose()
+
+
+def _cache_plan(prompt, extract_fn, n, max_new_tokens, chat_max_tokens, system, runtime=None):
+    backends = [b for b in _backends_for(runtime) if b.available()]
+    params = {
+        "extract": extract_fn.__name__,
+        "n": n,
+        "max_new_tokens": max_new_tokens,
+        "chat_max_tokens": chat_max_tokens,
+        "system": system,
+    }
+    keys = [cache_key(b.name, b.model, params, prompt) for b in backends]
+    return backends, keys
+
+def _generation_failed(backend, started, error):
+    backend.breaker.record_failure()
+    metrics.LLM_GENERATION_SECONDS.labels(backend=backend.name, outcome="error").observe(time.perf_counter() - started)
+    metrics.LLM_FALLBACKS.labels(backend=backend.name, reason="error").inc()
+    print(f"[INFO] No se pudo usar backend {backend.name}: {error}")
+
+def _generation_done(backend, started, raw, extract_fn):
+    elapsed = time.perf_counter() - started
+    backend.record_latency(elapsed)
+    backend.breaker.record_success()
+    with metrics.stage("extraction", backend=backend.name):
+        results = extract_fn(raw) or None
+    metrics.LLM_GENERATION_SECONDS.labels(backend=backend.name, outcome="ok" if results else "empty").observe(elapsed)
+    if not results:
+        metrics.LLM_FALLBACKS.labels(backend=backend.name, reason="empty").inc()
+    return results
+
+async def _generate_until(backend, parser, prompt, max_new_tokens, chat_max_tokens, system):
+    """
+    Genera en streaming y corta en cuanto ``parser`` reconoce sus ítems.
+
+    Al cerrar el stream el backend deja de generar (se cierra la conexión
+    HTTP o se detiene el pipeline local). Si se cortó, el texto se recorta
+    a la última línea completa para no extraer un ítem a medias.
+    """
+    chunks = backend.astream(prompt, max_new_tokens, chat_max_tokens, system)
+    parts = []
+    try:
+        async for chunk in chunks:
+            parts.append(chunk)
+            parser.feed(chunk)
+            if parser.done:
+                break
+    finally:
+        await chunks.aclose()
+    text = "".join(parts)
+    if not parser.done:
+        return text
+    metrics.LLM_EARLY_STOPS.labels(backend=backend.name).inc()
+    return text[:text.rfind("\n") + 1]
+
+def _run_sync(coro):
+    """
+    Ejecuta una corrutina desde código síncrono con un loop propio.
+
+    Si el hilo ya tiene un loop corriendo (un handler síncrono llamado desde
+    un endpoint async) no se puede abrir otro en él: se usa un hilo auxiliar.
+    """
+    if _in_event_loop():
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="llm-sync") as pool:
+            return pool.submit(_run_sync, coro).result()
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.run_until_complete(aclose_backends())
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
+
+def _in_event_loop():
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+def _attempt(backend, prompt, extract_fn, max_new_tokens, chat_max_tokens, system, stop=None):
+    started = time.perf_counter()
+    try:
+        with metrics.stage("generation", backend=backend.name):
+            if stop is not None and getattr(backend, "batcher", None):
+                # Con micro-batching la parada es por secuencia dentro del batch, sin pasar por astream
+                raw = backend.generate_until(prompt, max_new_tokens, stop)
+            elif stop is not None:
+                raw = _run_sync(_generate_until(backend, stop(), prompt, max_new_tokens, chat_max_tokens, system))
+            else:
+                raw = backend.generate(prompt, max_new_tokens, chat_max_tokens, system)
     except Exception as e:
-        print(f"[INFO] No se pudo usar HuggingFace API: {e}")
+        _generation_failed(backend, started, e)
+        return None
+    return _generation_done(backend, started, raw, extract_fn)
 
-    # 3. OpenAI API
+async def _attempt_async(backend, prompt, extract_fn, max_new_tokens, chat_max_tokens, system, stop=None):
+    started = time.perf_counter()
     try:
-        OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-        if OPENAI_API_KEY:
-            import openai
-            openai.api_key = OPENAI_API_KEY
-            messages = [
-                {"role": "system", "content": "Eres un asistente pedagógico experto en educación superior."},
-                {"role": "user", "content": prompt}
-            ]
-            chat_resp = openai.ChatCompletion.create(
-                model="gpt-3.5-turbo",
-                messages=messages,
-                max_tokens=500,
-                n=1,
-                stop=None,
-                temperature=0.3,
-            )
-            raw = chat_resp.choices[0].message.content
-            results = extract_fn(raw)
-            if results:
-                return results
+        with metrics.stage("generation", backend=backend.name):
+            if stop is not None and getattr(backend, "batcher", None):
+                raw = await backend.agenerate_until(prompt, max_new_tokens, stop)
+            elif stop is not None:
+                raw = await _generate_until(backend, stop(), prompt, max_new_tokens, chat_max_tokens, system)
+            else:
+                raw = await backend.agenerate(prompt, max_new_tokens, chat_max_tokens, system)
+    except asyncio.CancelledError:
+        backend.breaker.record_cancelled()
+        raise
     except Exception as e:
-        print(f"[INFO] No se pudo usar OpenAI API: {e}")
+        _generation_failed(backend, started, e)
+        return None
+    return _generation_done(backend, started, raw, extract_fn)
+
+def _stop_condition(stop_format, n):
+    """Fábrica de parsers incrementales que marcan la parada al llegar a ``n`` ítems."""
+    if stop_format is None or not EARLY_STOP or not n:
+        return None
+    return lambda: stop_format.stream(limit=n)
 
-    # 4. Fallback (puedes customizar según el caso de uso)
+def query_llm(prompt, extract_fn, n=3, max_new_tokens=256, chat_max_tokens=500, system=DEFAULT_SYSTEM_PROMPT, use_cache=True, stop_format=None, runtime=None):
+    """
+    Genera con el primer backend disponible y devuelve ``extract_fn(texto)``.
+
+    Con ``stop_format`` (un ``llm_parsers.LineFormat``) la generación se hace
+    en streaming y se corta en cuanto se reconocen ``n`` ítems. ``runtime``
+    elige el backend local (ver LOCAL_RUNTIMES).
+    """
+    backends, keys = _cache_plan(prompt, extract_fn, n, max_new_tokens, chat_max_tokens, system, runtime)
+    stop = _stop_condition(stop_format, n)
+    use_cache = use_cache and CACHE_ENABLED
+    if use_cache:
+        cached = response_cache.get_first(keys)
+        if cached is not None:
+            return cached
+
+    for backend, key in zip(backends, keys):
+        if not backend.breaker.allow():
+            continue
+        results = _attempt(backend, prompt, extract_fn, max_new_tokens, chat_max_tokens, system, stop)
+        if results:
+            if use_cache:
+                response_cache.set(key, results)
+            return results
+
+    # Fallback (puedes customizar según el caso de uso)
     return extract_fn("")  # O resultados hardcodeados si quieres
 
+async def _dispatch(candidates, run, policy):
+    """
+    Ejecuta ``run(backend)`` según la política y devuelve el primer
+    resultado válido junto con su clave de caché. Las tareas que siguen
+    pendientes al terminar se cancelan.
+    """
+    waiting = list(candidates)
+    pending = {}
+    last = None
+
+    def launch():
+        nonlocal last
+        while waiting:
+            backend, key = waiting.pop(0)
+            # Circuito abierto: se salta sin esperar a que falle
+            if backend.breaker.allow():
+                last = backend
+                pending[asyncio.ensure_future(run(backend))] = key
+                return
+
+    try:
+        while waiting or pending:
+            if waiting and (not pending or policy == "race"):
+                launch()
+                continue
+            timeout = last.hedge_delay() if policy == "hedge" and waiting else None
+            done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                # Hedge: el backend actual va lento, arranca el siguiente sin cancelarlo
+                launch()
+                continue
+            for task in done:
+                key = pending.pop(task)
+                results = task.result()
+                if results:
+                    return results, key
+        return None, None
+    finally:
+        for task in pending:
+            task.cancel()
+
+async def query_llm_async(prompt, extract_fn, n=3, max_new_tokens=256, chat_max_tokens=500, system=DEFAULT_SYSTEM_PROMPT, use_cache=True, policy=None, stop_format=None, runtime=None):
+    """Versión no bloqueante de ``query_llm`` con política de despacho configurable."""
+    backends, keys = _cache_plan(prompt, extract_fn, n, max_new_tokens, chat_max_tokens, system, runtime)
+    stop = _stop_condition(stop_format, n)
+    use_cache = use_cache and CACHE_ENABLED
+    if use_cache:
+        cached = response_cache.get_first(keys)
+        if cached is not None:
+            return cached
+
+    async def run(backend):
+        return await _attempt_async(backend, prompt, extract_fn, max_new_tokens, chat_max_tokens, system, stop)
+
+    results, key = await _dispatch(zip(backends, keys), run, policy or DISPATCH_POLICY)
+    if results:
+        if use_cache:
+            response_cache.set(key, results)
+        return results
+    return extract_fn("")
+
+async def stream_llm_async(prompt, max_new_tokens=256, chat_max_tokens=500, system=DEFAULT_SYSTEM_PROMPT, runtime=None):
+    """
+    Emite los fragmentos de texto del primer backend que logre generar.
+
+    Si un backend falla antes de su primer fragmento se pasa al siguiente;
+    una vez que empezó a emitir ya no se puede cambiar de backend.
+    """
+    for backend in _backends_for(runtime):
+        if not backend.available() or not backend.breaker.allow():
+            continue
+        started = time.perf_counter()
+        emitted = False
+        try:
+            async for chunk in backend.astream(prompt, max_new_tokens, chat_max_tokens, system):
+                emitted = True
+                yield chunk
+        except asyncio.CancelledError:
+            backend.breaker.record_cancelled()
+            raise
+        except Exception as e:
+            backend.breaker.record_failure()
+            print(f"[INFO] No se pudo usar backend {backend.name} en streaming: {e}")
+            if emitted:
+                return
+            continue
+        backend.record_latency(time.perf_counter() - started)
+        backend.breaker.record_success()
+        if emitted:
+            return
+
+def iter_sync(chunks):
+    """Consume un generador asíncrono desde código síncrono (CLI) con un loop propio."""
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(chunks.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        loop.run_until_complete(chunks.aclose())
+        loop.run_until_complete(aclose_backends())
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
+
 def build_context_prompt(data: dict) -> str:
     context = []
     if data.get("carrera"):
@@ -75,84 +1008,190 @@ def build_context_prompt(data: dict) -> str:
     return "\n".join(context)
 
 
-def infer_objectives(req, n=4):
+def _endpoint_params(name, max_new_tokens, chat_max_tokens):
+    """
+    Presupuesto de tokens y runtime local de un endpoint, ajustables con
+    LLM_<NAME>_MAX_NEW_TOKENS, LLM_<NAME>_CHAT_MAX_TOKENS y LLM_<NAME>_RUNTIME.
+    """
+    prefix = f"LLM_{name.upper()}_"
+    return {
+        "max_new_tokens": int(os.getenv(prefix + "MAX_NEW_TOKENS", str(max_new_tokens))),
+        "chat_max_tokens": int(os.getenv(prefix + "CHAT_MAX_TOKENS", str(chat_max_tokens))),
+        "runtime": os.getenv(prefix + "RUNTIME", LOCAL_RUNTIME),
+    }
+
+ENDPOINT_PARAMS = {
+    "objectives": _endpoint_params("objectives", 160, 300),
+    "activity": _endpoint_params("activity", 256, 500),
+    "prework": _endpoint_params("prework", 220, 400),
+    "rubric": _endpoint_params("rubric", 180, 350),
+    # Una sola generación con las cuatro secciones: la suma de los presupuestos anteriores
+    "suggest": _endpoint_params("suggest", 816, 1550),
+}
+OBJECTIVES_PARAMS = ENDPOINT_PARAMS["objectives"]
+ACTIVITY_PARAMS = ENDPOINT_PARAMS["activity"]
+PREWORK_PARAMS = ENDPOINT_PARAMS["prework"]
+
+@metrics.timed("prompt_build")
+def _objectives_prompt(req, n, structured=JSON_MODE):
     data = req.dict() if hasattr(req, 'dict') else req
     context = build_context_prompt(data)
-    prompt = (
+    return (
         f"{context}\n\n"
         f"Redacta {n} objetivos de aprendizaje claros, observables y medibles para una actividad titulada '{data['activity_title']}' "
         f"con esta descripción: '{data['activity_description']}'. Usa frases cortas y verbos de la taxonomía de Bloom."
         "Devuélvelos como una lista numerada."
-    )
-    return query_llm(prompt, _extract_objectives, n)
+    ) + (json_hint("objectives") if structured else "")
 
-def infer_activity(req, strategy_id=None):
+def infer_objectives(req, n=4, use_cache=True):
+    prompt = _objectives_prompt(req, n)
+    return query_llm(prompt, _extract_objectives, n, use_cache=use_cache, stop_format=OBJECTIVES, **OBJECTIVES_PARAMS)
+
+async def ainfer_objectives(req, n=4, use_cache=True):
+    prompt = _objectives_prompt(req, n)
+    return await query_llm_async(prompt, _extract_objectives, n, use_cache=use_cache, stop_format=OBJECTIVES, **OBJECTIVES_PARAMS)
+
+@metrics.timed("prompt_build")
+def _activity_prompt(req, strategy_id):
     data = req.dict() if hasattr(req, 'dict') else req
     context = build_context_prompt(data)
     strategy = strategy_id or data.get("strategy_id", "")
-    prompt = (
+    return (
         f"{context}\n\n"
         f"Como experto en didáctica universitaria, diseña una actividad principal para la estrategia pedagógica '{strategy}'. "
         f"La actividad debe estar alineada con el título '{data['activity_title']}' y la descripción: '{data['activity_description']}'. "
         "Incluye pasos claros y concretos para estudiantes y docente, y especifica materiales si aplica."
     )
+
+def infer_activity(req, strategy_id=None, use_cache=True):
     # Para una sola actividad, retorna la primera de la lista
-    result = query_llm(prompt, _extract_objectives, 1)
+    prompt = _activity_prompt(req, strategy_id)
+    result = query_llm(prompt, _extract_activity, 1, use_cache=use_cache, stop_format=OBJECTIVES, **ACTIVITY_PARAMS)
     return result[0] if result else ""
 
-def suggest_prework_resources(req, n=3):
+async def ainfer_activity(req, strategy_id=None, use_cache=True):
+    prompt = _activity_prompt(req, strategy_id)
+    result = await query_llm_async(prompt, _extract_activity, 1, use_cache=use_cache, stop_format=OBJECTIVES, **ACTIVITY_PARAMS)
+    return result[0] if result else ""
+
+def stream_activity(req, strategy_id=None):
+    return stream_llm_async(_activity_prompt(req, strategy_id), **ACTIVITY_PARAMS)
+
+def extract_activity(text):
+    result = parse_objectives(text, limit=1)
+    return result[0] if result else ""
+
+@metrics.timed("prompt_build")
+def _prework_prompt(req, n, structured=JSON_MODE):
     data = req.dict() if hasattr(req, 'dict') else req
     context = build_context_prompt(data)
-    prompt = (
+    return (
         f"{context}\n\n"
         f"Sugiere {n} recursos de prework (artículos, videos, podcast, libros o cursos online) para una clase sobre '{data['activity_title']}'.\n"
         "Por cada recurso, incluye:\n"
         "- Título\n- Tipo (paper, video, curso, podcast, libro)\n- URL\n- Breve descripción (1 frase)\n"
         "Devuélvelos como una lista estructurada."
-    )
-    return query_llm(prompt, extract_resources, n)
+    ) + (json_hint("resources") if structured else "")
+
+def suggest_prework_resources(req, n=3, use_cache=True):
+    prompt = _prework_prompt(req, n)
+    return query_llm(prompt, extract_resources, n, use_cache=use_cache, stop_format=RESOURCES, **PREWORK_PARAMS)
+
+async def asuggest_prework_resources(req, n=3, use_cache=True):
+    prompt = _prework_prompt(req, n)
+    return await query_llm_async(prompt, extract_resources, n, use_cache=use_cache, stop_format=RESOURCES, **PREWORK_PARAMS)
+
+RUBRIC_PARAMS = {
+    **ENDPOINT_PARAMS["rubric"],
+    "system": "Eres un experto en pedagogía universitaria.",
+}
+
+@metrics.timed("prompt_build")
+def _rubric_prompt(activity_title, activity_description, objectives, structured=JSON_MODE):
+    return (
+        f"Genera una rúbrica de evaluación de 3 niveles para una actividad universitaria titulada '{activity_title}' "
+        f"con esta descripción: '{activity_description}'. "
+        f"Los objetivos de aprendizaje son: {', '.join(objectives)}.\n\n"
+        "Sigue este formato:\n"
+        "Nivel 1 (Aprueba): ...\n"
+        "Nivel 2 (Destacado): ...\n"
+        "Nivel 3 (Excelente): ...\n\n"
+        "Sé claro, conciso y específico para cada nivel."
+    ) + (json_hint("rubric") if structured else "")
+
+def suggest_rubric(activity_title, activity_description, objectives, use_cache=True):
+    prompt = _rubric_prompt(activity_title, activity_description, objectives)
+    return query_llm(prompt, extract_rubric, 1, use_cache=use_cache, **RUBRIC_PARAMS)
+
+async def asuggest_rubric(activity_title, activity_description, objectives, use_cache=True):
+    prompt = _rubric_prompt(activity_title, activity_description, objectives)
+    return await query_llm_async(prompt, extract_rubric, 1, use_cache=use_cache, **RUBRIC_PARAMS)
+
+def stream_rubric(activity_title, activity_description, objectives):
+    # El streaming se muestra tal cual al usuario: siempre en texto, nunca JSON
+    prompt = _rubric_prompt(activity_title, activity_description, objectives, structured=False)
+    return stream_llm_async(prompt, **RUBRIC_PARAMS)
+
+def extract_rubric(text):
+    return parse_rubric(text)
+
+SUGGEST_PARAMS = {**ENDPOINT_PARAMS["suggest"], "system": RUBRIC_PARAMS["system"]}
+SUGGEST_OBJECTIVES = 4
+SUGGEST_RESOURCES = 3
+
+@metrics.timed("prompt_build")
+def _suggest_prompt(req, structured=JSON_MODE):
+    data = req.dict() if hasattr(req, 'dict') else req
+    context = build_context_prompt(data)
+    strategy = data.get("strategy_id", "")
+    return (
+        f"{context}\n\n"
+        f"Para una actividad universitaria titulada '{data['activity_title']}' con esta descripción: "
+        f"'{data['activity_description']}' (estrategia pedagógica '{strategy}'), responde con estas cuatro secciones, "
+        "cada una con su encabezado:\n\n"
+        f"### Objetivos\n{SUGGEST_OBJECTIVES} objetivos de aprendizaje claros, observables y medibles, como lista numerada "
+        "con verbos de la taxonomía de Bloom.\n\n"
+        "### Actividad\nLa actividad principal en un solo ítem, con pasos claros para estudiantes y docente.\n\n"
+        f"### Recursos\n{SUGGEST_RESOURCES} recursos de prework, uno por línea con el formato "
+        "\"- Título [paper|video|curso|podcast|libro] (URL): descripción breve\".\n\n"
+        "### Rúbrica\nRúbrica de 3 niveles alineada con los objetivos anteriores:\n"
+        "Nivel 1 (Aprueba): ...\nNivel 2 (Destacado): ...\nNivel 3 (Excelente): ..."
+    ) + (json_hint("suggest") if structured else "")
+
+def extract_suggestion(text):
+    """Secciones de la sugerencia combinada; ``{}`` si no se reconoce ninguna."""
+    sections = parse_suggestion(text, SUGGEST_OBJECTIVES, SUGGEST_RESOURCES)
+    if not useful_objectives(sections["objectives"]):
+        sections["objectives"] = []
+    if not useful_activity(sections["activity"]):
+        sections["activity"] = ""
+    return sections if any(sections.values()) else {}
+
+def suggest_all(req, use_cache=True):
+    """
+    Objetivos, actividad, recursos y rúbrica en una sola generación: el
+    contexto del curso se procesa una vez en vez de una por endpoint. Las
+    secciones que no se reconozcan quedan vacías.
+    """
+    return query_llm(_suggest_prompt(req), extract_suggestion, 1, use_cache=use_cache, **SUGGEST_PARAMS)
+
+async def asuggest_all(req, use_cache=True):
+    return await query_llm_async(_suggest_prompt(req), extract_suggestion, 1, use_cache=use_cache, **SUGGEST_PARAMS)
 
 def extract_resources(text):
     """
-    Extrae recursos estructurados del output del LLM.
-    Soporta outputs tipo markdown, lista numerada, o bloques.
+    Extrae recursos estructurados del output del LLM (lista
+    "- Título [tipo] (url): resumen" o JSON).
     """
-    resources = []
-    # Busca líneas tipo "- [Título](url) [tipo]: desc"
-    # O líneas separadas por atributos
-    pattern = re.compile(
-        r"-\s*(?P<title>.+?)\s*\[(?P<type>paper|video|curso|mooc|podcast|libro)\]\s*\((?P<url>https?://[^\s)]+)\)\s*[:-]\s*(?P<desc>.+)",
-        re.IGNORECASE
-    )
-    for line in text.split('\n'):
-        match = pattern.match(line)
-        if match:
-            resources.append({
-                "title": match.group("title"),
-                "type": match.group("type"),
-                "url": match.group("url"),
-                "description": match.group("desc")
-            })
-    # Fallback: busca por secciones básicas si no matchea nada
-    if not resources:
-        resources = [
-            {"title": "Artículo ejemplo", "type": "paper", "url": "https://ejemplo.org", "description": "Un recurso de muestra."}
-            for _ in range(3)
-        ]
-    return resources
+    # Sin recursos reconocibles devuelve []: se prueba el siguiente backend y el endpoint usa su fallback
+    return parse_resources(text)
 
+# Los extractores devuelven un resultado vacío si la salida no sirve: así no se
+# cachea y query_llm pasa al siguiente backend en vez de darla por buena.
 def _extract_objectives(text):
-    objectives = []
-    for line in text.split('\n'):
-        line = line.strip()
-        if not line:
-            continue
-        # Puede venir como "1. xxx" o "- xxx"
-        if line[0].isdigit() and "." in line:
-            obj = line.split(".", 1)[1].strip()
-            objectives.append(obj)
-        elif line.startswith("-") or line.startswith("•"):
-            objectives.append(line[1:].strip())
-    if not objectives and text:
-        objectives = [l.strip("-• ") for l in text.split('\n') if l.strip()]
-    return objectives
\ No newline at end of file
+    objectives = parse_objectives(text)
+    return objectives if useful_objectives(objectives) else []
+
+def _extract_activity(text):
+    activity = parse_objectives(text, limit=1)
+    return activity if activity and useful_activity(activity[0]) else []
@@ -0,0 +1,230 @@
+"""
+Métricas estilo Prometheus y tracing por etapa, sin dependencias externas.
+
+Los contadores e histogramas viven en memoria del proceso y se exponen en
+formato de texto Prometheus desde ``GET /metrics``. Si ``opentelemetry``
+está instalado, cada etapa abre además un span compatible con OTel.
+"""
+import functools
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+try:
+    from opentelemetry import trace as _otel_trace
+    _tracer = _otel_trace.get_tracer("pedagogy-radar")
+except ImportError:
+    _tracer = None
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, child in sorted(self._children.items()):
+            lines.extend(self._render_child(key, child))
+        return lines
+
+
+class _CounterValue:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterValue()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def _render_child(self, key, child):
+        yield f"{self.name}{_format_labels(self.labelnames, key)} {child.value}"
+
+
+class _HistogramValue:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.sum += value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def _render_child(self, key, child):
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(float(bound))
+            yield f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', le)])} {cumulative}"
+        yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {child.sum}"
+        yield f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}"
+
+
+class Gauge(_Metric):
+    """Gauge calculado al exportar: ``collect()`` devuelve ``{labels_tuple: valor}``."""
+    kind = "gauge"
+
+    def __init__(self, name, help, labelnames=(), collect=None):
+        super().__init__(name, help, labelnames)
+        self.collect = collect or (lambda: {})
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in sorted(self.collect().items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+_registry = []
+_registry_lock = threading.Lock()
+
+def register(metric):
+    with _registry_lock:
+        _registry.append(metric)
+    return metric
+
+def counter(name, help, labelnames=()):
+    return register(Counter(name, help, labelnames))
+
+def histogram(name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return register(Histogram(name, help, labelnames, buckets))
+
+def gauge(name, help, labelnames=(), collect=None):
+    return register(Gauge(name, help, labelnames, collect))
+
+def render_prometheus():
+    with _registry_lock:
+        metrics = list(_registry)
+    return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+
+# -------- Métricas del pipeline --------
+
+HTTP_REQUEST_SECONDS = histogram(
+    "pedagogy_http_request_duration_seconds", "Duración de las peticiones HTTP por endpoint.",
+    ("method", "endpoint", "status"),
+)
+STAGE_SECONDS = histogram(
+    "pedagogy_stage_duration_seconds",
+    "Duración por etapa (catalog_load, template_render, prompt_build, model_load, generation, extraction).",
+    ("stage", "backend"),
+)
+LLM_GENERATION_SECONDS = histogram(
+    "pedagogy_llm_generation_seconds", "Duración de cada intento de generación por backend.",
+    ("backend", "outcome"),
+)
+LLM_FALLBACKS = counter(
+    "pedagogy_llm_fallback_total", "Intentos de backend fallidos o vacíos que pasan al siguiente.",
+    ("backend", "reason"),
+)
+LLM_EARLY_STOPS = counter(
+    "pedagogy_llm_early_stop_total", "Generaciones cortadas al reconocer los n ítems pedidos.", ("backend",),
+)
+LLM_CACHE_LOOKUPS = counter(
+    "pedagogy_llm_cache_lookups_total", "Consultas a la caché de respuestas LLM.", ("result",),
+)
+RENDER_CACHE_LOOKUPS = counter(
+    "pedagogy_render_cache_lookups_total", "Consultas a la caché de scaffolds renderizados.", ("result",),
+)
+HARDCODED_DEFAULTS = counter(
+    "pedagogy_hardcoded_default_total", "Respuestas servidas con el contenido por defecto.", ("endpoint",),
+)
+SUGGEST_SECTIONS = counter(
+    "pedagogy_suggest_sections_total",
+    "Secciones de /suggest por origen: la generación combinada o el endpoint individual.", ("section", "source"),
+)
+ADMISSION_REJECTIONS = counter(
+    "pedagogy_admission_rejections_total",
+    "Peticiones no admitidas por endpoint y motivo (quota, queue_full, timeout, saturated, shed).",
+    ("endpoint", "reason"),
+)
+ADMISSION_WAIT_SECONDS = histogram(
+    "pedagogy_admission_wait_seconds", "Espera en la cola de admisión antes de empezar a generar.", ("endpoint",),
+)
+
+LLM_BATCH_SIZE = histogram(
+    "pedagogy_llm_batch_size", "Tamaño de los batches del modelo local.", (),
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+LLM_BATCH_QUEUE_WAIT_SECONDS = histogram(
+    "pedagogy_llm_batch_queue_wait_seconds", "Espera en cola antes de entrar a un batch.",
+)
+
+
+@contextmanager
+def stage(name, backend="", **attributes):
+    """Mide una etapa del pipeline y, si hay OpenTelemetry, la envuelve en un span."""
+    started = time.perf_counter()
+    if _tracer is None:
+        try:
+            yield
+        finally:
+            STAGE_SECONDS.labels(stage=name, backend=backend).observe(time.perf_counter() - started)
+        return
+    with _tracer.start_as_current_span(name, attributes={"backend": backend, **attributes}):
+        try:
+            yield
+        finally:
+            STAGE_SECONDS.labels(stage=name, backend=backend).observe(time.perf_counter() - started)
+
+def timed(name):
+    """Decorador equivalente a ``with stage(name)`` para funciones síncronas."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
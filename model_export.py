@@ -0,0 +1,104 @@
+"""
+Exportación y verificación offline de los modelos locales.
+
+``export_onnx`` convierte el modelo de transformers a ONNX (opcionalmente
+cuantizado a int8) para ``LLM_LOCAL_RUNTIME=onnx``. ``verify`` compara un
+runtime contra el pipeline fp32 de referencia con los prompts reales de la
+app: coincidencia de salidas, latencia y memoria. Los GGUF se generan con
+``convert_hf_to_gguf.py`` de llama.cpp y se verifican igual.
+"""
+import resource
+import time
+from pathlib import Path
+
+import llm_utils
+
+SAMPLE_BRIEF = {
+    "carrera": "Ingeniería en Sistemas",
+    "semestre": "4",
+    "materia": "Algoritmos",
+    "tema": "Grafos",
+    "strategy_id": "flipped",
+    "activity_title": "Recorridos en grafos",
+    "activity_description": "Implementar y comparar BFS y DFS sobre grafos reales.",
+}
+
+
+def sample_prompts():
+    return [
+        llm_utils._objectives_prompt(SAMPLE_BRIEF, 4, structured=False),
+        llm_utils._activity_prompt(SAMPLE_BRIEF, None),
+        llm_utils._rubric_prompt(SAMPLE_BRIEF["activity_title"], SAMPLE_BRIEF["activity_description"], ["Analizar BFS"], structured=False),
+    ]
+
+
+def export_onnx(model, out, quantize=False):
+    """Exporta ``model`` a ONNX en ``out``; con ``quantize`` agrega versiones int8 dinámicas."""
+    from optimum.onnxruntime import ORTModelForCausalLM, ORTModelForSeq2SeqLM, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from transformers import AutoConfig, AutoTokenizer
+
+    out = Path(out)
+    cls = ORTModelForSeq2SeqLM if AutoConfig.from_pretrained(model).is_encoder_decoder else ORTModelForCausalLM
+    cls.from_pretrained(model, export=True).save_pretrained(out)
+    AutoTokenizer.from_pretrained(model).save_pretrained(out)
+    if quantize:
+        config = AutoQuantizationConfig.avx2(is_static=False, per_channel=False)
+        for onnx_file in sorted(out.glob("*.onnx")):
+            if onnx_file.stem.endswith("_quantized"):
+                continue
+            ORTQuantizer.from_pretrained(out, file_name=onnx_file.name).quantize(save_dir=out, quantization_config=config)
+    return sorted(f.name for f in out.glob("*.onnx"))
+
+
+def rss_mb():
+    """Memoria residente actual del proceso (o el pico, si no hay /proc)."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize() / 2**20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _run(backend, prompts, max_new_tokens):
+    before = rss_mb()
+    started = time.perf_counter()
+    backend.load()
+    load_s = time.perf_counter() - started
+    outputs, latencies = [], []
+    for prompt in prompts:
+        started = time.perf_counter()
+        outputs.append(backend.generate(prompt, max_new_tokens).strip())
+        latencies.append(time.perf_counter() - started)
+    return {
+        "runtime": backend.runtime,
+        "model": backend.model,
+        "load_s": load_s,
+        "latency_ms": [1000 * latency for latency in latencies],
+        "rss_growth_mb": rss_mb() - before,
+        "outputs": outputs,
+    }
+
+
+def _overlap(a, b):
+    words_a, words_b = set(a.lower().split()), set(b.lower().split())
+    return len(words_a & words_b) / len(words_a | words_b) if words_a | words_b else 1.0
+
+
+def verify(runtime, model=None, max_new_tokens=64, reference_model=llm_utils.LOCAL_MODEL):
+    """
+    Genera los prompts de muestra con ``runtime`` y con el pipeline fp32.
+
+    Devuelve ambos resultados y, por prompt, si la salida es idéntica y el
+    solapamiento de palabras (las versiones cuantizadas rara vez coinciden
+    token a token, pero no deberían alejarse mucho).
+    """
+    cls, default_model = llm_utils.LOCAL_RUNTIMES[runtime]
+    prompts = sample_prompts()
+    candidate = _run(cls(model or default_model, max_batch_size=1), prompts, max_new_tokens)
+    reference = _run(llm_utils.LocalBackend(reference_model, max_batch_size=1), prompts, max_new_tokens)
+    comparisons = [
+        {"identical": a == b, "overlap": _overlap(a, b)}
+        for a, b in zip(candidate["outputs"], reference["outputs"])
+    ]
+    return {"candidate": candidate, "reference": reference, "comparisons": comparisons}
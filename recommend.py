@@ -0,0 +1,214 @@
+"""
+Recomendación de estrategias a partir de la descripción de una actividad.
+
+Cada estrategia se indexa con su descripción, taxonomías, métricas NSM,
+evidencias y notas de implementación. El índice léxico (BM25 o TF-IDF) se
+construye al cargar el catálogo y, cuando el YAML cambia, se reconstruye
+reutilizando los documentos de las estrategias que no cambiaron. Con
+``PEDAGOGY_RADAR_EMBEDDING_MODEL`` (sentence-transformers) también se puede
+rankear por similitud de embeddings. Ningún método llama al modelo generativo.
+"""
+import hashlib
+import math
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter
+
+import metrics
+from core import get_catalog
+
+RECOMMEND_METHOD = os.getenv("PEDAGOGY_RADAR_RECOMMEND_METHOD", "bm25")
+# p. ej. sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2 (vacío = sin embeddings)
+EMBEDDING_MODEL = os.getenv("PEDAGOGY_RADAR_EMBEDDING_MODEL", "")
+METHODS = ("bm25", "tfidf", "embeddings")
+# Tope de top_k que aceptan los endpoints de recomendación y de alineación
+MAX_TOP_K = int(os.getenv("PEDAGOGY_RADAR_MAX_TOP_K", "50"))
+BM25_K1 = 1.5
+BM25_B = 0.75
+# Stemming por truncado: "colaborativo" y "colaboración" comparten "colabo"
+STEM_LENGTH = 6
+
+STOPWORDS = frozenset(
+    "a al ante con contra de del desde durante e el en entre es esta este esto hacia hasta la las lo los mas "
+    "o para pero por que se sin sobre su sus tras un una uno unos unas y the and of for to in on with".split()
+)
+# Los niveles de Bloom del catálogo están en inglés; las actividades suelen venir en español
+BLOOM_ES = {
+    "Remember": "recordar memorizar",
+    "Understand": "comprender explicar",
+    "Apply": "aplicar resolver",
+    "Analyze": "analizar comparar",
+    "Evaluate": "evaluar argumentar",
+    "Create": "crear diseñar",
+}
+_WORD = re.compile(r"\w+")
+
+
+def _fold(text):
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+def tokenize(text):
+    return [word[:STEM_LENGTH] for word in _WORD.findall(_fold(text)) if len(word) > 2 and word not in STOPWORDS]
+
+def _digest(text):
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+def strategy_text(strategy):
+    parts = [strategy.display_name, strategy.description, strategy.implementation_notes]
+    for entry in strategy.taxonomies:
+        for taxonomy, levels in entry.items():
+            parts.append(taxonomy)
+            for level in levels or []:
+                parts.append(str(level))
+                if taxonomy == "bloom":
+                    parts.append(BLOOM_ES.get(level, ""))
+    parts.extend(metric.get("display_name", metric.get("id", "")) for metric in strategy.nsm_metrics)
+    parts.extend(str(evidence).replace("_", " ") for evidence in strategy.evidence)
+    return "\n".join(part for part in parts if part)
+
+
+class StrategyIndex:
+    """
+    Índice léxico (BM25 y TF-IDF) sobre un snapshot del catálogo.
+
+    ``previous`` es el índice de la versión anterior: los conteos de términos
+    y los embeddings de los documentos que no cambiaron se reutilizan, y solo
+    se recalculan las estadísticas globales (idf, largo promedio). Los
+    documentos se identifican por un digest del texto, que no se conserva.
+    """
+
+    def __init__(self, snapshot, previous=None):
+        self.version = snapshot.version
+        self.strategies = snapshot.strategies
+        known = previous._terms if previous is not None else {}
+        self.keys = []
+        self._terms = {}
+        self.reused = 0
+        for strategy in self.strategies:
+            text = strategy_text(strategy)
+            key = _digest(text)
+            self.keys.append(key)
+            if key in known:
+                self._terms[key] = known[key]
+                self.reused += 1
+            else:
+                self._terms[key] = Counter(tokenize(text))
+        # Solo se heredan los embeddings de documentos que siguen en el catálogo
+        current = set(self.keys)
+        self._embeddings = {}
+        if previous is not None:
+            with previous._embeddings_lock:
+                self._embeddings = {key: vector for key, vector in previous._embeddings.items() if key in current}
+        self._embeddings_lock = threading.Lock()
+
+        counts = [self._terms[key] for key in self.keys]
+        lengths = [sum(c.values()) for c in counts]
+        self.avg_length = sum(lengths) / len(lengths) if lengths else 0.0
+        df = Counter(term for c in counts for term in c)
+        total = len(counts)
+        self.idf = {term: math.log(1 + (total - n + 0.5) / (n + 0.5)) for term, n in df.items()}
+        # Listas invertidas: término -> [(documento, peso BM25 sin idf)]
+        self.postings = {}
+        for doc, (c, length) in enumerate(zip(counts, lengths)):
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * length / (self.avg_length or 1))
+            for term, tf in c.items():
+                self.postings.setdefault(term, []).append((doc, tf * (BM25_K1 + 1) / (tf + norm)))
+        # Vectores TF-IDF normalizados
+        self.vectors = []
+        for c in counts:
+            vector = {term: (1 + math.log(tf)) * self.idf[term] for term, tf in c.items()}
+            norm = math.sqrt(sum(w * w for w in vector.values())) or 1.0
+            self.vectors.append({term: w / norm for term, w in vector.items()})
+
+    def _bm25(self, terms):
+        scores = [0.0] * len(self.strategies)
+        for term, qtf in Counter(terms).items():
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc, weight in self.postings[term]:
+                scores[doc] += idf * weight * qtf
+        return scores
+
+    def _tfidf(self, terms):
+        query = {term: (1 + math.log(tf)) * self.idf[term] for term, tf in Counter(terms).items() if term in self.idf}
+        norm = math.sqrt(sum(w * w for w in query.values())) or 1.0
+        return [sum(w * vector.get(term, 0.0) for term, w in query.items()) / norm for vector in self.vectors]
+
+    def _embedding_scores(self, text):
+        model = _embedder()
+        with self._embeddings_lock:
+            missing = [doc for doc, key in enumerate(self.keys) if key not in self._embeddings]
+            if missing:
+                texts = [strategy_text(self.strategies[doc]) for doc in missing]
+                for doc, vector in zip(missing, model.encode(texts, normalize_embeddings=True)):
+                    self._embeddings[self.keys[doc]] = [float(x) for x in vector]
+        query = [float(x) for x in model.encode([text], normalize_embeddings=True)[0]]
+        return [sum(a * b for a, b in zip(query, self._embeddings[key])) for key in self.keys]
+
+    def search(self, text, top_k=5, method=RECOMMEND_METHOD):
+        if method not in METHODS:
+            raise ValueError(f"Método desconocido: {method} (usa {', '.join(METHODS)})")
+        terms = tokenize(text)
+        if method == "embeddings":
+            scores = self._embedding_scores(text)
+        elif method == "tfidf":
+            scores = self._tfidf(terms)
+        else:
+            scores = self._bm25(terms)
+        query_terms = set(terms)
+        ranked = sorted(range(len(scores)), key=lambda doc: -scores[doc])[:top_k]
+        return [
+            {
+                "strategy_id": self.strategies[doc].id,
+                "display_name": self.strategies[doc].display_name,
+                "score": round(scores[doc], 4),
+                "matched_terms": sorted(query_terms & self._terms[self.keys[doc]].keys()),
+            }
+            for doc in ranked
+            if scores[doc] > 0
+        ]
+
+
+_embedding_model = None
+_embedding_lock = threading.Lock()
+
+def _embedder():
+    global _embedding_model
+    if not EMBEDDING_MODEL:
+        raise RuntimeError("No hay modelo de embeddings configurado (PEDAGOGY_RADAR_EMBEDDING_MODEL).")
+    if _embedding_model is None:
+        with _embedding_lock:
+            if _embedding_model is None:
+                from sentence_transformers import SentenceTransformer
+                with metrics.stage("model_load", backend="embeddings"):
+                    _embedding_model = SentenceTransformer(EMBEDDING_MODEL, device="cpu")
+    return _embedding_model
+
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_index():
+    """Índice del catálogo actual; se reconstruye (incrementalmente) si cambió la versión."""
+    global _index
+    snapshot = get_catalog().snapshot()
+    index = _index
+    if index is None or index.version != snapshot.version:
+        with _index_lock:
+            index = _index
+            if index is None or index.version != snapshot.version:
+                with metrics.stage("recommend_index"):
+                    index = _index = StrategyIndex(snapshot, previous=index)
+    return index
+
+def brief_text(activity_title="", activity_description="", tema="", materia=""):
+    return "\n".join(part for part in (activity_title, activity_description, tema, materia) if part)
+
+def recommend_strategies(activity_title="", activity_description="", tema="", materia="", top_k=5, method=None):
+    """Estrategias ordenadas por relevancia para la actividad descrita."""
+    text = brief_text(activity_title, activity_description, tema, materia)
+    return get_index().search(text, top_k, method or RECOMMEND_METHOD)
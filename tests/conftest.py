@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# Los módulos viven en la raíz del repo (sin paquete)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# Cachés y colas en un directorio temporal; sin daemon ni caché de respuestas del LLM
+os.environ.setdefault("PEDAGOGY_RADAR_CACHE_DIR", tempfile.mkdtemp(prefix="pedagogy-radar-tests-"))
+os.environ.setdefault("PEDAGOGY_RADAR_DAEMON", "0")
+os.environ.setdefault("LLM_CACHE_DISABLED", "1")
@@ -0,0 +1,115 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+from fastapi.testclient import TestClient
+
+import admission
+from admission import AdmissionMiddleware, Gate, Quotas, Rejected
+
+
+def make_client(mode="queue", fallback=None):
+    app = FastAPI()
+
+    @app.post("/generar")
+    def generar():
+        return {"ok": True}
+
+    @app.get("/libre")
+    def libre():
+        return {"ok": True}
+
+    app.add_middleware(AdmissionMiddleware, paths=("/generar",), fallback=fallback, mode=mode)
+    return TestClient(app)
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    monkeypatch.setattr(admission, "_gates", {})
+    monkeypatch.setattr(admission, "quotas", Quotas(rate=0))
+
+
+def test_gate_queues_fifo_and_rejects_when_full():
+    async def scenario():
+        gate = Gate("g", limit=1, queue=1, wait_s=5)
+        await gate.acquire()
+        waiting = asyncio.create_task(gate.acquire())
+        await asyncio.sleep(0)
+        assert gate.in_flight == 1 and gate.waiting == 1
+        with pytest.raises(Rejected) as rejected:
+            await gate.acquire()
+        assert rejected.value.status == 503 and rejected.value.reason == "queue_full"
+        assert rejected.value.retry_after >= 1
+        # Al liberar, el lugar pasa directo al primero de la cola
+        gate.release(0.5)
+        await waiting
+        assert gate.in_flight == 1 and gate.waiting == 0
+        gate.release()
+        assert gate.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_gate_times_out_and_leaves_the_queue():
+    async def scenario():
+        gate = Gate("g", limit=1, queue=4, wait_s=0.05)
+        await gate.acquire()
+        with pytest.raises(Rejected) as rejected:
+            await gate.acquire()
+        assert rejected.value.reason == "timeout"
+        assert gate.waiting == 0 and gate.in_flight == 1
+
+    asyncio.run(scenario())
+
+
+def test_gate_reject_mode_does_not_queue():
+    async def scenario():
+        gate = Gate("g", limit=1, queue=4)
+        await gate.acquire()
+        with pytest.raises(Rejected) as rejected:
+            await gate.acquire(mode="reject")
+        assert rejected.value.reason == "saturated" and gate.waiting == 0
+
+    asyncio.run(scenario())
+
+
+def test_quotas_token_bucket():
+    quotas = Quotas(rate=10, burst=2)
+    assert quotas.take("a") == 0 and quotas.take("a") == 0
+    wait = quotas.take("a")
+    assert 0 < wait <= 0.1
+    # Cada cliente tiene su propio bucket
+    assert quotas.take("b") == 0
+
+
+def test_middleware_returns_429_with_retry_after(monkeypatch):
+    monkeypatch.setattr(admission, "quotas", Quotas(rate=0.1, burst=1))
+    client = make_client()
+    assert client.post("/generar", headers={"X-API-Key": "k1"}).status_code == 200
+    response = client.post("/generar", headers={"X-API-Key": "k1"})
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    # Otra API key no comparte la cuota, y las rutas fuera de ``paths`` no pasan por la admisión
+    assert client.post("/generar", headers={"X-API-Key": "k2"}).status_code == 200
+    assert client.get("/libre", headers={"X-API-Key": "k1"}).status_code == 200
+
+
+def test_middleware_returns_503_when_saturated():
+    client = make_client()
+    gate = admission._gates["generar"] = Gate("generar", limit=1, queue=0)
+    gate.in_flight = 1
+    response = client.post("/generar")
+    assert response.status_code == 503
+    assert int(response.headers["Retry-After"]) >= 1
+    gate.in_flight = 0
+    assert client.post("/generar").status_code == 200
+    assert gate.in_flight == 0
+
+
+def test_middleware_fallback_mode_serves_default_content():
+    client = make_client(mode="fallback", fallback=lambda name: JSONResponse({"fallback": name}))
+    admission._gates["generar"] = Gate("generar", limit=1, queue=4)
+    admission._gates["generar"].in_flight = 1
+    response = client.post("/generar")
+    assert response.status_code == 200 and response.json() == {"fallback": "generar"}
@@ -0,0 +1,50 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import api
+from core import get_catalog
+
+
+@pytest.fixture(scope="module")
+def client():
+    return TestClient(api.app)
+
+
+@pytest.fixture(scope="module")
+def scaffold_request():
+    strategy = get_catalog().snapshot().strategies[0]
+    return {
+        "strategy_id": strategy.id,
+        "activity_title": "Grafos",
+        "activity_description": "Comparar BFS y DFS en problemas reales",
+        "learning_objectives": [{"text": "Analizar recorridos de grafos", "taxonomy": "Analyze"}],
+    }
+
+
+def test_scaffold_returns_strong_etag(client, scaffold_request):
+    first = client.post("/scaffold", json=scaffold_request)
+    assert first.status_code == 200 and first.json()["markdown"]
+    etag = first.headers["ETag"]
+    assert etag.startswith('"') and etag.endswith('"')
+    assert client.post("/scaffold", json=scaffold_request).headers["ETag"] == etag
+    other = client.post("/scaffold", json={**scaffold_request, "activity_title": "Árboles"})
+    assert other.status_code == 200 and other.headers["ETag"] != etag
+
+
+@pytest.mark.parametrize("if_none_match", ["{etag}", "W/{etag}", '"otro", {etag}', "*"])
+def test_scaffold_if_none_match_returns_304(client, scaffold_request, if_none_match):
+    etag = client.post("/scaffold", json=scaffold_request).headers["ETag"]
+    response = client.post("/scaffold", json=scaffold_request, headers={"If-None-Match": if_none_match.format(etag=etag)})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["ETag"] == etag and response.headers["X-Catalog-Version"]
+
+
+def test_scaffold_stale_etag_renders_again(client, scaffold_request):
+    response = client.post("/scaffold", json=scaffold_request, headers={"If-None-Match": '"viejo"'})
+    assert response.status_code == 200 and response.json()["markdown"]
+
+
+def test_scaffold_unknown_strategy_is_404(client, scaffold_request):
+    response = client.post("/scaffold", json={**scaffold_request, "strategy_id": "no-existe"})
+    assert response.status_code == 404
@@ -0,0 +1,112 @@
+import asyncio
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import jobs
+from jobs import JobQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(tmp_path / "jobs.sqlite3")
+
+
+def expire(queue, job_id):
+    # Simula un worker que dejó de latir hace rato
+    old = time.time() - jobs.JOBS_LEASE_S - 1
+    queue._conn().execute("UPDATE jobs SET started = ?, heartbeat = ? WHERE id = ?", (old, old, job_id))
+
+
+def test_claim_is_fifo_and_exclusive(queue):
+    first = queue.submit("k", {"n": 1})
+    second = queue.submit("k", {"n": 2})
+    assert queue.claim("w1") == (first, "k", {"n": 1})
+    assert queue.claim("w2") == (second, "k", {"n": 2})
+    assert queue.claim("w3") is None
+    assert queue.counts() == {"queued": 0, "running": 2, "done": 0, "error": 0}
+
+
+def test_expired_lease_is_requeued_until_max_attempts(queue):
+    job_id = queue.submit("k", {})
+    for attempt in range(1, jobs.JOBS_MAX_ATTEMPTS + 1):
+        assert queue.claim(f"w{attempt}")[0] == job_id
+        assert queue.get(job_id)["attempts"] == attempt
+        expire(queue, job_id)
+    assert queue.claim("otro") is None
+    job = queue.get(job_id)
+    assert job["status"] == "error" and job["error"] == "Se agotaron los reintentos."
+
+
+def test_heartbeat_keeps_the_lease(queue):
+    job_id = queue.submit("k", {})
+    queue.claim("w1")
+    expire(queue, job_id)
+    assert queue.heartbeat(job_id, "w1")
+    assert queue.claim("w2") is None
+    # Solo el dueño renueva el lease
+    assert not queue.heartbeat(job_id, "w2")
+
+
+def test_complete_is_guarded_by_owner(queue):
+    job_id = queue.submit("k", {})
+    queue.claim("viejo")
+    expire(queue, job_id)
+    assert queue.claim("nuevo")[0] == job_id
+    # El worker que perdió el lease ya no puede renovarlo ni pisar el resultado
+    assert not queue.heartbeat(job_id, "viejo")
+    queue.complete(job_id, {"tarde": True}, "viejo")
+    queue.fail(job_id, "tarde", "viejo")
+    assert queue.get(job_id)["status"] == "running"
+    queue.complete(job_id, {"ok": True}, "nuevo")
+    job = queue.get(job_id)
+    assert job["status"] == "done" and job["result"] == {"ok": True}
+
+
+def test_old_database_gets_heartbeat_column(tmp_path):
+    path = tmp_path / "old.sqlite3"
+    db = sqlite3.connect(path)
+    db.execute(
+        "CREATE TABLE jobs (id TEXT PRIMARY KEY, kind TEXT, payload TEXT, status TEXT, result TEXT, error TEXT,"
+        "attempts INTEGER DEFAULT 0, worker TEXT, created REAL, started REAL, finished REAL)"
+    )
+    db.commit()
+    db.close()
+    queue = JobQueue(path)
+    job_id = queue.submit("k", {})
+    assert queue.claim("w1")[0] == job_id and queue.heartbeat(job_id, "w1")
+
+
+def test_worker_heartbeat_outlives_the_lease(queue, monkeypatch):
+    monkeypatch.setattr(jobs, "JOBS_LEASE_S", 0.3)
+    monkeypatch.setattr(jobs, "JOBS_HEARTBEAT_S", 0.05)
+    monkeypatch.setattr(jobs, "JOBS_POLL_S", 0.01)
+
+    class Payload:
+        def __init__(self, **kwargs):
+            self.kwargs = kwargs
+
+    def slow(request):
+        time.sleep(0.8)
+        return {"eco": request.kwargs}
+
+    job_id = queue.submit("slow", {"x": 1})
+    stolen = []
+
+    async def scenario():
+        worker = asyncio.create_task(jobs._work("w1", queue, {"slow": (Payload, slow)}))
+        while queue.get(job_id)["status"] != "running":
+            await asyncio.sleep(0.01)
+        thief = threading.Thread(target=lambda: [stolen.append(queue.claim("w2")) or time.sleep(0.1) for _ in range(6)])
+        thief.start()
+        while queue.get(job_id)["status"] == "running":
+            await asyncio.sleep(0.02)
+        await asyncio.to_thread(thief.join)
+        worker.cancel()
+
+    asyncio.run(scenario())
+    job = queue.get(job_id)
+    assert job["status"] == "done" and job["result"] == {"eco": {"x": 1}} and job["attempts"] == 1
+    assert not any(stolen)
@@ -0,0 +1,149 @@
+import threading
+import time
+
+import pytest
+
+import llm_utils
+from llm_parsers import OBJECTIVES
+from llm_utils import CircuitBreaker, LocalBackend, MicroBatcher
+
+LINE = "{i}. Analizar el caso número {i} con detalle suficiente\n"
+
+
+class FakePipe:
+    """Pipeline de text-generation que emite una línea numerada por paso."""
+    task = "text-generation"
+    tokenizer = None
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, prompts, max_new_tokens, batch_size, stopping_criteria=None, return_full_text=True):
+        self.calls.append({"prompts": list(prompts), "return_full_text": return_full_text})
+        # Con el _stop_sequences falso, stopping_criteria es la lista de parsers por fila
+        parsers = stopping_criteria or [None] * len(prompts)
+        outputs = []
+        for parser in parsers:
+            text = ""
+            for i in range(1, max_new_tokens + 1):
+                text += LINE.format(i=i)
+                if parser is not None:
+                    parser.feed(LINE.format(i=i))
+                    if parser.done:
+                        break
+            outputs.append([{"generated_text": text + "Evaluar a med"}])
+        return outputs
+
+
+@pytest.fixture
+def local_backend(monkeypatch):
+    monkeypatch.setattr(llm_utils, "_stop_sequences", lambda tokenizer, parsers: parsers)
+    backend = LocalBackend("fake", window_ms=100, max_batch_size=8)
+    backend._pipe = FakePipe()
+    return backend
+
+
+def test_microbatcher_groups_concurrent_prompts():
+    calls = []
+
+    def generate_batch(prompts, max_new_tokens):
+        calls.append((list(prompts), max_new_tokens))
+        return [p.upper() for p in prompts]
+
+    batcher = MicroBatcher(generate_batch, window_ms=100, max_batch_size=8)
+    futures = [batcher.submit(f"p{i}", 16) for i in range(5)] + [batcher.submit("otro", 32)]
+    assert [f.result(timeout=5) for f in futures] == ["P0", "P1", "P2", "P3", "P4", "OTRO"]
+    # Un solo batch, repartido por presupuesto de tokens
+    assert sorted(calls, key=lambda call: call[1]) == [(["p0", "p1", "p2", "p3", "p4"], 16), (["otro"], 32)]
+    assert batcher.stats()["batches"] == 1
+
+
+def test_microbatcher_propagates_errors_and_skips_cancelled():
+    gate = threading.Event()
+    seen = []
+
+    def generate_batch(prompts, max_new_tokens):
+        gate.wait(5)
+        seen.extend(prompts)
+        raise ValueError("boom")
+
+    batcher = MicroBatcher(generate_batch, window_ms=0, max_batch_size=1)
+    first = batcher.submit("primero", 8)
+    cancelled = batcher.submit("cancelado", 8)
+    assert cancelled.cancel()
+    gate.set()
+    with pytest.raises(ValueError):
+        first.result(timeout=5)
+    last = batcher.submit("último", 8)
+    with pytest.raises(ValueError):
+        last.result(timeout=5)
+    assert seen == ["primero", "último"]
+
+
+def test_per_row_stopping_inside_one_batch(local_backend):
+    early_stops = llm_utils.metrics.LLM_EARLY_STOPS.labels(backend=local_backend.name)
+    before = early_stops.value
+    futures = [
+        local_backend.batcher.submit("a", 10, llm_utils._stop_condition(OBJECTIVES, 2)),
+        local_backend.batcher.submit("b", 10, llm_utils._stop_condition(OBJECTIVES, 4)),
+        local_backend.batcher.submit("c", 10),
+    ]
+    texts = [f.result(timeout=5) for f in futures]
+
+    pipe = local_backend._pipe
+    assert len(pipe.calls) == 1 and pipe.calls[0]["prompts"] == ["a", "b", "c"]
+    assert pipe.calls[0]["return_full_text"] is False
+    # Las filas con parada se cortan en su n (sin la línea a medias); la otra genera todo
+    assert texts[0] == LINE.format(i=1) + LINE.format(i=2)
+    assert texts[1].count("\n") == 4 and texts[1].endswith("\n")
+    assert texts[2].count("\n") == 10 and texts[2].endswith("Evaluar a med")
+    assert early_stops.value == before + 2
+
+
+def test_batched_backend_keeps_early_stop_in_query_llm(local_backend, monkeypatch):
+    monkeypatch.setattr(llm_utils, "_backends_for", lambda runtime=None: [local_backend])
+    objectives = llm_utils.query_llm(
+        "prompt", OBJECTIVES.parse, n=3, max_new_tokens=20, use_cache=False, stop_format=OBJECTIVES,
+    )
+    assert len(objectives) == 3
+    assert local_backend.batcher.stats()["batches"] == 1
+
+
+def test_stop_sequences_marks_rows_independently():
+    torch = pytest.importorskip("torch")
+    pytest.importorskip("transformers")
+
+    class Tokenizer:
+        def decode(self, ids, skip_special_tokens=True):
+            return "".join(LINE.format(i=int(i)) for i in ids)
+
+    parsers = [OBJECTIVES.stream(limit=1), OBJECTIVES.stream(limit=2), None]
+    criteria = llm_utils._stop_sequences(Tokenizer(), parsers)
+    prompt = torch.zeros((3, 4), dtype=torch.long)
+    done = criteria[0](torch.cat([prompt, torch.tensor([[1], [1], [1]])], dim=1), None)
+    assert done.tolist() == [True, False, False]
+    done = criteria[0](torch.cat([prompt, torch.tensor([[1, 2], [1, 2], [1, 2]])], dim=1), None)
+    assert done.tolist() == [True, True, False]
+
+
+def test_circuit_breaker_transitions():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    assert breaker.state == "closed" and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.state == "half-open"
+    # Una sola petición de prueba a la vez
+    assert breaker.allow() and not breaker.allow()
+    breaker.record_cancelled()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow() and breaker.allow()